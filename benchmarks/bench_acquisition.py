@@ -0,0 +1,218 @@
+"""
+End-to-end acquisition throughput benchmark on the Micro-Manager demo camera (no hardware needed).
+
+Runs the pump + writer pipeline against pymmcore_plus's demo configuration for every combination of frame
+size, frame count, hand-off queue (queue.Queue, collections.deque, FrameRingBuffer) and writer backend, each
+in a fresh process so that peak memory is measured per configuration. Sustained fps, dropped frames, circular
+buffer overflow, peak RSS and disk MB/s are written to JSON; --compare flags regressions against an earlier run.
+The demo configuration must be installed (`mmcore install`).
+
+    python benchmarks/bench_acquisition.py --sizes 512 1024 --frames 2000 --output bench.json
+    python benchmarks/bench_acquisition.py --output new.json --compare bench.json
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUEUE_TYPES = ('queue', 'deque', 'ring')
+CONFIG_KEYS = ('size', 'frames', 'queue', 'backend')
+
+
+class DequeQueue:
+    """collections.deque polled like deque-threaded_acquisition.py, with the queue.Queue calls FrameSavingThread uses"""
+
+    def __init__(self):
+        self._frames = collections.deque()
+
+    def put(self, frame):
+        self._frames.append(frame)
+
+    def get(self, timeout=None):
+        deadline = time.perf_counter() + (timeout or 0)
+        while True:
+            try:
+                return self._frames.popleft()
+            except IndexError:
+                if time.perf_counter() >= deadline:
+                    raise queue.Empty
+                time.sleep(0.001)
+
+    def task_done(self):
+        pass
+
+    def qsize(self):
+        return len(self._frames)
+
+    def empty(self):
+        return not self._frames
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None if it cannot be measured)"""
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_config(params):
+    """Acquire one configuration on the demo camera and return its measurements"""
+    from pymmcore_plus import CMMCorePlus
+
+    from pylab.buffers import FrameRingBuffer
+    from pylab.metadata import FrameMetadataBuffer
+    from pylab.pump import FramePump
+    from pylab.telemetry import AcquisitionMonitor
+    from pylab.writers import STACK_EXTENSIONS, FrameSavingThread
+
+    mmc = CMMCorePlus()
+    mmc.loadSystemConfiguration() # demo configuration
+    mmc.setProperty('Camera', 'OnCameraCCDXSize', params['size'])
+    mmc.setProperty('Camera', 'OnCameraCCDYSize', params['size'])
+    mmc.setExposure(params['exposure_ms'])
+    mmc.setCircularBufferMemoryFootprint(params['circular_buffer_mb'])
+
+    if params['queue'] == 'ring':
+        frame_queue = FrameRingBuffer.for_core(mmc, params['ring_buffer_mb'] * 1024**2, params['frames'])
+    elif params['queue'] == 'deque':
+        frame_queue = DequeQueue()
+    else:
+        frame_queue = queue.Queue()
+
+    directory = tempfile.mkdtemp(dir=params['directory'])
+    try:
+        filename = os.path.join(directory, 'stack' + STACK_EXTENSIONS[params['backend']])
+        metadata = FrameMetadataBuffer(os.path.join(directory, 'frame_metadata.npy'), params['frames'])
+        stop_event = threading.Event()
+        writer = FrameSavingThread(frame_queue, stop_event, filename, params['frames'], backend=params['backend'],
+                                   metadata=metadata)
+        pump = FramePump(mmc, frame_queue.put, params['frames'], stop_event=stop_event, metadata=metadata)
+        monitor = AcquisitionMonitor(mmc, frame_queue, pump, writer, interval=0.5)
+
+        writer.start()
+        mmc.startContinuousSequenceAcquisition(0)
+        monitor.start()
+        pump.run()
+        mmc.stopSequenceAcquisition()
+        stop_event.set()
+        writer.join()
+        metadata.close()
+        monitor.stop()
+        report = monitor.report(params['frames'], metadata.columns['image_number'][:metadata.count])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        **params,
+        'fps': report['pump'].get('fps', 0.0),
+        'frames_written': report['frames_written'],
+        'dropped_frames': report['dropped_frames'],
+        'no_dropped_frames': report['no_dropped_frames'],
+        'circular_buffer_overflowed': report['circular_buffer_overflowed'],
+        'circular_buffer_peak_fill': report['circular_buffer_peak_fill'],
+        'queue_peak_depth': report['queue_peak_depth'],
+        'pump_latency_p99_ms': report['pump'].get('latency_p99_ms'),
+        'disk_mb_per_s': report['writer']['mb_per_s'],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_in_subprocess(params):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', json.dumps(params)],
+                            capture_output=True, text=True, env=env)
+    if result.returncode:
+        return {**params, 'error': result.stderr.strip().splitlines()[-1:]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, previous_filename, tolerance):
+    """Print fps and dropped-frame changes against an earlier run; returns the number of regressions"""
+    with open(previous_filename) as fh:
+        previous = {tuple(r[key] for key in CONFIG_KEYS): r for r in json.load(fh)['results'] if 'error' not in r}
+    regressions = 0
+    for result in results:
+        before = previous.get(tuple(result[key] for key in CONFIG_KEYS))
+        if before is None or 'error' in result:
+            continue
+        ratio = result['fps'] / before['fps'] if before['fps'] else float('inf')
+        regressed = ratio < 1 - tolerance or result['dropped_frames'] > before['dropped_frames']
+        regressions += regressed
+        print(f"{_label(result)}: fps {before['fps']:.1f} -> {result['fps']:.1f} ({ratio - 1:+.0%}), "
+              f"dropped {before['dropped_frames']} -> {result['dropped_frames']}" + (" REGRESSION" if regressed else ""))
+    return regressions
+
+
+def _label(result):
+    return f"{result['size']}x{result['size']} {result['frames']} frames {result['queue']:>5} -> {result['backend']:<6}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024], help="square frame sizes in pixels")
+    parser.add_argument('--frames', type=int, nargs='+', default=[2000])
+    parser.add_argument('--queues', nargs='+', default=list(QUEUE_TYPES), choices=QUEUE_TYPES)
+    parser.add_argument('--backends', nargs='+', default=['tiff', 'memmap', 'zarr'])
+    parser.add_argument('--exposure', type=float, default=1.0, help="demo camera exposure in ms")
+    parser.add_argument('--circular-buffer-mb', type=int, default=2048)
+    parser.add_argument('--ring-buffer-mb', type=int, default=1024)
+    parser.add_argument('--directory', help="where to write the stacks (default: system temp directory)")
+    parser.add_argument('--output', help="save the results as JSON")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="fps drop that counts as a regression")
+    parser.add_argument('--run', help=argparse.SUPPRESS) # internal: run one configuration
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_config(json.loads(args.run))))
+        return
+
+    results = []
+    for size, frames, queue_type, backend in itertools.product(args.sizes, args.frames, args.queues, args.backends):
+        params = {'size': size, 'frames': frames, 'queue': queue_type, 'backend': backend,
+                  'exposure_ms': args.exposure, 'circular_buffer_mb': args.circular_buffer_mb,
+                  'ring_buffer_mb': args.ring_buffer_mb, 'directory': args.directory}
+        result = run_in_subprocess(params)
+        results.append(result)
+        if 'error' in result:
+            print(f"{_label(result)}: failed ({' '.join(result['error'])})")
+            continue
+        print(f"{_label(result)}: {result['fps']:7.1f} fps, {result['disk_mb_per_s']:7.1f} MB/s, "
+              f"dropped {result['dropped_frames']}, peak RSS {result['peak_rss_mb'] or 0:.0f} MB"
+              + (", circular buffer overflow" if result['circular_buffer_overflowed'] else ""))
+
+    if args.output:
+        import numpy
+        import pymmcore_plus
+        environment = {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'numpy': numpy.__version__,
+            'pymmcore_plus': pymmcore_plus.__version__,
+            'pylab': open(os.path.join(ROOT, 'pylab', 'VERSION')).read().strip(),
+        }
+        with open(args.output, 'w') as fh:
+            json.dump({'environment': environment, 'results': results}, fh, indent=2)
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure how analyze_images scales with the number of worker processes.
+
+A synthetic uint16 stack (noise with bright moving blobs) is written to a memory-mapped .npy file and analyzed
+block by block with 1, 2, 4, ... workers, per frame or as one volume. Wall time, frames/s and the speedup and
+parallel efficiency over one worker are reported; labels are checked to be identical for every worker count.
+The time of each stage is recorded too: the merge stage is the only one that runs in the parent alone, so its
+share of the one-worker run (the serial fraction) bounds the speedup by Amdahl's law, 1 / (serial + (1 - serial) / N).
+
+    python benchmarks/bench_analysis.py --frames 2000 --size 512 --workers 1 2 4 8 16 --output analysis.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pylab.analyze import analyze_images
+
+
+def synthetic_stack(filename, frames, size, seed=0):
+    """Memory-mapped (frames, size, size) uint16 stack of noise with a few bright blobs drifting over time"""
+    rng = np.random.default_rng(seed)
+    stack = np.lib.format.open_memmap(filename, mode='w+', dtype=np.uint16, shape=(frames, size, size))
+    yy, xx = np.mgrid[:size, :size]
+    centers = rng.random((8, 2)) * size
+    for t in range(frames):
+        frame = rng.normal(1000, 100, (size, size))
+        for cy, cx in (centers + t * 0.5) % size:
+            frame += 2000 * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * (size / 40) ** 2))
+        stack[t] = frame.clip(0, 65535)
+    stack.flush()
+    return stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=512)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--block-frames', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--volume', action='store_true', help="analyze the stack as one 3D volume (default: per frame)")
+    parser.add_argument('--output', help="save the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        images = synthetic_stack(os.path.join(directory, 'stack.npy'), args.frames, args.size)
+        results = []
+        reference = None
+        for workers in sorted(set(args.workers)):
+            timings = {}
+            start = time.perf_counter()
+            _, labels, _ = analyze_images(images, block_frames=args.block_frames, workers=workers,
+                                          per_frame=not args.volume, out_dir=os.path.join(directory, str(workers)),
+                                          timings=timings)
+            seconds = time.perf_counter() - start
+            serial = timings['merge'] / seconds
+            if reference is None:
+                reference = (seconds, np.asarray(labels))
+            identical = bool(np.array_equal(labels, reference[1]))
+            result = {'workers': workers, 'seconds': seconds, 'fps': args.frames / seconds,
+                      'speedup': reference[0] / seconds, 'efficiency': reference[0] / seconds / workers,
+                      'stages': timings, 'serial_fraction': serial,
+                      'amdahl_limit': 1 / (serial + (1 - serial) / workers), 'identical_labels': identical}
+            results.append(result)
+            stages = ", ".join(f"{name} {stage_seconds:.2f}" for name, stage_seconds in timings.items())
+            print(f"{workers:3d} workers: {seconds:7.2f} s, {result['fps']:8.1f} frames/s, "
+                  f"speedup {result['speedup']:5.2f}x ({result['efficiency']:.0%} efficiency), "
+                  f"serial {serial:.1%}, Amdahl limit {result['amdahl_limit']:.1f}x [{stages} s]"
+                  + ("" if identical else ", LABELS DIFFER"))
+            del labels
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'python': sys.version, 'cpu_count': os.cpu_count(), 'frames': args.frames, 'size': args.size,
+                       'block_frames': args.block_frames, 'per_frame': not args.volume, 'results': results},
+                      fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
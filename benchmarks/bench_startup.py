@@ -0,0 +1,89 @@
+"""
+Measure how long pylab takes to start, and check that no heavy dependency is imported on the way.
+
+Every target runs in a fresh interpreter several times; the median wall time is reported together with the
+heavy modules (hardware drivers, GUI toolkits, pandas, allensdk, ...) the target imported. The exit status is 1
+when a target exceeds --budget seconds or imports a heavy module, so the script can guard releases.
+
+    python benchmarks/bench_startup.py --repeat 5 --budget 1.0 --output startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that must only be imported by the command that needs them
+HEAVY_MODULES = ['pycromanager', 'pymmcore_plus', 'napari', 'nidaqmx', 'serial', 'requests', 'pandas', 'allensdk',
+                 'matplotlib.pyplot', 'zarr']
+
+# Name -> command line (after the interpreter) of each target
+TARGETS = {
+    'pylab --help': ['-m', 'pylab', '--help'],
+    'pylab recover --help': ['-m', 'pylab', 'recover', '--help'],
+    'import pylab.__main__': ['-c', 'import pylab.__main__'],
+    'import pylab.stacks': ['-c', 'import pylab.stacks'],
+    'import pylab.session': ['-c', 'import pylab.session'],
+    'import pylab.threaded_acquisition': ['-c', 'import pylab.threaded_acquisition'],
+}
+
+PROBE = ("import sys, json, importlib; importlib.import_module({module!r}); "
+         "print(json.dumps([m for m in {heavy!r} if m in sys.modules]))")
+
+
+def heavy_imports(target):
+    """Return the heavy modules imported by an `import` target (CLI targets import pylab.__main__)"""
+    args = TARGETS[target]
+    module = args[1].split()[-1] if args[0] == '-c' else 'pylab.__main__'
+    result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            capture_output=True, text=True)
+    if result.returncode:
+        return None # the module cannot be imported in this environment
+    return json.loads(result.stdout)
+
+
+def time_command(command, repeat):
+    """Median wall time of a command in seconds, or (None, last error line) if it fails"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode:
+            return None, result.stderr.strip().splitlines()[-1:]
+    return statistics.median(times), []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help="maximum median startup time in seconds")
+    parser.add_argument('--output', help="save the results as JSON")
+    args = parser.parse_args()
+
+    baseline, _ = time_command([sys.executable, '-c', 'pass'], args.repeat)
+    results = []
+    failed = False
+    for target in TARGETS:
+        seconds, error = time_command([sys.executable] + TARGETS[target], args.repeat)
+        heavy = heavy_imports(target)
+        result = {'target': target, 'seconds': seconds, 'heavy_imports': heavy, 'error': error}
+        results.append(result)
+        if seconds is None:
+            print(f"{target:>36}: skipped ({' '.join(error)})")
+            continue
+        over_budget = seconds > args.budget
+        failed = failed or over_budget or bool(heavy)
+        print(f"{target:>36}: {seconds * 1000:7.0f} ms ({(seconds - baseline) * 1000:+.0f} ms over a bare interpreter)"
+              + (f", imports {', '.join(heavy)}" if heavy else "")
+              + (" OVER BUDGET" if over_budget else ""))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'python': sys.version, 'interpreter_seconds': baseline, 'budget_seconds': args.budget,
+                       'results': results}, fh, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare the threaded writer (FrameSavingThread) with the writer process (ProcessFrameWriter).
+
+A synthetic camera releases frames on a fixed clock; the real FramePump moves them into the ring and the
+writer saves them. The pump's hand-off time of every frame is compared with the time the camera released it,
+so GIL contention between pump and writer shows up as hand-off jitter.
+
+    python benchmarks/bench_writers.py --frames 5000 --fps 500 --backend tiff --output writers.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from pylab.buffers import FrameRingBuffer
+from pylab.process_writer import ProcessFrameWriter, SharedFrameRing
+from pylab.pump import FramePump
+from pylab.writers import STACK_EXTENSIONS, FrameSavingThread
+
+
+class ClockedCamera:
+    """Circular buffer stand-in that makes frame k available at start + k / fps"""
+
+    def __init__(self, num_frames, fps, shape):
+        rng = np.random.default_rng(0)
+        self.frames = rng.integers(0, 4096, size=(16,) + shape, dtype=np.uint16) # recycled frame contents
+        self.num_frames = num_frames
+        self.fps = fps
+        self.popped = 0
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def available(self):
+        return min(self.num_frames, int((time.perf_counter() - self.start_time) * self.fps) + 1)
+
+    def getRemainingImageCount(self):
+        return self.available() - self.popped
+
+    def isSequenceRunning(self):
+        return self.available() < self.num_frames
+
+    def popNextImage(self):
+        frame = self.frames[self.popped % len(self.frames)]
+        self.popped += 1
+        return frame
+
+
+def run_writer(mode, args, directory):
+    shape = (args.height, args.width)
+    filename = os.path.join(directory, f"{mode}{STACK_EXTENSIONS[args.backend]}")
+    stop_event = threading.Event()
+    if mode == 'thread':
+        ring = FrameRingBuffer(args.ring_frames, shape)
+        writer = FrameSavingThread(ring, stop_event, filename, args.frames, batch_size=args.batch_size,
+                                   backend=args.backend)
+    else:
+        ring = SharedFrameRing(args.ring_frames, shape)
+        writer = ProcessFrameWriter(ring, stop_event, filename, args.frames, batch_size=args.batch_size,
+                                    backend=args.backend)
+    camera = ClockedCamera(args.frames, args.fps, shape)
+    pump = FramePump(camera, ring.put, args.frames)
+    writer.start()
+    time.sleep(1.0) # let the writer process finish starting up
+    camera.start()
+    pump.run()
+    stop_event.set()
+    writer.join()
+
+    released = camera.start_time + np.arange(pump.frames_pumped) / args.fps
+    jitter_ms = (pump.handoff_times[:pump.frames_pumped] - released) * 1000
+    result = {
+        'mode': mode,
+        'frames_written': writer.frames_written,
+        'writer_mb_per_s': writer.bytes_written / 1024**2 / writer.elapsed if writer.elapsed else 0.0,
+        'backpressure_events': ring.backpressure_events,
+        'handoff_jitter_p50_ms': float(np.percentile(jitter_ms, 50)),
+        'handoff_jitter_p99_ms': float(np.percentile(jitter_ms, 99)),
+        'handoff_jitter_max_ms': float(jitter_ms.max()),
+        'pump': pump.summary(),
+    }
+    if mode == 'process':
+        writer.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--fps', type=float, default=500)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--backend', default='tiff', choices=sorted(STACK_EXTENSIONS))
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--ring-frames', type=int, default=512)
+    parser.add_argument('--directory', help="where to write the stacks (default: a temporary directory)")
+    parser.add_argument('--output', help="save the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.directory or tmp
+        results = [run_writer(mode, args, directory) for mode in ('thread', 'process')]
+
+    for result in results:
+        print(f"{result['mode']:>8}: {result['frames_written']} frames, writer {result['writer_mb_per_s']:.1f} MB/s, "
+              f"hand-off jitter p50 {result['handoff_jitter_p50_ms']:.2f} ms / p99 {result['handoff_jitter_p99_ms']:.2f} ms"
+              f" / max {result['handoff_jitter_max_ms']:.2f} ms, ring full {result['backpressure_events']} times")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'parameters': vars(args), 'results': results}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,9 @@
 
 #from pylab.cli import main  # pragma: no cover
 import click
-from pycromanager import Core
 
+# Heavy dependencies (pycromanager, pymmcore_plus, napari, nidaqmx, ...) and hardware are only loaded inside
+# the command that needs them, so `pylab --help` and file-only commands start quickly.
 
 '''
 This is the client terminal command line interface
@@ -23,7 +24,7 @@ def record():
     """
     Record a widefield acquisition.S
     """
-    from pycromanager import Acquisition, multi_d_acquisition_events
+    from pycromanager import Acquisition, multi_d_acquisition_events, Core
     from pylab import base
 
     print("Initializing Micro Manager Device configuration from config file..." + base.MM_CONFIG)
@@ -64,6 +65,44 @@ def record2():
             core.close()
 
 
+@cli.command()
+@click.option('--config', 'config_file', type=click.Path(exists=True), help='Session config file (JSON).')
+@click.option('--frames', type=int, help='Number of frames, overrides the config.')
+@click.option('--subject', help='Subject ID, overrides the config.')
+@click.option('--session', help='Session ID, overrides the config.')
+@click.option('--trigger', type=click.Choice(['none', 'input']), help='Trigger mode, overrides the config.')
+@click.option('--backend', type=click.Choice(['tiff', 'memmap', 'zarr']), help='Writer backend, overrides the config.')
+@click.option('--replay', type=click.Path(exists=True), help='Replay a stored stack instead of the camera (dry run).')
+@click.option('--replay-fps', type=float, help='Replay rate (default: the recorded frame times).')
+@click.option('--template', type=click.Path(), help='Write a session config with the default settings and exit.')
+def acquire(config_file, frames, subject, session, trigger, backend, replay, replay_fps, template):
+    """
+    Run a headless acquisition with the threaded pump and writer pipeline.
+    """
+    from pylab.acquisition import load_session_config, run_session, save_session_config
+
+    if template:
+        save_session_config(template)
+        click.echo(f"Wrote default session config: {template}")
+        return
+    config = load_session_config(config_file, num_frames=frames, subject_id=subject, session_id=session,
+                                 trigger=trigger, backend=backend, replay=replay, replay_fps=replay_fps)
+    reports = run_session(config)
+    if not all(report['no_dropped_frames'] for report in reports.values()):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.argument('filename', type=click.Path(exists=True))
+def recover(filename):
+    """
+    Finalise a stack from an interrupted, journaled acquisition.
+    """
+    from pylab.journal import recover_stack
+
+    recover_stack(filename)
+
+
 ### Utility commands for querying serial ports and USB IDs ###
 
 @cli.command()
@@ -79,11 +118,12 @@ def get_devices():
         click.echo("Failed to download USB IDs.")
 
 ### NI-DAQ commands ###
-from .utils import list_nidaq_devices, test_nidaq_connection, read_analog_input
 
 @click.command()
 def list_devices():
     """List all connected NI-DAQ devices."""
+    from .utils import list_nidaq_devices
+
     devices = list_nidaq_devices()
     click.echo("\n".join(devices))
 
@@ -91,6 +131,8 @@ def list_devices():
 @click.option('--device_name', default='Dev2', help='Device name to test connection.')
 def test_connection(device_name):
     """Test connection to a specified NI-DAQ device."""
+    from .utils import test_nidaq_connection
+
     if test_nidaq_connection(device_name):
         click.echo(f"Successfully connected to {device_name}.")
     else:
@@ -100,7 +142,22 @@ cli.add_command(list_devices)
 cli.add_command(test_connection)
 
 
-if __name__ == "__main__":  # pragma: no cover
+@cli.command()
+def gui():
+    """
+    Launch the napari acquisition interface.
+    """
+    from pylab.threaded_acquisition import start_napari
+
+    start_napari()
+
+
+def main():
+    """Console script entry point"""
     cli()
 
 
+if __name__ == "__main__":  # pragma: no cover
+    main()
+
+
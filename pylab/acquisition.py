@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from pylab.daq_recorder import DAQRecorder, NIDAQRecordingBackend
+from pylab.session import AcquisitionSession, CameraPipeline
+from pylab.triggers import NIDAQTrigger
+from pylab.writers import STACK_EXTENSIONS
+
+# Settings of a headless acquisition session; a session config file (JSON) overrides any of them
+DEFAULT_SESSION_CONFIG = {
+    'mm_config': r'C:/dev/ThorPupil.cfg', # Micro-Manager configuration of the main camera
+    'camera_name': None, # name of the main camera in reports (default: name of its config file)
+    'extra_cameras': {}, # cameras streamed in parallel from the same trigger, name -> Micro-Manager config
+    'save_dir': r'F:/sbaskar/202407_SB_F31prelim_pupil',
+    'protocol_id': 'baseline',
+    'subject_id': 'devJG',
+    'session_id': '01',
+    'num_frames': 24000,
+    'trigger': 'none', # 'none' starts right away, 'input' waits for a rising edge on trigger_channels
+    'trigger_timeout': None, # seconds to wait for the trigger (default: forever)
+    'nidaq_device': 'Dev1',
+    'trigger_channels': ['port2/line0'],
+    'backend': 'tiff', # 'tiff', 'memmap' or 'zarr', see make_writer()
+    'writer_mode': 'thread', # 'thread' or 'process'
+    'batch_size': 64,
+    'batch_ms': 250,
+    'ring_buffer_mb': 1024,
+    'max_file_gb': None, # split the stack into files of at most this size
+    'journal_interval': None, # seconds between journaled syncs ('memmap' and 'zarr' backends)
+    # frames per TIFF series ('tiff' backend): None closes a series after every batch, so a crash loses at most one
+    # batch, but the stack is read page by page; set it to num_frames or more for one memory-mappable series,
+    # which a crash loses entirely
+    'tiff_series_frames': None,
+    'monitor_interval': 5.0, # seconds between live throughput lines
+    'daq_ai_channels': [], # analog inputs recorded for the whole session; empty disables DAQ recording
+    'daq_di_channels': [],
+    'daq_rate': 1000,
+    'replay': None, # stored stack replayed as the main camera instead of mm_config, see ReplayCore
+    'replay_fps': None, # replay rate (default: the recorded frame times)
+}
+
+TRIGGER_MODES = ('none', 'input')
+
+
+def load_session_config(filename=None, **overrides):
+    """
+    Read a session config file (JSON) on top of DEFAULT_SESSION_CONFIG. Keyword arguments override the file;
+    unknown keys raise a ValueError, so a typo cannot silently fall back to a default.
+    """
+    config = dict(DEFAULT_SESSION_CONFIG)
+    settings = {}
+    if filename is not None:
+        with open(filename) as fh:
+            settings.update(json.load(fh))
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    unknown = sorted(set(settings) - set(config))
+    if unknown:
+        raise ValueError(f"Unknown session settings: {', '.join(unknown)}")
+    config.update(settings)
+    if config['trigger'] not in TRIGGER_MODES:
+        raise ValueError(f"Unknown trigger mode {config['trigger']!r}, expected one of {TRIGGER_MODES}")
+    return config
+
+
+def save_session_config(filename, config=None):
+    """Write a session config file, e.g. to start from the defaults"""
+    with open(filename, 'w') as fh:
+        json.dump(config or DEFAULT_SESSION_CONFIG, fh, indent=2)
+
+
+def session_stack_filename(config, timestamp=None, camera=None):
+    """Path of a camera's stack: <save_dir>/<protocol>-<subject>/ses-<session>/anat/sub-<subject>_ses-<session>_<time>"""
+    timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    anat_dir = os.path.join(config['save_dir'], f"{config['protocol_id']}-{config['subject_id']}",
+                            f"ses-{config['session_id']}", "anat")
+    stack_name = f"sub-{config['subject_id']}_ses-{config['session_id']}_{timestamp}"
+    if camera is not None:
+        stack_name += f"_{camera}"
+    return os.path.join(anat_dir, stack_name + STACK_EXTENSIONS[config['backend']])
+
+
+def run_session(config, mmc=None, preview=None):
+    """
+    Run an acquisition session described by a session config: stream every camera to disk through its own
+    pump and writer, record the DAQ channels, print live throughput and a per-camera summary.
+    mmc is an already loaded core for the main camera; without it a new core is loaded from config['mm_config'],
+    or config['replay'] is replayed as the main camera.
+    Returns {camera name: session report}.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_filename = session_stack_filename(config, timestamp)
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+
+    # Each camera gets its own ring buffer, pump, writer, frame metadata and stop event
+    pipeline_options = dict(backend=config['backend'], batch_size=config['batch_size'],
+                            batch_timeout_ms=config['batch_ms'], ring_buffer_mb=config['ring_buffer_mb'],
+                            writer_mode=config['writer_mode'], monitor_interval=config['monitor_interval'],
+                            live=True, journal_interval=config['journal_interval'],
+                            series_frames=config['tiff_series_frames'],
+                            max_file_bytes=int(config['max_file_gb'] * 1024**3) if config['max_file_gb'] else None)
+    name = config['camera_name'] or os.path.splitext(os.path.basename(config['replay'] or config['mm_config']))[0]
+    if mmc is None and config['replay']:
+        from pylab.replay import ReplayCore
+        mmc = ReplayCore(config['replay'], fps=config['replay_fps'])
+    if mmc is None:
+        pipelines = [CameraPipeline.from_config(name, config['mm_config'], output_filename, config['num_frames'],
+                                                preview=preview, **pipeline_options)]
+    else:
+        pipelines = [CameraPipeline(name, mmc, output_filename, config['num_frames'], preview=preview,
+                                    **pipeline_options)]
+    for camera, config_file in config['extra_cameras'].items():
+        filename = session_stack_filename(config, timestamp, camera)
+        pipelines.append(CameraPipeline.from_config(camera, config_file, filename, config['num_frames'],
+                                                    **pipeline_options))
+    session = AcquisitionSession(pipelines)
+
+    # Continuous DAQ recording covers the trigger and the whole acquisition
+    daq_recorder = None
+    if config['daq_ai_channels']:
+        daq_backend = NIDAQRecordingBackend(config['nidaq_device'], config['daq_ai_channels'],
+                                            config['daq_di_channels'], rate=config['daq_rate'])
+        daq_recorder = DAQRecorder(daq_backend, os.path.splitext(output_filename)[0] + "_daq")
+        daq_recorder.start()
+
+    start_time = time.time()
+    try:
+        if config['trigger'] == 'input':
+            # The camera sequences are armed before the trigger and started on the hardware-detected edge
+            with NIDAQTrigger(config['nidaq_device'], config['trigger_channels']) as trigger:
+                reports = session.run(trigger, timeout=config['trigger_timeout'])
+        else:
+            reports = session.run()
+    finally:
+        if daq_recorder is not None:
+            daq_recorder.stop()
+            print(f"Recorded {daq_recorder.samples_written} DAQ samples per channel: {daq_recorder.filename}")
+        # Per-camera throughput, latency and dropped-frame checks, also (and above all) when the run failed;
+        # each camera also writes <stack>_report.json
+        print(f"started at ctime: {time.ctime(start_time)}")
+        session.print_summary()
+    return reports
@@ -1,104 +1,75 @@
 import numpy as np
-import tifffile
 import os
-from skimage import filters, measure, exposure
-import matplotlib.pyplot as plt
-from allensdk.core.reference_space_cache import ReferenceSpaceCache
-from allensdk.core.mouse_connectivity_cache import MouseConnectivityCache
 
-# Function to load TIFF stack
-def load_tiff_stack(filepath):
-    with tifffile.TiffFile(filepath) as tif:
-        images = tif.asarray()
-    return images
+from pylab import analyze
+from pylab.analyze import (BLOCK_FRAMES, CACHE_DIR, CACHE_GB, display_results, load_tiff_stack, output_array,
+                           preprocess_images, save_region_table)
+from pylab.cache import AnalysisCache, file_fingerprint
+from pylab.stacks import iter_blocks
 
-# Function to preprocess images
-def preprocess_images(images):
-    # Apply histogram equalization
-    images_eq = exposure.equalize_hist(images)
-    return images_eq
+# Function to load the Allen Brain Atlas annotation of the dorsal cortex surface, (AP, ML) structure IDs, from the
+# local atlas store (the annotation volume is only downloaded and projected the first time, see AtlasStore)
+def download_allen_brain_atlas_annotation(resolution=10):
+    from pylab.atlas import AtlasStore
 
-# Function to download Allen Brain Atlas annotation
-def download_allen_brain_atlas_annotation():
-    manifest_path = 'manifest.json'
-    resolution = 10  # in microns
-    reference_space_key = 'annotation/ccf_2022'  # The key for the annotation volume
-    rspc = ReferenceSpaceCache(reference_space_key=reference_space_key, resolution=resolution, manifest=manifest_path)
-    annotation, _ = rspc.get_annotation_volume()
-    return annotation
+    return AtlasStore().dorsal_annotation(resolution)
 
 # Function to segment images using the Allen Brain Atlas annotation
-def segment_using_allen_brain_atlas(images, annotation):
-    # Resize the annotation to match the image dimensions if needed
-    annotation_resized = resize_annotation(annotation, images.shape)
+def segment_using_allen_brain_atlas(images, annotation, block_frames=BLOCK_FRAMES, out_dir=None):
+    # Resize the annotation to match the frame dimensions (2D annotation, used for every frame) or the stack
+    # dimensions (3D annotation) if needed
+    per_frame = annotation.ndim == 2
+    annotation_resized = resize_annotation(annotation, images.shape[1:] if per_frame else images.shape)
 
-    # Apply the annotation to segment the image
-    segmented_images = images * annotation_resized
+    # Apply the annotation to segment the image, one block at a time
+    dtype = np.result_type(images.dtype, annotation_resized.dtype)
+    segmented_images = output_array(out_dir, 'segmented', images.shape, dtype)
+    for start, stop, block, _ in iter_blocks(images, block_frames):
+        segmented_images[start:stop] = block * (annotation_resized if per_frame else annotation_resized[start:stop])
 
     return segmented_images
 
-# Function to resize the annotation to match image dimensions
-def resize_annotation(annotation, target_shape):
-    from skimage.transform import resize
-    return resize(annotation, target_shape, preserve_range=True, anti_aliasing=True, order=0)
+# Function to resize the annotation to match image dimensions: a nearest-neighbour index map, computed once per
+# (annotation shape, target shape, transform) and cached on disk, gathers the label IDs without blending them.
+# transform is an optional affine atlas-to-image alignment, see nearest_index_map()
+def resize_annotation(annotation, target_shape, transform=None):
+    from pylab.resample import resample_labels
+    return resample_labels(annotation, target_shape, transform)
 
 # Function to analyze images
-def analyze_images(images, segmented_images):
-    # Apply a Sobel filter for edge detection on the segmented images
-    edges = filters.sobel(segmented_images)
-    
-    # Threshold the image
-    threshold_value = filters.threshold_otsu(segmented_images)
-    binary_image = segmented_images > threshold_value
-    
-    # Label the image
-    labeled_image = measure.label(binary_image)
-    
-    # Perform regionprops analysis
-    regions = measure.regionprops(labeled_image, intensity_image=segmented_images)
-    
-    return edges, labeled_image, regions
-
-# Function to display results
-def display_results(images, edges, labeled_image, regions):
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-    ax = axes.ravel()
-    
-    ax[0].imshow(images[0], cmap='gray')
-    ax[0].set_title('Original Image')
-    
-    ax[1].imshow(edges[0], cmap='gray')
-    ax[1].set_title('Edges')
-    
-    ax[2].imshow(labeled_image[0], cmap='nipy_spectral')
-    ax[2].set_title('Labeled Image')
-    
-    plt.tight_layout()
-    plt.show()
-    
-    print(f"Number of regions: {len(regions)}")
-    for region in regions:
-        print(f"Region: {region.label}, Area: {region.area}, Mean Intensity: {region.mean_intensity}")
+def analyze_images(images, segmented_images, block_frames=BLOCK_FRAMES, out_dir=None):
+    # Edges, Otsu threshold, labels and region table of the segmented images, streamed as in analyze.py
+    return analyze.analyze_images(segmented_images, block_frames=block_frames, out_dir=out_dir)
 
 # Main analysis function
 def main():
     # Path to the TIFF stack
     filepath = r'D:\Mapping\Animals\sb02\first_test\25-Apr-2024_1\Frames_1_512_512_uint16_0003.tif'
     
-    # Load the images
+    # Load the images (lazily, the stack can be larger than memory); every stage is cached, see AnalysisCache
     images = load_tiff_stack(filepath)
+    cache = AnalysisCache(os.path.join(os.path.dirname(filepath), CACHE_DIR), CACHE_GB)
     
     # Preprocess the images
-    images_preprocessed = preprocess_images(images)
-    
-    # Download Allen Brain Atlas annotation
-    annotation = download_allen_brain_atlas_annotation()
+    preprocess_key, preprocessed = cache.run(
+        'preprocess', [file_fingerprint(filepath)], {'dtype': 'float32'},
+        lambda out_dir: {'preprocessed': preprocess_images(images, out_dir=out_dir)})
+    images_preprocessed = preprocessed['preprocessed']
     
-    # Segment images using the Allen Brain Atlas annotation
-    segmented_images = segment_using_allen_brain_atlas(images_preprocessed, annotation)
+    # Segment images using the dorsal Allen Brain Atlas annotation (loaded only if the segmentation is not cached)
+    segment_key, segmented = cache.run(
+        'segment', [preprocess_key], {'annotation': 'annotation/ccf_2022', 'resolution': 10, 'projection': 'dorsal'},
+        lambda out_dir: {'segmented': segment_using_allen_brain_atlas(
+            images_preprocessed, download_allen_brain_atlas_annotation(), out_dir=out_dir)})
+    segmented_images = segmented['segmented']
     
     # Analyze the images
-    edges, labeled_image, regions = analyze_images(images_preprocessed, segmented_images)
+    _, analyzed = cache.run(
+        'analyze', [segment_key], {'per_frame': False},
+        lambda out_dir: dict(zip(['edges', 'labels', 'regions'],
+                                 analyze_images(images_preprocessed, segmented_images, out_dir=out_dir))))
+    edges, labeled_image, regions = analyzed['edges'], analyzed['labels'], analyzed['regions']
+    save_region_table(os.path.splitext(filepath)[0] + '_regions.parquet', regions)
     
     # Display the results
     display_results(images_preprocessed, edges, labeled_image, regions)
@@ -1,40 +1,285 @@
 import numpy as np
 import tifffile
 import os
-from skimage import filters, measure, io, morphology, exposure
-import matplotlib.pyplot as plt
+import tempfile
+import time
+from skimage import filters, measure, io, morphology
+
+from pylab.cache import AnalysisCache, file_fingerprint
+from pylab.histogram import StreamingHistogram, stack_histogram
+from pylab.stacks import MappedStack, iter_blocks, map_blocks, open_session_stack
+
+BLOCK_FRAMES = 64 # frames processed at a time; memory use scales with this, not with the stack
+CACHE_DIR = '.pylab_cache' # analysis cache, relative to the stack's directory unless absolute
+CACHE_GB = 50 # size cap of the analysis cache; least recently used stages are deleted beyond it
+
 
 # Function to load TIFF stack
-def load_tiff_stack(filepath):
-    with tifffile.TiffFile(filepath) as tif:
-        images = tif.asarray()
-    return images
+def load_tiff_stack(filepath, lazy=True):
+    """
+    Open a stack without reading it: memory-mapped when its image data are contiguous, read page by page
+    otherwise (see open_session_stack). lazy=False reads the whole stack into memory.
+    """
+    if not lazy:
+        with tifffile.TiffFile(filepath) as tif:
+            return tif.asarray()
+    return open_session_stack(filepath)
+
+# Arrays the size of the stack are memory-mapped .npy files in out_dir, or in memory without out_dir
+def output_array(out_dir, name, shape, dtype):
+    if out_dir is None:
+        return np.empty(shape, dtype=dtype)
+    os.makedirs(out_dir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
 
 # Function to preprocess images
-def preprocess_images(images):
-    # Apply histogram equalization
-    images_eq = exposure.equalize_hist(images)
+def preprocess_images(images, block_frames=BLOCK_FRAMES, out_dir=None, dtype=np.float32):
+    # Apply histogram equalization with the histogram of the whole stack, one block at a time:
+    # values in [0, 1] for a float dtype, or over the full range of an integer dtype (e.g. uint16)
+    dtype = np.dtype(dtype)
+    if StreamingHistogram.supports(images.dtype):
+        lut = StreamingHistogram.from_stack(images, block_frames).equalization_lut(dtype)
+        equalize = lambda block: lut[block]
+    else:
+        hist, bin_centers = stack_histogram(images, block_frames=block_frames)
+        cdf = hist.cumsum() / float(hist.sum())
+        if dtype.kind != 'f':
+            cdf = np.round(cdf * np.iinfo(dtype).max)
+        equalize = lambda block: np.interp(block, bin_centers, cdf).astype(dtype)
+    images_eq = output_array(out_dir, 'preprocessed', images.shape, dtype)
+    for start, stop, block, _ in iter_blocks(images, block_frames):
+        images_eq[start:stop] = equalize(block)
     return images_eq
 
+# Pairs of block labels that touch across a block boundary (full connectivity: the 3x3 neighbourhood in the next frame)
+def _boundary_pairs(previous, first):
+    padded = np.pad(first, 1)
+    height, width = previous.shape
+    pairs = []
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            neighbour = padded[dy:dy + height, dx:dx + width]
+            touching = (previous > 0) & (neighbour > 0)
+            pairs.append(np.stack([previous[touching], neighbour[touching]]))
+    return np.concatenate(pairs, axis=1)
+
+# Function to build the label map that merges touching regions: label -> merged label, where merged regions take
+# the number of their first pixel in raster order, as if the stack had been labeled at once. Returns the map and
+# the number of merged labels.
+def _merge_map(pairs, count):
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if count == 0:
+        return np.zeros(1, dtype=np.int64), 0
+    pairs = np.concatenate(pairs, axis=1) if pairs else np.zeros((2, 0), dtype=np.int64)
+    graph = coo_matrix((np.ones(pairs.shape[1]), (pairs[0], pairs[1])), shape=(count + 1, count + 1))
+    _, component = connected_components(graph, directed=False)
+    first_label = np.full(component.max() + 1, count + 1, dtype=np.int64)
+    np.minimum.at(first_label, component[1:], np.arange(1, count + 1))
+    roots = np.unique(first_label[component[1:]])
+    lut = np.zeros(count + 1, dtype=np.int64)
+    lut[1:] = np.searchsorted(roots, first_label[component[1:]]) + 1
+    return lut, len(roots)
+
+# Function to merge labels of touching regions in place
+def _merge_labels(labeled_image, pairs, count, block_frames):
+    lut, _ = _merge_map(pairs, count)
+    for start, stop, block, _ in iter_blocks(labeled_image, block_frames):
+        labeled_image[start:stop] = lut[block]
+
+# Function to label connected regions block by block; regions that continue across a block boundary are merged
+def label_stack(binary_image, block_frames=BLOCK_FRAMES, out_dir=None):
+    labeled_image = output_array(out_dir, 'labels', binary_image.shape, np.int64)
+    offset = 0
+    pairs = []
+    for start, stop, block, _ in iter_blocks(binary_image, block_frames):
+        labels, count = measure.label(block, return_num=True)
+        labels[labels > 0] += offset
+        offset += count
+        if start > 0:
+            pairs.append(_boundary_pairs(labeled_image[start - 1], labels[0]))
+        labeled_image[start:stop] = labels
+    _merge_labels(labeled_image, pairs, offset, block_frames)
+    return labeled_image
+
+# Outputs are handed to worker processes as the path of their .npy file and mapped again there
+def _output(target):
+    return np.load(target, mmap_mode='r+') if isinstance(target, str) else target
+
+# Function to analyze one block in a worker: edges, threshold and labels of the frames block[core] (mapped through
+# lut first, if given), numbered from 1 in the block, are written straight into the outputs. Returns the number of
+# labels and the labels of the first and last frame, which is all the parent needs to merge regions across blocks.
+def _label_block(start, block, core, threshold_value, per_frame, lut, edges_target, labels_target):
+    if lut is not None:
+        block = lut[block]
+    binary_image = block[core] > threshold_value
+    stop = start + len(binary_image)
+    if not per_frame:
+        edges = filters.sobel(block)[core]
+        labels, count = measure.label(binary_image, return_num=True)
+    else:
+        # Each frame on its own: 2D edges, and regions that never extend to other frames
+        edges = np.stack([filters.sobel(frame) for frame in block[core]])
+        labels = np.zeros(binary_image.shape, dtype=np.int64)
+        count = 0
+        for i, frame in enumerate(binary_image):
+            frame_labels, frame_count = measure.label(frame, return_num=True)
+            labels[i] = np.where(frame_labels > 0, frame_labels + count, 0)
+            count += frame_count
+    _output(edges_target)[start:stop] = edges
+    _output(labels_target)[start:stop] = labels
+    return count, labels[0].copy(), labels[-1].copy()
+
+# Function to sum the properties of the regions in one block: the labels present and, for each, its pixel count,
+# sums of y, x and intensity, and first and last frame
+def _region_sums(start, labels, intensity):
+    pixels = np.flatnonzero(labels)
+    region = labels.ravel()[pixels]
+    frame, y, x = np.unravel_index(pixels, labels.shape)
+    present, first, index = np.unique(region, return_index=True, return_inverse=True)
+    # Pixels are in frame order, so the first and last occurrence of a label give its first and last frame
+    last = len(region) - 1 - np.unique(region[::-1], return_index=True)[1]
+    sums = np.stack([np.bincount(index, weights=weights, minlength=len(present))
+                     for weights in (None, y, x, intensity.ravel()[pixels])])
+    return present, sums, start + frame[first], start + frame[last]
+
+# Function to relabel one block in a worker with its slice of the merge map and sum its region properties
+def _measure_block(start, block, core, lut, labels_target, label_map):
+    if lut is not None:
+        block = lut[block]
+    labels_out = _output(labels_target)
+    stop = start + block[core].shape[0]
+    labels = label_map[labels_out[start:stop]]
+    labels_out[start:stop] = labels
+    return _region_sums(start, labels, block[core])
+
+# Running totals of the region properties, one row per label, filled block by block in frame order
+class _RegionTotals:
+    def __init__(self, num_labels):
+        self.num_labels = num_labels
+        self.sums = np.zeros((4, num_labels + 1))
+        self.first_frame = np.full(num_labels + 1, -1, dtype=np.int64)
+        self.last_frame = np.full(num_labels + 1, -1, dtype=np.int64)
+
+    def add(self, present, sums, first, last):
+        self.sums[:, present] += sums
+        self.first_frame[present] = np.where(self.first_frame[present] < 0, first, self.first_frame[present])
+        self.last_frame[present] = last
+
+    def columns(self):
+        area = self.sums[0, 1:]
+        with np.errstate(invalid='ignore', divide='ignore'): # labels without pixels get NaN
+            return {
+                'label': np.arange(1, self.num_labels + 1),
+                'frame': self.first_frame[1:],
+                'last_frame': self.last_frame[1:],
+                'area': area.astype(np.int64),
+                'centroid_y': self.sums[1, 1:] / area,
+                'centroid_x': self.sums[2, 1:] / area,
+                'mean_intensity': self.sums[3, 1:] / area,
+            }
+
 # Function to analyze images
-def analyze_images(images):
-    # Apply a Sobel filter for edge detection
-    edges = filters.sobel(images)
-    
-    # Threshold the image
-    threshold_value = filters.threshold_otsu(images)
-    binary_image = images > threshold_value
-    
-    # Label the image
-    labeled_image = measure.label(binary_image)
-    
-    # Perform regionprops analysis
-    regions = measure.regionprops(labeled_image, intensity_image=images)
-    
-    return edges, labeled_image, regions
+def analyze_images(images, block_frames=BLOCK_FRAMES, out_dir=None, workers=1, per_frame=False, timings=None,
+                   lut=None):
+    # Blocks of frames are analyzed in parallel by `workers` processes (None: one per CPU). By default the stack
+    # is one 3D volume: 3D Sobel edges and regions connected in time. per_frame=True analyzes every frame on its
+    # own (2D edges and regions), which matches running the 2D functions frame by frame.
+    # lut (e.g. StreamingHistogram.equalization_lut() of an 8- or 16-bit stack) preprocesses every block in the
+    # workers, and the threshold is taken from the histogram of the raw stack mapped through it: the results match
+    # analyzing preprocess_images(images), but the preprocessed stack is never written.
+    # Every pass over the frames runs in the workers, which write edges and labels straight into the output files;
+    # the parent only merges labels across blocks and adds up the region sums. With several workers and no out_dir
+    # the outputs are staged in a temporary directory and loaded into memory at the end. `timings`, if given, is
+    # filled with the seconds spent in each stage.
+    workers = workers or os.cpu_count()
+    timings = {} if timings is None else timings
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(workers) as pool:
+            if out_dir is not None:
+                return _analyze_images(images, block_frames, out_dir, pool, per_frame, timings, lut)
+            with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as staging:
+                edges, labeled_image, regions = _analyze_images(images, block_frames, staging, pool, per_frame,
+                                                                timings, lut)
+                return np.array(edges), np.array(labeled_image), regions
+    return _analyze_images(images, block_frames, out_dir, 1, per_frame, timings, lut)
+
+def _analyze_images(images, block_frames, out_dir, workers, per_frame, timings, lut):
+    # Threshold the image with the Otsu threshold of the whole stack
+    clock = time.perf_counter()
+    if lut is not None:
+        hist = StreamingHistogram.from_stack(images, block_frames, workers)
+        threshold_value = filters.threshold_otsu(hist=hist.mapped_histogram(lut))
+    elif StreamingHistogram.supports(images.dtype):
+        threshold_value = StreamingHistogram.from_stack(images, block_frames, workers).otsu()
+    else:
+        threshold_value = filters.threshold_otsu(hist=stack_histogram(images, block_frames=block_frames,
+                                                                      workers=workers))
+    timings['threshold'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    # Apply a Sobel filter for edge detection and label the image, block by block. In 3D every block reads one
+    # neighbouring frame on each side for the Sobel filter. Labels are numbered from 1 in every block for now.
+    dtype = images.dtype if lut is None else lut.dtype
+    edges_dtype = np.float32 if dtype in (np.float16, np.float32) else np.float64 # as filters.sobel returns
+    edges = output_array(out_dir, 'edges', images.shape, edges_dtype)
+    labeled_image = output_array(out_dir, 'labels', images.shape, np.int64)
+    targets = (edges, labeled_image) if out_dir is None else (edges.filename, labeled_image.filename)
+    blocks = {} # start -> (offset of the block's labels in the whole stack, number of labels)
+    offset = 0
+    pairs = []
+    last = None # labels of the last frame of the previous block, in the numbering of the whole stack
+    for start, _, (count, first, block_last) in map_blocks(_label_block, images, block_frames, 0 if per_frame else 1,
+                                                           workers, (threshold_value, per_frame, lut, *targets)):
+        if last is not None and not per_frame:
+            pairs.append(_boundary_pairs(last, np.where(first > 0, first + offset, 0)))
+        last = np.where(block_last > 0, block_last + offset, 0)
+        blocks[start] = (offset, count)
+        offset += count
+    timings['label'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    # Merge regions that touch across blocks; every block gets the compact slice of the label map it needs
+    if per_frame:
+        label_map, num_labels = np.arange(offset + 1), offset
+    else:
+        label_map, num_labels = _merge_map(pairs, offset)
+    def block_map(start, stop):
+        block_offset, count = blocks[start]
+        return (np.concatenate([[0], label_map[block_offset + 1:block_offset + count + 1]]),)
+    timings['merge'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    # Relabel and measure the regions in the workers (one row per region, see region_table)
+    totals = _RegionTotals(num_labels)
+    for _, _, sums in map_blocks(_measure_block, images, block_frames, 0, workers, (lut, targets[1]), block_map):
+        totals.add(*sums)
+    timings['measure'] = time.perf_counter() - clock
+    return edges, labeled_image, totals.columns()
+
+# Function to measure labeled regions without building a Python object per region: every property is a sum over
+# the region's pixels, accumulated for all labels at once with np.bincount, one block of frames at a time.
+# Returns columns (arrays with one row per label 1..num_labels) like load_frame_metadata(): label, frame and
+# last_frame (first and last frame the region is in), area (pixels), centroid_y, centroid_x, mean_intensity.
+def region_table(labeled_image, intensity_image, block_frames=BLOCK_FRAMES, num_labels=None):
+    if num_labels is None:
+        num_labels = max((int(block.max()) for _, _, block, _ in iter_blocks(labeled_image, block_frames)), default=0)
+    totals = _RegionTotals(num_labels)
+    for (start, _, labels, _), (_, _, intensity, _) in zip(iter_blocks(labeled_image, block_frames),
+                                                           iter_blocks(intensity_image, block_frames)):
+        totals.add(*_region_sums(start, labels, intensity))
+    return totals.columns()
+
+# Function to save a region table as Parquet (needs pandas and pyarrow)
+def save_region_table(filename, regions):
+    import pandas as pd
+
+    pd.DataFrame(regions).to_parquet(filename, index=False)
 
 # Function to display results
 def display_results(images, edges, labeled_image, regions):
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(1, 3, figsize=(15, 5))
     ax = axes.ravel()
     
@@ -50,23 +295,52 @@ def display_results(images, edges, labeled_image, regions):
     plt.tight_layout()
     plt.show()
     
-    print(f"Number of regions: {len(regions)}")
-    for region in regions:
-        print(f"Region: {region.label}, Area: {region.area}, Mean Intensity: {region.mean_intensity}")
+    # The first regions only; the full table is saved with save_region_table()
+    num_regions = len(regions['label'])
+    print(f"Number of regions: {num_regions}")
+    for label, area, mean_intensity in zip(regions['label'][:20], regions['area'][:20], regions['mean_intensity'][:20]):
+        print(f"Region: {label}, Area: {area}, Mean Intensity: {mean_intensity}")
+    if num_regions > 20:
+        print(f"... and {num_regions - 20} more regions")
+
+# Function to run the whole analysis of a stack with every stage cached (see AnalysisCache): a re-run, or a run
+# that only changes a later stage, loads the unchanged stages memory-mapped from the cache instead of recomputing.
+# 8- and 16-bit stacks are equalized through a lookup table inside the analysis, so only the table is cached and
+# the returned preprocessed images are a MappedStack view of the raw stack; other stacks are preprocessed to disk.
+def analyze_stack(filepath, cache_dir=None, cache_gb=CACHE_GB, per_frame=False, workers=1):
+    images = load_tiff_stack(filepath)
+    cache = AnalysisCache(cache_dir or os.path.join(os.path.dirname(os.path.abspath(filepath)), CACHE_DIR), cache_gb)
+    
+    # Preprocess the images: the equalization lookup table, or the equalized stack
+    analyzed_images, lut = images, None
+    if StreamingHistogram.supports(images.dtype):
+        preprocess_key, preprocessed = cache.run(
+            'equalize', [file_fingerprint(filepath)], {'dtype': 'float32'},
+            lambda out_dir: {'lut': StreamingHistogram.from_stack(images, workers=workers).equalization_lut()})
+        lut = np.array(preprocessed['lut']) # small, and sent to every worker
+        images_preprocessed = MappedStack(images, lut)
+    else:
+        preprocess_key, preprocessed = cache.run(
+            'preprocess', [file_fingerprint(filepath)], {'dtype': 'float32'},
+            lambda out_dir: {'preprocessed': preprocess_images(images, out_dir=out_dir)})
+        images_preprocessed = analyzed_images = preprocessed['preprocessed']
+    
+    # Analyze the images
+    _, analyzed = cache.run(
+        'analyze', [preprocess_key], {'per_frame': per_frame},
+        lambda out_dir: dict(zip(['edges', 'labels', 'regions'],
+                                 analyze_images(analyzed_images, out_dir=out_dir, workers=workers,
+                                                per_frame=per_frame, lut=lut))))
+    return images_preprocessed, analyzed['edges'], analyzed['labels'], analyzed['regions']
 
 # Main analysis function
 def main():
     # Path to the TIFF stack
     filepath = r'D:\Mapping\Animals\sb07\D1-Baseline\01-Jul-2024\Frames_1_512_512_uint16_0001.tif'
     
-    # Load the images
-    images = load_tiff_stack(filepath)
-    
-    # Preprocess the images
-    images_preprocessed = preprocess_images(images)
-    
-    # Analyze the images
-    edges, labeled_image, regions = analyze_images(images_preprocessed)
+    # Load, preprocess and analyze the images (lazily, the stack can be larger than memory), or reuse the cache
+    images_preprocessed, edges, labeled_image, regions = analyze_stack(filepath)
+    save_region_table(os.path.splitext(filepath)[0] + '_regions.parquet', regions)
     
     # Display the results
     display_results(images_preprocessed, edges, labeled_image, regions)
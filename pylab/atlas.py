@@ -0,0 +1,136 @@
+import json
+import os
+
+import numpy as np
+
+ATLAS_DIR = os.path.join(os.path.expanduser('~'), '.pylab', 'allen_atlas') # local atlas (allensdk manifest directory)
+REFERENCE_SPACE_KEY = 'annotation/ccf_2022'
+RESOLUTIONS = (10, 25, 50, 100) # microns per voxel of the Allen CCF annotation volumes
+
+# NRRD sample types of annotation volumes -> numpy dtype (without byte order)
+_NRRD_TYPES = {
+    'unsigned int': 'u4', 'uint': 'u4', 'uint32': 'u4', 'uint32_t': 'u4', 'unsigned short': 'u2',
+    'ushort': 'u2', 'uint16': 'u2', 'uint16_t': 'u2', 'int': 'i4', 'int32': 'i4', 'int32_t': 'i4',
+}
+
+
+def read_annotation_volume(filename):
+    """
+    Read an annotation volume (NRRD) as an (AP, DV, ML) array: memory-mapped when the data are stored raw,
+    loaded with pynrrd otherwise (e.g. gzip-encoded)
+    """
+    import nrrd
+
+    with open(filename, 'rb') as fh:
+        header = nrrd.read_header(fh)
+        offset = fh.tell()
+    if header.get('encoding') == 'raw' and header.get('type') in _NRRD_TYPES and 'data file' not in header:
+        dtype = np.dtype(_NRRD_TYPES[header['type']]).newbyteorder('>' if header.get('endian') == 'big' else '<')
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=tuple(header['sizes']), order='F')
+    data, _ = nrrd.read(filename)
+    return data
+
+
+def dorsal_projection(volume, slab=64):
+    """
+    Label of the first labeled voxel from the dorsal surface down, for every (AP, ML) position of an
+    (AP, DV, ML) annotation volume; 0 outside the brain. The volume is read in slabs along ML (contiguous for
+    volumes in NRRD order), so only one slab is in memory at a time.
+    """
+    projection = np.zeros((volume.shape[0], volume.shape[2]), dtype=volume.dtype)
+    for start in range(0, volume.shape[2], slab):
+        block = np.asarray(volume[:, :, start:start + slab])
+        labeled = block != 0
+        first = np.argmax(labeled, axis=1) # first labeled voxel along DV, or 0 if there is none
+        surface = np.take_along_axis(block, first[:, np.newaxis, :], axis=1)[:, 0, :]
+        projection[:, start:start + slab] = np.where(labeled.any(axis=1), surface, 0)
+    return projection
+
+
+class AtlasStore:
+    '''
+    Local store of the Allen CCF annotation for segmenting 2D widefield frames. The first time a resolution is
+    used, the dorsal-surface label projection (see dorsal_projection()) is computed from the annotation volume
+    and saved next to it, as compact uint16 region indices plus a lookup table of Allen structure IDs; later
+    runs memory-map these small files and start in milliseconds, without network access or the volume.
+
+    Annotation volumes are read from the allensdk cache layout under `directory`
+    (<directory>/annotation/ccf_2022/annotation_<resolution>.nrrd). A missing volume is downloaded once through
+    allensdk's ReferenceSpaceCache if `download` is set; a projection at a coarser resolution is derived from a
+    local finer projection instead, when there is one.
+
+        atlas = AtlasStore()
+        labels = atlas.dorsal_labels(10) # (AP, ML) indices into atlas.region_ids(10), 0 outside the brain
+        annotation = atlas.dorsal_annotation(10) # the same as Allen structure IDs
+
+    Parameters:
+    - directory (str): local atlas directory (default: ATLAS_DIR)
+    - reference_space_key (str): annotation version (default: REFERENCE_SPACE_KEY)
+    - download (bool): download missing annotation volumes with allensdk (default: True)
+    '''
+    def __init__(self, directory=ATLAS_DIR, reference_space_key=REFERENCE_SPACE_KEY, download=True):
+        self.directory = directory
+        self.reference_space_key = reference_space_key
+        self.download = download
+        self.projection_dir = os.path.join(directory, reference_space_key, 'dorsal_projection')
+
+    def volume_filename(self, resolution):
+        return os.path.join(self.directory, self.reference_space_key, f'annotation_{resolution}.nrrd')
+
+    def _projection_filenames(self, resolution):
+        stem = os.path.join(self.projection_dir, f'dorsal_{resolution}um')
+        return stem + '_labels.npy', stem + '_region_ids.npy', stem + '.json'
+
+    def annotation_volume(self, resolution):
+        """The (AP, DV, ML) annotation volume at a resolution, read from the local store (downloaded if missing)"""
+        filename = self.volume_filename(resolution)
+        if not os.path.exists(filename):
+            if not self.download:
+                raise FileNotFoundError(f"No local annotation volume {filename} and downloading is disabled")
+            from allensdk.core.reference_space_cache import ReferenceSpaceCache
+
+            manifest = os.path.join(self.directory, 'manifest.json')
+            ReferenceSpaceCache(reference_space_key=self.reference_space_key, resolution=resolution,
+                                manifest=manifest).get_annotation_volume()
+        return read_annotation_volume(filename)
+
+    def save_projection(self, resolution, projection):
+        """Store a dorsal projection (Allen structure IDs) as compact region indices and their lookup table"""
+        region_ids, labels = np.unique(projection, return_inverse=True)
+        if region_ids[0] != 0:
+            region_ids = np.concatenate([[0], region_ids]) # index 0 is always outside the brain
+            labels += 1
+        labels_filename, ids_filename, info_filename = self._projection_filenames(resolution)
+        os.makedirs(self.projection_dir, exist_ok=True)
+        dtype = np.uint16 if len(region_ids) <= np.iinfo(np.uint16).max + 1 else np.uint32
+        np.save(labels_filename, labels.reshape(projection.shape).astype(dtype))
+        np.save(ids_filename, region_ids.astype(np.uint32))
+        with open(info_filename, 'w') as fh:
+            json.dump({'reference_space_key': self.reference_space_key, 'resolution_um': resolution,
+                       'shape': list(projection.shape), 'regions': len(region_ids) - 1,
+                       'axes': ['anterior-posterior', 'medial-lateral']}, fh, indent=2)
+
+    def _build_projection(self, resolution):
+        # A finer projection already in the store is subsampled (nearest voxel) rather than reading a volume
+        for finer in sorted(r for r in RESOLUTIONS if r < resolution and resolution % r == 0):
+            if os.path.exists(self._projection_filenames(finer)[0]):
+                step = resolution // finer
+                self.save_projection(resolution, self.dorsal_annotation(finer)[step // 2::step, step // 2::step])
+                return
+        self.save_projection(resolution, dorsal_projection(self.annotation_volume(resolution)))
+
+    def dorsal_labels(self, resolution=10):
+        """(AP, ML) memory-mapped region indices (uint16) of the dorsal surface, built on first use"""
+        labels_filename = self._projection_filenames(resolution)[0]
+        if not os.path.exists(labels_filename):
+            self._build_projection(resolution)
+        return np.load(labels_filename, mmap_mode='r')
+
+    def region_ids(self, resolution=10):
+        """Lookup table of region index -> Allen structure ID (index 0, outside the brain, is ID 0)"""
+        self.dorsal_labels(resolution)
+        return np.load(self._projection_filenames(resolution)[1])
+
+    def dorsal_annotation(self, resolution=10):
+        """(AP, ML) Allen structure IDs of the dorsal surface"""
+        return self.region_ids(resolution)[self.dorsal_labels(resolution)]
@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Seconds a blocked put() waits before checking again that the writer is still running
+CONSUMER_POLL_INTERVAL = 0.1
+
+
+class WriterFailedError(RuntimeError):
+    """Raised by put() when the writer consuming the buffer has failed, so the producer stops instead of blocking"""
+
+
+def check_consumer(consumer):
+    """Raise WriterFailedError if the writer registered as a buffer's consumer has failed"""
+    error = getattr(consumer, 'error', None)
+    if error is not None:
+        raise WriterFailedError(f"The frame writer failed: {error!r}") from error
+
+
+def dtype_for_core(mmc):
+    """Return the numpy dtype of the images produced by the current camera"""
+    bytes_per_pixel = mmc.getBytesPerPixel()
+    if bytes_per_pixel == 1:
+        return np.dtype(np.uint8)
+    if bytes_per_pixel == 2:
+        return np.dtype(np.uint16)
+    return np.dtype(np.uint32)
+
+
+class FrameRingBuffer:
+    '''
+    Fixed-capacity ring buffer for handing frames from the acquisition pump to the writer thread.
+    All slots live in one preallocated (capacity, height, width) array that is reused for the whole
+    acquisition, so no memory is allocated per frame. The buffer mimics the queue.Queue interface
+    used by FrameSavingThread (put / get / task_done / empty / qsize):
+
+    - put() copies a frame into the next free slot and advances the producer cursor (head)
+    - get() returns a view of the next unread slot without copying
+    - task_done() releases the oldest slot(s) handed out by get() and advances the consumer cursor (tail)
+
+    When every slot is in use put() blocks until the writer releases one; each time this happens it is
+    counted in `backpressure_events`, and put() raises queue.Full if the wait times out. The writer registers
+    itself as `consumer`; put() checks its `error` on every call and every wake-up and raises
+    WriterFailedError once it is set, so a failed writer never leaves the producer waiting forever.
+    The buffer supports a single producer and a single consumer.
+
+    Parameters:
+    - capacity (int): number of frame slots
+    - frame_shape (tuple): (height, width) of each frame
+    - dtype (numpy dtype): pixel type of the frames (default: uint16)
+    '''
+    def __init__(self, capacity, frame_shape, dtype=np.uint16):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least one frame")
+        self.capacity = capacity
+        self.frames = np.empty((capacity,) + tuple(frame_shape), dtype=dtype)
+        self.head = 0 # total frames written by the producer
+        self.tail = 0 # total frames released by the consumer
+        self._read = 0 # total frames handed to the consumer by get()
+        self.backpressure_events = 0
+        self.max_fill = 0
+        self.consumer = None # writer reading from the buffer, checked for failure by put()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    @classmethod
+    def for_core(cls, mmc, max_bytes=1024 * 1024**2, max_frames=None):
+        """Size a ring buffer for the current camera, using at most max_bytes (default 1 GB) of memory"""
+        dtype = dtype_for_core(mmc)
+        frame_shape = (mmc.getImageHeight(), mmc.getImageWidth())
+        frame_nbytes = frame_shape[0] * frame_shape[1] * dtype.itemsize
+        capacity = max(2, max_bytes // frame_nbytes)
+        if max_frames:
+            capacity = max(2, min(capacity, max_frames))
+        return cls(capacity, frame_shape, dtype)
+
+    @property
+    def frame_shape(self):
+        return self.frames.shape[1:]
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def fill_level(self):
+        """Fraction of slots that hold frames not yet released by the consumer"""
+        return (self.head - self.tail) / self.capacity
+
+    def put(self, frame, block=True, timeout=None):
+        """Copy a frame into the next free slot, waiting for the consumer if the buffer is full"""
+        with self._not_full:
+            check_consumer(self.consumer)
+            if self.head - self.tail >= self.capacity:
+                self.backpressure_events += 1
+                if not block:
+                    raise queue.Full
+                deadline = None if timeout is None else time.perf_counter() + timeout
+                while self.head - self.tail >= self.capacity:
+                    wait = CONSUMER_POLL_INTERVAL
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.perf_counter())
+                        if wait <= 0:
+                            raise queue.Full
+                    self._not_full.wait(wait)
+                    check_consumer(self.consumer)
+            slot = self.head % self.capacity
+        # The slot is invisible to the consumer until head moves, so copy outside the lock
+        np.copyto(self.frames[slot], frame, casting='unsafe')
+        with self._not_empty:
+            self.head += 1
+            self.max_fill = max(self.max_fill, self.head - self.tail)
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """Return a view of the next unread frame; call task_done() when finished with it"""
+        with self._not_empty:
+            if self._read >= self.head:
+                if not block or not self._not_empty.wait_for(lambda: self._read < self.head, timeout):
+                    raise queue.Empty
+            slot = self._read % self.capacity
+            self._read += 1
+        return self.frames[slot]
+
+    def get_many(self, max_frames, block=True, timeout=None):
+        """
+        Return a view of up to max_frames consecutive unread frames without copying.
+        Waits until max_frames are available (fewer if the block would wrap around the end of the ring)
+        or until timeout expires, then returns whatever is available. Call task_done(len(block)) when
+        finished with the block.
+        """
+        with self._not_empty:
+            slot = self._read % self.capacity
+            wanted = min(max_frames, self.capacity - slot)
+            if block and self.head - self._read < wanted:
+                self._not_empty.wait_for(lambda: self.head - self._read >= wanted, timeout)
+            count = min(wanted, self.head - self._read)
+            if count == 0:
+                raise queue.Empty
+            self._read += count
+        return self.frames[slot:slot + count]
+
+    def task_done(self, count=1):
+        """Release the oldest `count` slots handed out by get() so the producer can reuse them"""
+        with self._not_full:
+            if self.tail + count > self._read:
+                raise ValueError("task_done() called more times than frames were read")
+            self.tail += count
+            self._not_full.notify()
+
+    def qsize(self):
+        """Number of frames written but not yet read"""
+        return self.head - self._read
+
+    def empty(self):
+        return self.qsize() == 0
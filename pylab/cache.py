@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+SAMPLE_BYTES = 1024**2 # bytes read per sample when fingerprinting a file
+SAMPLES = 64 # samples spread over a file, in addition to its first and last SAMPLE_BYTES
+
+
+def _stack_files(filename):
+    """Files holding a stack: the file itself, the files of a split stack's manifest, or the files of a zarr"""
+    if os.path.isdir(filename):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(filename) for name in names)
+    files = [filename]
+    if filename.endswith('_manifest.json'):
+        directory = os.path.dirname(os.path.abspath(filename))
+        with open(filename) as fh:
+            for part in json.load(fh)['files']:
+                files += _stack_files(os.path.join(directory, part['filename']))
+    return files
+
+
+def file_fingerprint(filename, full=False):
+    """
+    Fingerprint of a stack (a file, a split stack's manifest with its files, or a zarr directory). By default
+    the size, modification time and SAMPLES evenly spread blocks of each file are hashed, which takes
+    milliseconds for multi-GB stacks; an edit that keeps the size and misses the sampled blocks is only caught
+    by the modification time, and touching a file without changing it also changes the fingerprint.
+    full=True hashes every byte instead of the modification time and samples: a pure content hash.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in _stack_files(filename):
+        stat = os.stat(path)
+        size = stat.st_size
+        digest.update(f"{os.path.basename(path)}:{size}".encode())
+        if not full:
+            digest.update(f":{stat.st_mtime_ns}".encode())
+        with open(path, 'rb') as fh:
+            if full or size <= (SAMPLES + 2) * SAMPLE_BYTES:
+                for chunk in iter(lambda: fh.read(16 * SAMPLE_BYTES), b''):
+                    digest.update(chunk)
+                continue
+            for offset in np.linspace(0, size - SAMPLE_BYTES, SAMPLES + 2).astype(np.int64):
+                fh.seek(int(offset))
+                digest.update(fh.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    '''
+    Content-addressed on-disk cache of analysis intermediates (equalized stacks, label volumes, region
+    tables), so that re-runs and parameter sweeps skip the stages whose inputs did not change.
+
+    Every entry is keyed by a stage name, its inputs (a file_fingerprint() of the stack, or the key of the
+    stage it was computed from) and its parameters, and holds named arrays as .npy files that are loaded
+    memory-mapped. A value can also be a dict of arrays (e.g. a region table), stored in a subdirectory.
+    When the cache grows beyond max_gb, the least recently used entries are deleted, except those used by this
+    AnalysisCache (their arrays may still be memory-mapped). An entry is renamed into .trash before it is
+    deleted, so it is either complete or gone: if it cannot be renamed (e.g. it is mapped by another process on
+    Windows) it is kept.
+
+        cache = AnalysisCache('.pylab_cache')
+        key, result = cache.run('preprocess', [file_fingerprint(filepath)], {'dtype': 'float32'},
+                                lambda out_dir: {'preprocessed': preprocess_images(images, out_dir=out_dir)})
+
+    Parameters:
+    - directory (str): where the entries are stored
+    - max_gb (float): size cap of the cache (default: 50)
+    '''
+    def __init__(self, directory, max_gb=50):
+        self.directory = directory
+        self.max_bytes = int(max_gb * 1024**3)
+        self.used = set() # keys loaded or computed by this cache, never evicted by it
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(stage, inputs, params=None):
+        """Key of a stage computed from `inputs` (fingerprints or keys) with `params` (JSON-serialisable)"""
+        description = json.dumps({'stage': stage, 'inputs': list(inputs), 'params': params or {}},
+                                 sort_keys=True, default=str)
+        return f"{stage}-{hashlib.blake2b(description.encode(), digest_size=16).hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), 'entry.json'))
+
+    def load(self, key):
+        """Return the arrays of an entry (memory-mapped, read-only) and mark it as recently used"""
+        path = self._path(key)
+        self.used.add(key)
+        with open(os.path.join(path, 'entry.json')) as fh:
+            entry = json.load(fh)
+        entry['last_access'] = time.time()
+        self._write_entry(path, entry)
+        value = {}
+        for name in entry['arrays']:
+            if os.path.isdir(os.path.join(path, name)):
+                value[name] = {column[:-len('.npy')]: np.load(os.path.join(path, name, column), mmap_mode='r')
+                               for column in sorted(os.listdir(os.path.join(path, name)))}
+            else:
+                value[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        return value
+
+    def run(self, stage, inputs, params, compute):
+        """
+        Return (key, arrays) of a stage, from the cache if it was computed before. Otherwise compute(out_dir)
+        is called to produce a dict of arrays; arrays it wrote to out_dir as <name>.npy are kept in place and
+        the others are saved there.
+        """
+        key = self.key(stage, inputs, params)
+        if key in self:
+            return key, self.load(key)
+        tmp_path = self._path(key) + f'.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            value = compute(tmp_path)
+            array = None
+            for name, array in value.items():
+                if isinstance(array, dict):
+                    os.makedirs(os.path.join(tmp_path, name), exist_ok=True)
+                    for column, data in array.items():
+                        np.save(os.path.join(tmp_path, name, column + '.npy'), np.asarray(data))
+                elif getattr(array, 'filename', None) != os.path.abspath(os.path.join(tmp_path, name + '.npy')):
+                    np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array))
+                elif hasattr(array, 'flush'):
+                    array.flush()
+            value = array = None # release the memory maps in the entry before it is moved
+            nbytes = sum(os.path.getsize(os.path.join(root, name))
+                         for root, _, names in os.walk(tmp_path) for name in names)
+            now = time.time()
+            self._write_entry(tmp_path, {'stage': stage, 'inputs': list(inputs), 'params': params,
+                                         'arrays': sorted(os.path.splitext(name)[0] for name in os.listdir(tmp_path)),
+                                         'nbytes': nbytes, 'created': now, 'last_access': now})
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if key not in self: # another process may have committed the same entry first
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.used.add(key)
+        self.evict()
+        return key, self.load(key)
+
+    def entries(self):
+        """Descriptions of the committed entries, least recently used first"""
+        entries = []
+        for key in os.listdir(self.directory):
+            if key in self:
+                with open(os.path.join(self._path(key), 'entry.json')) as fh:
+                    entries.append(dict(json.load(fh), key=key))
+        return sorted(entries, key=lambda entry: entry['last_access'])
+
+    @property
+    def nbytes(self):
+        return sum(entry['nbytes'] for entry in self.entries())
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits in max_gb; `keep` and used keys are never deleted"""
+        entries = self.entries()
+        total = sum(entry['nbytes'] for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry['key'] == keep or entry['key'] in self.used:
+                continue
+            if self._delete(entry['key']):
+                total -= entry['nbytes']
+
+    def clear(self):
+        for entry in self.entries():
+            self._delete(entry['key'])
+        self.used = set()
+
+    def _delete(self, key):
+        """Move an entry out of the cache, then remove it; returns False if it could not be moved"""
+        trash = os.path.join(self.directory, '.trash')
+        os.makedirs(trash, exist_ok=True)
+        target = os.path.join(trash, f"{key}-{os.getpid()}-{time.monotonic_ns()}")
+        try:
+            os.replace(self._path(key), target)
+        except OSError:
+            return False
+        for name in os.listdir(trash): # also what earlier runs could not remove
+            shutil.rmtree(os.path.join(trash, name), ignore_errors=True)
+        return True
+
+    @staticmethod
+    def _write_entry(path, entry):
+        with open(os.path.join(path, 'entry.json.tmp'), 'w') as fh:
+            json.dump(entry, fh, indent=2)
+        os.replace(os.path.join(path, 'entry.json.tmp'), os.path.join(path, 'entry.json'))
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class NIDAQRecordingBackend:
+    '''
+    Hardware-timed, buffered NI-DAQ acquisition of analog and digital input channels.
+    Analog channels run on the device's sample clock; digital lines (if any) are sampled on the same clock
+    (/<device>/ai/SampleClock), so both streams share one time base.
+
+    Parameters:
+    - device_name (str): Name of the NI-DAQ device (default: 'Dev1')
+    - ai_channels (list): analog input channels, e.g. ['ai0', 'ai1']
+    - di_channels (list): digital input lines, e.g. ['port0/line0'] (optional)
+    - rate (float): samples per second per channel (default: 1000)
+    - buffer_seconds (float): size of the driver buffer in seconds (default: 10)
+    '''
+    def __init__(self, device_name='Dev1', ai_channels=None, di_channels=None, rate=1000, buffer_seconds=10):
+        self.device_name = device_name
+        self.ai_channels = list(ai_channels or ['ai0'])
+        self.di_channels = list(di_channels or [])
+        self.rate = rate
+        self.buffer_seconds = buffer_seconds
+        self._ai_task = None
+        self._di_task = None
+
+    def start(self):
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType
+        from nidaqmx.stream_readers import AnalogMultiChannelReader, DigitalMultiChannelReader
+
+        buffer_size = int(self.rate * self.buffer_seconds)
+        self._ai_task = nidaqmx.Task()
+        for channel in self.ai_channels:
+            self._ai_task.ai_channels.add_ai_voltage_chan(f'{self.device_name}/{channel}')
+        self._ai_task.timing.cfg_samp_clk_timing(self.rate, sample_mode=AcquisitionType.CONTINUOUS,
+                                                 samps_per_chan=buffer_size)
+        self._ai_reader = AnalogMultiChannelReader(self._ai_task.in_stream)
+        if self.di_channels:
+            self._di_task = nidaqmx.Task()
+            for channel in self.di_channels:
+                self._di_task.di_channels.add_di_chan(f'{self.device_name}/{channel}')
+            self._di_task.timing.cfg_samp_clk_timing(self.rate, source=f'/{self.device_name}/ai/SampleClock',
+                                                     sample_mode=AcquisitionType.CONTINUOUS,
+                                                     samps_per_chan=buffer_size)
+            self._di_reader = DigitalMultiChannelReader(self._di_task.in_stream)
+            self._di_words = None
+            self._di_task.start() # waits for the analog sample clock
+        self._ai_task.start()
+
+    def read(self, ai_block, di_block):
+        """Fill (channels, samples) blocks with the next samples, blocking until they are acquired"""
+        samples = ai_block.shape[1]
+        self._ai_reader.read_many_sample(ai_block, number_of_samples_per_channel=samples, timeout=10.0)
+        if self._di_task is not None:
+            if self._di_words is None or self._di_words.shape != di_block.shape:
+                self._di_words = np.empty(di_block.shape, dtype=np.uint32)
+            self._di_reader.read_many_sample_port_uint32(self._di_words, number_of_samples_per_channel=samples,
+                                                         timeout=10.0)
+            np.not_equal(self._di_words, 0, out=di_block)
+
+    def stop(self):
+        for task in (self._ai_task, self._di_task):
+            if task is not None:
+                task.close()
+        self._ai_task = self._di_task = None
+
+
+class SimulatedRecordingBackend:
+    '''
+    Software stand-in for NIDAQRecordingBackend, for tests and dry runs without a DAQ.
+    Analog channels carry noisy sine waves and digital lines carry a square wave at `pulse_rate`
+    (e.g. a camera frame clock). Samples are released in real time at `rate`.
+
+    Parameters:
+    - ai_channels (list): analog channel names (default: ['ai0'])
+    - di_channels (list): digital line names (optional)
+    - rate (float): samples per second per channel (default: 1000)
+    - pulse_rate (float): frequency of the simulated digital square wave in Hz (default: 50)
+    '''
+    def __init__(self, ai_channels=None, di_channels=None, rate=1000, pulse_rate=50):
+        self.ai_channels = list(ai_channels or ['ai0'])
+        self.di_channels = list(di_channels or [])
+        self.rate = rate
+        self.pulse_rate = pulse_rate
+        self._rng = np.random.default_rng(0)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._sample = 0
+
+    def read(self, ai_block, di_block):
+        samples = ai_block.shape[1]
+        ready_at = self._start + (self._sample + samples) / self.rate
+        delay = ready_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t = (self._sample + np.arange(samples)) / self.rate
+        for channel in range(ai_block.shape[0]):
+            ai_block[channel] = np.sin(2 * np.pi * (channel + 1) * t) + 0.01 * self._rng.standard_normal(samples)
+        di_block[:] = (t * self.pulse_rate) % 1 < 0.5
+        self._sample += samples
+
+    def stop(self):
+        pass
+
+
+class DAQRecorder(threading.Thread):
+    '''
+    Background thread that records analog/digital DAQ channels for the whole session and streams them to disk.
+    Samples are read in blocks of `block_size` into two reused numpy arrays and appended to raw binary files:
+    <filename>_ai.bin (float64, samples x analog channels) and <filename>_di.bin (uint8, samples x digital lines).
+    A JSON sidecar <filename>.json records the channels, rate and a clock reference: the time.perf_counter()
+    and unix time taken right after the hardware task started. Sample k was therefore taken at about
+    perf_counter_at_start + k / rate, the same clock as the host timestamps in the frame metadata. For
+    sub-millisecond alignment also record the camera's exposure output on a digital line.
+
+    Parameters:
+    - backend (NIDAQRecordingBackend or SimulatedRecordingBackend): source of samples
+    - filename (str): path prefix of the output files
+    - block_size (int): samples per channel read per block (default: rate / 10)
+    '''
+    def __init__(self, backend, filename, block_size=None):
+        super().__init__(daemon=True)
+        self.backend = backend
+        self.filename = filename
+        self.block_size = block_size or max(1, int(backend.rate / 10))
+        self.samples_written = 0
+        self.error = None
+        self._stop_recording = threading.Event()
+
+    def run(self):
+        backend = self.backend
+        ai_block = np.zeros((len(backend.ai_channels), self.block_size), dtype=np.float64)
+        di_block = np.zeros((len(backend.di_channels), self.block_size), dtype=np.uint8)
+        block_times = []
+        try:
+            with open(self.filename + '_ai.bin', 'wb') as ai_file, open(self.filename + '_di.bin', 'wb') as di_file:
+                backend.start()
+                self.perf_counter_at_start = time.perf_counter()
+                self.unix_time_at_start = time.time()
+                self._write_header()
+                while not self._stop_recording.is_set():
+                    backend.read(ai_block, di_block)
+                    block_times.append((self.samples_written, time.perf_counter()))
+                    ai_block.T.tofile(ai_file) # samples x channels on disk
+                    di_block.T.tofile(di_file)
+                    self.samples_written += self.block_size
+        except Exception as e:
+            self.error = e
+            print(f"Error while recording DAQ channels: {e}")
+        finally:
+            backend.stop()
+            if hasattr(self, 'perf_counter_at_start'):
+                np.save(self.filename + '_blocks.npy', np.array(block_times, dtype=np.float64).reshape(-1, 2))
+                self._write_header()
+
+    def stop(self):
+        """Stop recording after the current block and wait for the files to be closed"""
+        self._stop_recording.set()
+        self.join()
+
+    def _write_header(self):
+        header = {
+            'rate': self.backend.rate,
+            'ai_channels': self.backend.ai_channels,
+            'di_channels': self.backend.di_channels,
+            'samples': self.samples_written,
+            'perf_counter_at_start': self.perf_counter_at_start,
+            'unix_time_at_start': self.unix_time_at_start,
+        }
+        with open(self.filename + '.json', 'w') as fh:
+            json.dump(header, fh, indent=2)
+
+
+def load_daq_recording(filename):
+    """
+    Open a DAQ recording written by DAQRecorder. Returns (header, analog, digital, times) where analog and
+    digital are memory-mapped (samples, channels) arrays and times the perf_counter() time of each sample.
+    """
+    with open(filename + '.json') as fh:
+        header = json.load(fh)
+    streams = []
+    for suffix, dtype, channels in (('_ai.bin', np.float64, header['ai_channels']),
+                                    ('_di.bin', np.uint8, header['di_channels'])):
+        if channels and os.path.getsize(filename + suffix):
+            streams.append(np.memmap(filename + suffix, dtype=dtype, mode='r').reshape(-1, len(channels)))
+        else:
+            streams.append(np.zeros((0, len(channels)), dtype=dtype))
+    analog, digital = streams
+    times = header['perf_counter_at_start'] + np.arange(len(analog)) / header['rate']
+    return header, analog, digital, times
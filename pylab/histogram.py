@@ -0,0 +1,154 @@
+import numpy as np
+
+from pylab.stacks import map_blocks
+
+
+class StreamingHistogram:
+    '''
+    Global histogram of an 8- or 16-bit image stack, accumulated chunk by chunk in a single pass with one bin
+    per gray value, so only one chunk has to be in memory at a time. The equalization lookup table, Otsu
+    threshold and percentiles are derived from the histogram alone and match skimage.exposure.equalize_hist,
+    skimage.filters.threshold_otsu and np.percentile on the whole stack.
+
+        hist = StreamingHistogram.from_stack(images)
+        for start, stop, block, _ in iter_blocks(images):
+            out[start:stop] = hist.equalize(block)
+
+    Parameters:
+    - dtype (numpy dtype): unsigned integer dtype of the images (default: uint16)
+    '''
+    def __init__(self, dtype=np.uint16):
+        self.dtype = np.dtype(dtype)
+        if not self.supports(self.dtype):
+            raise ValueError(f"StreamingHistogram needs 8- or 16-bit unsigned images, not {self.dtype}")
+        self.counts = np.zeros(np.iinfo(self.dtype).max + 1, dtype=np.int64)
+        self._luts = {}
+
+    @staticmethod
+    def supports(dtype):
+        """Whether images of this dtype can be histogrammed with one bin per gray value"""
+        dtype = np.dtype(dtype)
+        return dtype.kind == 'u' and dtype.itemsize <= 2
+
+    @classmethod
+    def from_stack(cls, images, block_frames=64, workers=1):
+        """Histogram of a whole (frames, height, width) stack, read one block at a time and counted by `workers`"""
+        hist = cls(images.dtype)
+        for _, _, counts in map_blocks(_block_counts, images, block_frames, workers=workers,
+                                       args=(len(hist.counts), 0)):
+            hist.counts += counts
+        return hist
+
+    def update(self, chunk):
+        """Add the pixels of a chunk (any shape) to the histogram"""
+        self.counts += np.bincount(np.asarray(chunk).ravel(), minlength=len(self.counts))
+        self._luts = {}
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    @property
+    def min(self):
+        return int(np.flatnonzero(self.counts)[0])
+
+    @property
+    def max(self):
+        return int(np.flatnonzero(self.counts)[-1])
+
+    def cdf(self):
+        """Cumulative distribution indexed by gray value"""
+        cdf = np.cumsum(self.counts, dtype=np.float64)
+        return cdf / cdf[-1]
+
+    def equalization_lut(self, dtype=np.float32):
+        """Gray value -> equalized value: the CDF in [0, 1] for float dtypes, scaled to the full range for integers"""
+        dtype = np.dtype(dtype)
+        if dtype not in self._luts:
+            cdf = self.cdf()
+            if dtype.kind == 'f':
+                self._luts[dtype] = cdf.astype(dtype)
+            else:
+                self._luts[dtype] = np.round(cdf * np.iinfo(dtype).max).astype(dtype)
+        return self._luts[dtype]
+
+    def equalize(self, chunk, dtype=np.float32):
+        """Histogram-equalize a chunk with the global histogram through a lookup table"""
+        return self.equalization_lut(dtype)[chunk]
+
+    def otsu(self):
+        """Otsu threshold of the histogram; pixels above it are foreground"""
+        lo, hi = self.min, self.max
+        if lo == hi:
+            return lo
+        counts = self.counts[lo:hi + 1].astype(np.float64)
+        values = np.arange(lo, hi + 1, dtype=np.float64)
+        # Class weights and means for every possible threshold, as in skimage.filters.threshold_otsu
+        weight1 = np.cumsum(counts)
+        weight2 = np.cumsum(counts[::-1])[::-1]
+        mean1 = np.cumsum(counts * values) / weight1
+        mean2 = (np.cumsum((counts * values)[::-1]) / weight2[::-1])[::-1]
+        variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+        return lo + int(np.argmax(variance12))
+
+    def mapped_histogram(self, lut, nbins=256):
+        """
+        Histogram (counts, bin centers) of the stack mapped through `lut`, as stack_histogram() would compute it
+        from lut[images], without mapping a single pixel: every gray value carries its count to its mapped value
+        """
+        present = np.flatnonzero(self.counts)
+        values, weights = lut[present], self.counts[present]
+        if np.issubdtype(lut.dtype, np.integer):
+            lo, hi = int(values.min()), int(values.max())
+            hist = np.bincount(values.astype(np.int64) - lo, weights=weights, minlength=hi - lo + 1)
+            return hist.astype(np.int64), np.arange(lo, hi + 1)
+        lo, hi = values.min(), values.max()
+        hist = np.histogram(values, bins=nbins, range=(lo, hi), weights=weights)[0].astype(np.int64)
+        bin_edges = np.histogram_bin_edges([], bins=nbins, range=(lo, hi))
+        return hist, (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    def percentile(self, q):
+        """Percentile(s) of the gray values, with np.percentile's linear interpolation"""
+        q = np.asarray(q, dtype=np.float64)
+        position = q / 100 * (self.total - 1)
+        below = np.floor(position)
+        cumulative = np.cumsum(self.counts)
+        # Gray value of the pixel at a sorted position: the first value whose cumulative count exceeds it
+        lower = np.searchsorted(cumulative, below, side='right')
+        upper = np.searchsorted(cumulative, np.minimum(below + 1, self.total - 1), side='right')
+        return lower + (position - below) * (upper - lower)
+
+
+def _block_counts(start, block, core, length, lo):
+    """Counts of every integer value from lo in a block"""
+    return np.bincount(block[core].ravel().astype(np.int64) - lo if lo else block[core].ravel(), minlength=length)
+
+
+def _block_range(start, block, core):
+    return block[core].min(), block[core].max()
+
+
+def _block_histogram(start, block, core, nbins, lo, hi):
+    return np.histogram(block[core], bins=nbins, range=(lo, hi))[0]
+
+
+def stack_histogram(images, nbins=256, block_frames=64, workers=1):
+    """
+    Histogram (counts, bin centers) of a whole stack as computed by skimage.exposure.histogram, for stacks
+    that StreamingHistogram does not support (e.g. float): one pass for the range, one for the counts
+    """
+    lo, hi = np.inf, -np.inf
+    for _, _, (block_lo, block_hi) in map_blocks(_block_range, images, block_frames, workers=workers):
+        lo, hi = min(lo, block_lo), max(hi, block_hi)
+    if np.issubdtype(images.dtype, np.integer):
+        # One bin per integer value between the stack's minimum and maximum
+        lo, hi = int(lo), int(hi)
+        hist = np.zeros(hi - lo + 1, dtype=np.int64)
+        for _, _, counts in map_blocks(_block_counts, images, block_frames, workers=workers, args=(len(hist), lo)):
+            hist += counts
+        return hist, np.arange(lo, hi + 1)
+    hist = np.zeros(nbins, dtype=np.int64)
+    for _, _, counts in map_blocks(_block_histogram, images, block_frames, workers=workers, args=(nbins, lo, hi)):
+        hist += counts
+    bin_edges = np.histogram_bin_edges([], bins=nbins, range=(lo, hi))
+    return hist, (bin_edges[:-1] + bin_edges[1:]) / 2
@@ -0,0 +1,169 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Storage backends whose files stay valid up to the last synced frame and can be recovered after a crash
+JOURNAL_BACKENDS = ('memmap', 'zarr')
+
+
+def journal_filename(filename):
+    """Path of the journal that belongs to a stack"""
+    return os.path.splitext(filename)[0] + '_journal.jsonl'
+
+
+class StackJournal:
+    '''
+    Append-only journal of the frames that are safely on disk, written next to the stack as
+    <stem>_journal.jsonl. The first line describes the stack (backend, frame shape, dtype); every sync()
+    flushes the writer's data and the frame metadata to disk and then appends one line with the number of
+    frames written so far (and the file they are in, for split stacks). Each line is fsync'ed before the
+    next batch is written, so after a crash the last complete line is a frame count the files are known to
+    hold. recover_stack() uses it to finalise the stack without reading the image data.
+
+    Parameters:
+    - filename (str): the stack being written
+    - interval (float): minimum seconds between syncs (default: 5.0)
+    '''
+    def __init__(self, filename, interval=5.0):
+        self.filename = filename
+        self.journal_filename = journal_filename(filename)
+        self.interval = interval
+        self.committed_frames = 0
+        self._fh = None
+        self._last_sync = 0.0
+
+    def open(self, writer, backend, num_frames, frame_shape, dtype):
+        """Start the journal with a description of the stack"""
+        self._fh = open(self.journal_filename, 'w')
+        self._last_sync = time.perf_counter()
+        self._append({
+            'filename': os.path.basename(self.filename),
+            'backend': backend,
+            'num_frames': num_frames,
+            'frame_shape': list(frame_shape),
+            'dtype': np.dtype(dtype).str,
+            'split': hasattr(writer, 'manifest_filename'),
+        })
+
+    def sync(self, writer, metadata=None, force=False):
+        """Make the frames written so far durable and record their number, at most once per interval"""
+        now = time.perf_counter()
+        if self._fh is None or (not force and now - self._last_sync < self.interval):
+            return
+        self.committed_frames = writer.sync()
+        if metadata is not None:
+            metadata.flush()
+        self._append({
+            'frames': self.committed_frames,
+            'file': os.path.basename(getattr(writer, 'current_filename', self.filename)),
+            'first_frame': getattr(writer, 'current_first_frame', 0),
+            'time': time.time(),
+        })
+        self._last_sync = now
+
+    def close(self, frames):
+        """Record that the stack was closed cleanly with `frames` frames"""
+        if self._fh is None:
+            return
+        self._append({'frames': frames, 'closed': True, 'time': time.time()})
+        self._fh.close()
+        self._fh = None
+
+    def _append(self, record):
+        self._fh.write(json.dumps(record) + '\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+
+def read_journal(filename):
+    """Return the complete records of a journal; a line cut off by a crash is ignored"""
+    records = []
+    with open(filename) as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def _recover_file(backend, filename, frames):
+    """Cut one stack file down to `frames` frames by rewriting its structure only; a TIFF left empty is removed"""
+    from pylab.writers import truncate_tiff_pages
+
+    if backend == 'memmap':
+        if frames:
+            truncate_tiff_pages(filename, frames)
+        else:
+            os.remove(filename) # a TIFF cannot hold zero pages, and this one is still full-size
+    elif backend == 'zarr':
+        zarray_filename = os.path.join(filename, '.zarray')
+        with open(zarray_filename) as fh:
+            zarray = json.load(fh)
+        zarray['shape'][0] = frames
+        with open(zarray_filename, 'w') as fh:
+            json.dump(zarray, fh, indent=4)
+    else:
+        raise ValueError(f"Stacks written with the {backend!r} backend cannot be recovered")
+
+
+def _recover_metadata(filename, frames):
+    """Set the row count of a frame metadata file to the frames recovered (or fewer, if fewer were recorded)"""
+    record = np.load(filename, mmap_mode='r+')
+    host_time = record['host_time'][0]
+    unrecorded = np.flatnonzero(host_time == 0)
+    recorded = int(unrecorded[0]) if len(unrecorded) else len(host_time)
+    record['count'][0] = min(frames, recorded)
+    record.flush()
+    return int(record['count'][0])
+
+
+def recover_stack(filename):
+    """
+    Finalise a stack whose acquisition was interrupted, using its journal: the stack (or the file of a split
+    stack that was being written), its manifest and the frame metadata are cut down to the last journaled
+    frame count. Only file headers and the small metadata file are rewritten; a TIFF file that holds no
+    journaled frame is removed. Returns the number of frames recovered.
+    """
+    records = read_journal(journal_filename(filename))
+    if not records:
+        raise ValueError(f"The journal of {filename} is empty")
+    header, commits = records[0], records[1:]
+    if commits and commits[-1].get('closed'):
+        print(f"{filename} was closed cleanly with {commits[-1]['frames']} frames, nothing to recover")
+        return commits[-1]['frames']
+    last = commits[-1] if commits else {'frames': 0, 'file': None, 'first_frame': 0}
+    frames = last['frames']
+    directory = os.path.dirname(os.path.abspath(filename))
+    stem = os.path.splitext(filename)[0]
+
+    if header['split']:
+        manifest_filename = stem + '_manifest.json'
+        parts = []
+        if os.path.exists(manifest_filename):
+            with open(manifest_filename) as fh:
+                parts = [part for part in json.load(fh)['files'] if part['first_frame'] < last['first_frame']]
+        if last['file'] is not None:
+            _recover_file(header['backend'], os.path.join(directory, last['file']), frames - last['first_frame'])
+            if frames > last['first_frame']:
+                parts.append({'filename': last['file'], 'first_frame': last['first_frame'],
+                              'frames': frames - last['first_frame']})
+        manifest = {'backend': header['backend'], 'frames': frames, 'frame_shape': header['frame_shape'],
+                    'dtype': header['dtype'], 'files': parts}
+        with open(manifest_filename, 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+    else:
+        _recover_file(header['backend'], filename, frames)
+
+    metadata_filename = stem + '_frame_metadata.npy'
+    if os.path.exists(metadata_filename):
+        rows = _recover_metadata(metadata_filename, frames)
+        if rows < frames:
+            print(f"WARNING: frame metadata was only recorded for {rows} of {frames} frames")
+
+    with open(journal_filename(filename), 'a') as fh:
+        fh.write(json.dumps({'frames': frames, 'closed': True, 'recovered': True, 'time': time.time()}) + '\n')
+    print(f"Recovered {frames} frames of {filename}")
+    return frames
@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+
+# Camera metadata tags captured for every frame, as column name -> Micro-Manager tag
+FRAME_TAGS = {
+    'image_number': 'ImageNumber',
+    'camera_time_ms': 'ElapsedTime-ms',
+}
+
+
+class FrameMetadataBuffer:
+    '''
+    Preallocated, columnar store of per-frame metadata that lives in a memory-mapped .npy file next to the
+    image stack. Each column (frame index, host timestamp, and the camera tags in FRAME_TAGS) is one
+    contiguous array of length num_frames, so recording a frame only writes a few numbers into existing
+    arrays: no Python objects are built per frame. flush() pushes the rows recorded so far to disk and
+    updates the row count stored in the file, so the file is readable at any time with load_frame_metadata().
+
+    Host timestamps come from time.perf_counter(); the file also stores one (perf_counter, unix time) pair
+    taken when the buffer was created to convert them to wall-clock time.
+
+    Parameters:
+    - filename (str): path of the .npy file to create
+    - num_frames (int): number of rows to preallocate
+    - tags (dict): column name -> metadata tag to capture (default: FRAME_TAGS)
+    '''
+    def __init__(self, filename, num_frames, tags=FRAME_TAGS):
+        self.filename = filename
+        self.num_frames = num_frames
+        self.tags = dict(tags)
+        fields = [('count', '<i8'), ('perf_counter_origin', '<f8'), ('unix_time_origin', '<f8'),
+                  ('frame_index', '<i8', (num_frames,)), ('host_time', '<f8', (num_frames,))]
+        fields += [(name, '<f8', (num_frames,)) for name in self.tags]
+        self._mm = np.lib.format.open_memmap(filename, mode='w+', dtype=np.dtype(fields), shape=(1,))
+        self._mm['perf_counter_origin'][0] = time.perf_counter()
+        self._mm['unix_time_origin'][0] = time.time()
+        self.columns = {name: self._mm[name][0] for name in ['frame_index', 'host_time', *self.tags]}
+        self._tag_columns = [(self.columns[name], tag) for name, tag in self.tags.items()]
+        self.count = 0
+        self._last_flush = 0.0
+
+    def record(self, frame_index, md, host_time):
+        """Store one frame's index, host timestamp and camera tags (from popNextImageAndMD) in the next row"""
+        row = self.count
+        if row >= self.num_frames:
+            return
+        self.columns['frame_index'][row] = frame_index
+        self.columns['host_time'][row] = host_time
+        for column, tag in self._tag_columns:
+            try:
+                # pymmcore_plus.Metadata.get() raises KeyError for a missing tag unless given a default
+                column[row] = float(md.get(tag, None))
+            except (TypeError, ValueError):
+                column[row] = np.nan
+        self.count = row + 1
+
+    def flush(self, min_interval=0.0):
+        """Write recorded rows to disk, at most once every min_interval seconds"""
+        now = time.perf_counter()
+        if self._mm is None or now - self._last_flush < min_interval:
+            return
+        self._mm['count'][0] = self.count
+        self._mm.flush()
+        self._last_flush = now
+
+    def close(self):
+        self.flush()
+        self._mm = None
+
+
+def load_frame_metadata(filename):
+    """Load a per-frame metadata file as a dict of column name -> array, trimmed to the recorded rows"""
+    record = np.load(filename, mmap_mode='r')
+    count = int(record['count'][0])
+    columns = {}
+    for name in record.dtype.names:
+        if record.dtype[name].shape:
+            columns[name] = np.array(record[name][0][:count])
+    columns['unix_time'] = columns['host_time'] - record['perf_counter_origin'][0] + record['unix_time_origin'][0]
+    return columns
@@ -1,11 +1,8 @@
-from pymmcore_plus import CMMCorePlus
 import numpy as np
 import tifffile
 import os
 from datetime import datetime
-from napari import Viewer, run
 from qtpy.QtWidgets import QCheckBox, QPushButton, QWidget, QVBoxLayout, QLineEdit, QLabel, QFormLayout, QProgressBar
-import nidaqmx
 
 from typing import TYPE_CHECKING
 
@@ -13,7 +10,6 @@ if TYPE_CHECKING:
     import napari
 
 import time
-import pandas as pd
 
 #SAVE_DIR = r'C:/dev/sipefield/devOutput'
 SAVE_NAME = r'Acquisition_test'
@@ -23,9 +19,20 @@ NIDAQ_DEVICE = 'Dev1'
 CHANNELS = ['port2/line0']
 IO = 'input' # is the NIDAQ an INput or Output Device?
 
-print("loading Micro-Manager CORE...")
-mmc = CMMCorePlus.instance()
-mmc.loadSystemConfiguration(MM_CONFIG)
+mmc = None # Micro-Manager core, loaded by load_core() when an acquisition or the interface first needs it
+
+
+def load_core(config_file=MM_CONFIG):
+    """Return the shared CMMCorePlus, loading the Micro-Manager configuration on first use"""
+    global mmc
+    if mmc is None:
+        from pymmcore_plus import CMMCorePlus
+
+        print("loading Micro-Manager CORE...")
+        mmc = CMMCorePlus.instance()
+        mmc.loadSystemConfiguration(config_file)
+    return mmc
+
 
 # Default parameters for file saving
 save_dir = r'F:/sbaskar/202407_SB_F31prelim_pupil'
@@ -55,11 +62,15 @@ class Output:
         metadata_dir = os.path.join(save_dir, f"{self.protocol}-{self.subject_id}", f"ses-{self.session_id}", "metadata")
         os.makedirs(metadata_dir, exist_ok=True) # create the directory if it doesn't exist
         filename = os.path.join(metadata_dir, f"sub-{self.subject_id}_ses-{self.session_id}_{timestamp}.csv")
+        import pandas as pd
+
         df = pd.DataFrame(metadata)
         df.to_csv(filename, index=False) # save the metadata as a CSV file
         print(f"Saved metadata: {filename}")
     
     def create_dataframe(self, frames):
+        import pandas as pd
+
         df = pd.DataFrame(frames)
         return df
 class NIDAQ:
@@ -80,6 +91,8 @@ class NIDAQ:
 
     def __enter__(self):
         """During With context, generate input or output channels according to parameter 'io' """
+        import nidaqmx
+
         self.task = nidaqmx.Task()
         if self._io == "input": # Create input channel(s)
             for channel in self.channels:
@@ -114,6 +127,7 @@ class NIDAQ:
 
 # Function to start the MDA sequence
 def start_acquisition(viewer, wait_for_trigger):
+    mmc = load_core()
 
     if wait_for_trigger:
         with NIDAQ() as nidaq:
@@ -238,7 +252,9 @@ class MyWidget(QWidget):
 
 # Function to start Napari with the custom widget
 def start_napari():
-    
+    from napari import Viewer, run
+
+    load_core() # napari-micromanager picks up the loaded configuration from the shared core
     print("launching interface...")
     viewer = Viewer()
     
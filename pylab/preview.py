@@ -0,0 +1,71 @@
+import threading
+import time
+
+import numpy as np
+
+
+def downsample_frame(frame, factor, mode='bin'):
+    """Reduce a 2D frame by an integer factor, by averaging factor x factor blocks ('bin') or striding ('stride')"""
+    if factor <= 1:
+        return frame.copy()
+    if mode == 'stride':
+        return frame[::factor, ::factor].copy()
+    height = frame.shape[0] // factor * factor
+    width = frame.shape[1] // factor * factor
+    blocks = frame[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).astype(frame.dtype)
+
+
+class LivePreview:
+    '''
+    Throttled live view of an acquisition that never holds up the pump or the writer.
+    The pump offers every frame; at most `max_fps` times per second the frame is copied into a single
+    preview slot, and offers in between return immediately. The display side (e.g. a QTimer on the Qt thread)
+    polls latest(), which returns a downsampled copy of the newest frame. The pump only ever tries to take the
+    preview lock: if the display is reading the slot at that moment the frame is skipped, not waited for.
+
+    Parameters:
+    - max_fps (float): maximum preview rate (default: 15)
+    - downsample (int): integer reduction factor of the preview frame, 1 = full resolution (default: 1)
+    - mode (str): 'bin' averages downsample x downsample blocks, 'stride' keeps every n-th pixel (default: 'bin')
+    '''
+    def __init__(self, max_fps=15, downsample=1, mode='bin'):
+        self.max_fps = max_fps
+        self.downsample = downsample
+        self.mode = mode
+        self.frames_shown = 0
+        self._period = 1.0 / max_fps
+        self._due = 0.0
+        self._frame = None
+        self._fresh = False
+        self._lock = threading.Lock()
+
+    def offer(self, frame):
+        """Called from the pump for each frame; copies it into the preview slot only when a preview is due"""
+        now = time.perf_counter()
+        if now < self._due:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False # the display is reading the slot, try again with the next frame
+        try:
+            if self.mode == 'stride' and self.downsample > 1:
+                frame = frame[::self.downsample, ::self.downsample]
+            if self._frame is None or self._frame.shape != frame.shape or self._frame.dtype != frame.dtype:
+                self._frame = np.empty_like(frame)
+            np.copyto(self._frame, frame)
+            self._fresh = True
+            self._due = now + self._period
+        finally:
+            self._lock.release()
+        return True
+
+    def latest(self):
+        """Return a downsampled copy of the newest preview frame, or None if there is no new frame"""
+        with self._lock:
+            if not self._fresh:
+                return None
+            self._fresh = False
+            self.frames_shown += 1
+            if self.mode == 'stride':
+                return self._frame.copy() # already decimated in offer()
+            return downsample_frame(self._frame, self.downsample, self.mode)
@@ -0,0 +1,309 @@
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from pylab.buffers import check_consumer, dtype_for_core
+from pylab.journal import JOURNAL_BACKENDS, StackJournal
+from pylab.writers import make_writer
+
+# Layout of the writer statistics shared with the parent: counters followed by one write time per frame
+_FRAMES_WRITTEN, _BYTES_WRITTEN, _COMPRESSED_BYTES, _ELAPSED, _STATS_HEADER = 0, 1, 2, 3, 4
+
+
+class SharedFrameRing:
+    '''
+    Ring buffer of frame slots in multiprocessing.shared_memory, for handing frames from the acquisition pump
+    to a writer in another process. put() copies the frame into the next free slot and sends only the frame's
+    index over a multiprocessing queue; the writer process maps the same memory, writes the slots straight from
+    it and advances a shared counter to hand them back. Like FrameRingBuffer, put() blocks (or raises
+    queue.Full) when every slot is still waiting to be written, counts these backpressure events, and raises
+    WriterFailedError instead of waiting once the writer process registered as `consumer` has died.
+
+    Parameters:
+    - capacity (int): number of frame slots
+    - frame_shape (tuple): (height, width) of each frame
+    - dtype (numpy dtype): pixel type (default: uint16)
+    '''
+    def __init__(self, capacity, frame_shape, dtype=np.uint16):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        shape = (capacity,) + tuple(frame_shape)
+        nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        context = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._owner = True
+        self._shape = shape
+        self.frames = np.ndarray(shape, dtype=self.dtype, buffer=self._shm.buf)
+        self.indices = context.Queue() # index of every filled frame, None once the acquisition is over
+        self.released = context.Value('q', 0, lock=False) # frames written by the consumer so far
+        self.head = 0
+        self.backpressure_events = 0
+        self.max_fill = 0
+        self.consumer = None # ProcessFrameWriter reading from the ring, checked for failure by put()
+
+    @classmethod
+    def for_core(cls, mmc, max_bytes=1024 * 1024**2, max_frames=None):
+        """Size a shared ring for the current camera, using at most max_bytes (default 1 GB) of shared memory"""
+        dtype = dtype_for_core(mmc)
+        frame_shape = (mmc.getImageHeight(), mmc.getImageWidth())
+        capacity = max(2, max_bytes // (frame_shape[0] * frame_shape[1] * dtype.itemsize))
+        if max_frames:
+            capacity = max(2, min(capacity, max_frames))
+        return cls(capacity, frame_shape, dtype)
+
+    def __getstate__(self):
+        # Sent to the writer process: the memory is attached by name there, the cursors stay with the producer
+        return {'name': self._shm.name, 'shape': self._shape, 'dtype': self.dtype.str,
+                'indices': self.indices, 'released': self.released}
+
+    def __setstate__(self, state):
+        self._shm = shared_memory.SharedMemory(name=state['name']) # the producer unlinks it
+        self._owner = False
+        self._shape = state['shape']
+        self.capacity = self._shape[0]
+        self.dtype = np.dtype(state['dtype'])
+        self.frames = np.ndarray(self._shape, dtype=self.dtype, buffer=self._shm.buf)
+        self.indices = state['indices']
+        self.released = state['released']
+        self.head = 0
+        self.backpressure_events = 0
+        self.max_fill = 0
+        self.consumer = None
+
+    @property
+    def frame_shape(self):
+        return self._shape[1:]
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def qsize(self):
+        return self.head - self.released.value
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def fill_level(self):
+        return self.qsize() / self.capacity
+
+    def put(self, frame, block=True, timeout=None):
+        """Copy a frame into the next free slot and pass its index to the writer process"""
+        check_consumer(self.consumer)
+        if self.qsize() >= self.capacity:
+            self.backpressure_events += 1
+            if not block:
+                raise queue.Full
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            while self.qsize() >= self.capacity:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    raise queue.Full
+                time.sleep(0.0005)
+                check_consumer(self.consumer)
+        self.frames[self.head % self.capacity] = frame
+        self.indices.put(self.head)
+        self.head += 1
+        self.max_fill = max(self.max_fill, self.qsize())
+
+    def finish(self):
+        """Tell the consumer that no more frames will follow"""
+        self.indices.put(None)
+
+    def close(self):
+        """Release the shared memory; the producer also unlinks it"""
+        self.frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _write_frames(ring, stats_name, num_frames, filename, backend, batch_size, batch_timeout, max_file_frames,
+                  max_file_bytes, journal_interval, series_frames):
+    """Writer process: collect contiguous slot ranges from the index queue and write them from shared memory"""
+    stats_shm = shared_memory.SharedMemory(name=stats_name)
+    stats = np.ndarray((_STATS_HEADER + (num_frames or 0),), dtype=np.float64, buffer=stats_shm.buf)
+    write_times = stats[_STATS_HEADER:]
+    writer = make_writer(backend, filename, num_frames, max_file_frames, max_file_bytes, series_frames)
+    journal = StackJournal(filename, journal_interval) if journal_interval else None
+    opened = False
+    written = 0
+    finished = False
+    block = None
+    start_time = time.perf_counter()
+    try:
+        with tqdm(total=num_frames, desc='Saving Frames') as pbar:
+            while not finished:
+                first = ring.indices.get()
+                if first is None:
+                    break
+                count = 1
+                deadline = time.perf_counter() + batch_timeout
+                # Extend the batch with the following frames until it is full, reaches the end of the ring or times out
+                while count < batch_size and (first + count) % ring.capacity:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        index = ring.indices.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if index is None:
+                        finished = True
+                        break
+                    count += 1
+                slot = first % ring.capacity
+                block = ring.frames[slot:slot + count]
+                if not opened:
+                    writer.open(block.shape[1:], block.dtype)
+                    if journal is not None:
+                        journal.open(writer, backend, num_frames, block.shape[1:], block.dtype)
+                    opened = True
+                writer.write(block)
+                ring.released.value += count
+                if written + count <= len(write_times):
+                    write_times[written:written + count] = time.perf_counter()
+                written += count
+                stats[_FRAMES_WRITTEN] = written
+                stats[_BYTES_WRITTEN] += block.nbytes
+                pbar.update(count)
+                if journal is not None:
+                    journal.sync(writer) # frame metadata is flushed by the parent
+    finally:
+        writer.close()
+        if journal is not None:
+            journal.close(written)
+        stats[_COMPRESSED_BYTES] = getattr(writer, 'compressed_bytes', 0)
+        stats[_ELAPSED] = time.perf_counter() - start_time
+        block = write_times = stats = ring.frames = None # views must go before the memory is closed
+        ring._shm.close()
+        stats_shm.close()
+
+
+class ProcessFrameWriter:
+    '''
+    Drop-in alternative to FrameSavingThread that writes frames from a separate process, so that encoding and
+    disk I/O never compete with the acquisition pump for the GIL. Frames travel through a SharedFrameRing;
+    only frame indices cross the process boundary. Writer statistics (frames and bytes written, per-frame
+    write times) live in a second shared memory block, so AcquisitionMonitor reads them like the thread's.
+
+    The process is started with the 'spawn' method, which re-imports the main module: the script that
+    starts an acquisition must keep its acquisition code under `if __name__ == "__main__":`.
+
+    Parameters:
+    - frame_queue (SharedFrameRing): source of frames from the acquisition pump
+    - stop_event (threading.Event): set once the acquisition is finished (join() also ends the writer)
+    - filename (str): output file
+    - num_frames (int): expected number of frames, used for the progress bar and write-time statistics
+    - batch_size (int): maximum number of frames written per call (default: 64)
+    - batch_timeout_ms (float): write a partial batch after waiting this long for it to fill (default: 250)
+    - backend (str): storage backend, see make_writer() (default: 'tiff')
+    - metadata (FrameMetadataBuffer): per-frame metadata, flushed by the parent every journal_interval (every second
+      without a journal) and when the writer finishes (optional)
+    - max_file_frames (int): start a new file after this many frames (optional)
+    - max_file_bytes (int): start a new file before it exceeds this many image bytes (optional)
+    - journal_interval (float): seconds between journaled syncs, see FrameSavingThread (optional)
+    - series_frames (int): frames per TIFF series, see TiffStackWriter (optional, 'tiff' backend)
+    '''
+    def __init__(self, frame_queue, stop_event, filename, num_frames=None, batch_size=64, batch_timeout_ms=250,
+                 backend='tiff', metadata=None, max_file_frames=None, max_file_bytes=None, journal_interval=None,
+                 series_frames=None):
+        if not isinstance(frame_queue, SharedFrameRing):
+            raise TypeError("ProcessFrameWriter needs a SharedFrameRing")
+        if journal_interval and backend not in JOURNAL_BACKENDS:
+            raise ValueError(f"Journaled writes need one of the {JOURNAL_BACKENDS} backends, not {backend!r}")
+        self.frame_queue = frame_queue
+        self.stop_event = stop_event
+        self.filename = filename
+        self.num_frames = num_frames
+        self.backend = backend
+        self.metadata = metadata
+        self._stats_shm = shared_memory.SharedMemory(create=True, size=8 * (_STATS_HEADER + (num_frames or 0)))
+        self._stats = np.ndarray((_STATS_HEADER + (num_frames or 0),), dtype=np.float64, buffer=self._stats_shm.buf)
+        self._stats[:] = 0
+        self._process = multiprocessing.get_context('spawn').Process(
+            target=_write_frames, name='frame-writer', daemon=True,
+            args=(frame_queue, self._stats_shm.name, num_frames, filename, backend, max(1, batch_size),
+                  batch_timeout_ms / 1000, max_file_frames, max_file_bytes, journal_interval, series_frames))
+        self._finished = False
+        frame_queue.consumer = self
+        # The writer process cannot reach the metadata buffer, so a thread of the parent flushes it
+        self._metadata_interval = journal_interval or 1.0
+        self._stop_flushing = threading.Event()
+        self._flusher = None
+        if metadata is not None:
+            self._flusher = threading.Thread(target=self._flush_metadata, name='metadata-flush', daemon=True)
+
+    @property
+    def error(self):
+        """RuntimeError describing how the writer process failed, or None while it runs or after a clean exit"""
+        exitcode = self._process.exitcode
+        if exitcode:
+            return RuntimeError(f"writer process exited with code {exitcode}")
+        return None
+
+    @property
+    def frames_written(self):
+        return int(self._stats[_FRAMES_WRITTEN])
+
+    @property
+    def bytes_written(self):
+        return int(self._stats[_BYTES_WRITTEN])
+
+    @property
+    def elapsed(self):
+        return float(self._stats[_ELAPSED])
+
+    @property
+    def write_times(self):
+        return self._stats[_STATS_HEADER:] if self.num_frames else None
+
+    def start(self):
+        self._process.start()
+        if self._flusher is not None:
+            self._flusher.start()
+
+    def _flush_metadata(self):
+        while not self._stop_flushing.wait(self._metadata_interval):
+            self.metadata.flush()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def join(self, timeout=None):
+        """Signal the end of the acquisition, wait for the writer to drain the ring and close the file"""
+        if not self._finished:
+            self.frame_queue.finish()
+            self._finished = True
+        self._process.join(timeout)
+        if self._process.is_alive():
+            return
+        self._stop_flushing.set()
+        if self._flusher is not None and self._flusher.is_alive():
+            self._flusher.join()
+        if self.metadata is not None:
+            self.metadata.flush()
+        if self._process.exitcode:
+            print(f"WARNING: writer process exited with code {self._process.exitcode}")
+        print(self.report())
+
+    def report(self):
+        """One-line summary of writer throughput, like FrameSavingThread.report()"""
+        mb_written = self.bytes_written / 1024**2
+        line = f"Saved {self.frames_written} frames ({mb_written:.0f} MB) to {self.filename} " \
+               f"at {mb_written / self.elapsed if self.elapsed else 0:.1f} MB/s (writer process)"
+        compressed = self._stats[_COMPRESSED_BYTES]
+        if compressed:
+            line += f", compression ratio {self.bytes_written / compressed:.2f}x ({compressed / 1024**2:.0f} MB on disk)"
+        return line
+
+    def close(self):
+        """Release the shared memory of the statistics and the ring once the results have been read"""
+        self._stats = None
+        self._stats_shm.close()
+        self._stats_shm.unlink()
+        self.frame_queue.close()
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FramePump:
+    '''
+    Moves frames from the MMCore circular buffer into a sink (e.g. frame_queue.put) as soon as they arrive.
+    Every wake-up drains all frames that are waiting in the circular buffer in one batch. When the buffer
+    is empty the pump waits on an event that can be set by an image-ready signal (see connect()); without a
+    signal the wait is adaptive, starting at min_wait and doubling up to max_wait while no frames arrive.
+
+    Per-frame latency is measured from the moment the pump sees frames waiting to the moment the frame is
+    handed to the sink.
+
+    Parameters:
+    - mmc (CMMCorePlus): core with a running sequence acquisition
+    - sink (callable): called with each frame as it is popped from the circular buffer
+    - num_frames (int): number of frames to pump before returning
+    - stop_event (threading.Event): optional event to abort pumping early
+    - metadata (FrameMetadataBuffer): optional store for each frame's camera metadata and host timestamp;
+      frames are then popped with popNextImageAndMD
+    - preview (LivePreview): optional live view that is offered every frame
+    - min_wait (float): shortest wait in seconds when the circular buffer is empty (default: 0.0005)
+    - max_wait (float): longest wait in seconds when the circular buffer is empty (default: 0.01)
+    '''
+    def __init__(self, mmc, sink, num_frames, stop_event=None, metadata=None, preview=None, min_wait=0.0005,
+                 max_wait=0.01):
+        self.mmc = mmc
+        self.sink = sink
+        self.num_frames = num_frames
+        self.stop_event = stop_event
+        self.metadata = metadata
+        self.preview = preview
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.frames_pumped = 0
+        self.wakeups = 0
+        self.latencies = np.zeros(num_frames, dtype=np.float64) # seconds from detection to hand-off
+        self.handoff_times = np.zeros(num_frames, dtype=np.float64) # time.perf_counter() at hand-off
+        self._wake = threading.Event()
+
+    def notify(self, *args):
+        """Wake the pump early, e.g. from a pymmcore_plus image-ready signal"""
+        self._wake.set()
+
+    def connect(self, signal):
+        """Connect an image-ready signal (psygnal/Qt style) to the pump"""
+        signal.connect(self.notify)
+
+    def run(self):
+        """Pump frames until num_frames are handed off, the sequence stops, or stop_event is set"""
+        mmc = self.mmc
+        sink = self.sink
+        metadata = self.metadata
+        preview = self.preview
+        wait = self.min_wait
+        i = 0
+        while i < self.num_frames:
+            if self.stop_event is not None and self.stop_event.is_set():
+                break
+            remaining = mmc.getRemainingImageCount()
+            if remaining == 0:
+                if not mmc.isSequenceRunning():
+                    break # camera stopped and the circular buffer is drained
+                self._wake.wait(wait)
+                self._wake.clear()
+                wait = min(wait * 2, self.max_wait)
+                continue
+
+            # ==== Drain everything that is waiting in one batch ==== #
+            wait = self.min_wait
+            self.wakeups += 1
+            detected = time.perf_counter()
+            for _ in range(min(remaining, self.num_frames - i)):
+                if metadata is None:
+                    image = mmc.popNextImage()
+                else:
+                    image, md = mmc.popNextImageAndMD()
+                    metadata.record(i, md, time.perf_counter())
+                if preview is not None:
+                    preview.offer(image)
+                sink(image)
+                now = time.perf_counter()
+                self.latencies[i] = now - detected
+                self.handoff_times[i] = now
+                i += 1
+            self.frames_pumped = i
+        self.frames_pumped = i
+        return i
+
+    def summary(self):
+        """Return pump throughput and latency statistics for the frames handed off so far"""
+        n = self.frames_pumped
+        if n == 0:
+            return {'frames': 0, 'fps': 0.0}
+        latency_ms = self.latencies[:n] * 1000
+        elapsed = self.handoff_times[n - 1] - self.handoff_times[0]
+        return {
+            'frames': n,
+            'wakeups': self.wakeups,
+            'frames_per_wakeup': n / max(self.wakeups, 1),
+            'elapsed_s': elapsed,
+            'fps': (n - 1) / elapsed if elapsed > 0 else 0.0,
+            'latency_mean_ms': float(latency_ms.mean()),
+            'latency_p50_ms': float(np.percentile(latency_ms, 50)),
+            'latency_p99_ms': float(np.percentile(latency_ms, 99)),
+            'latency_max_ms': float(latency_ms.max()),
+            'max_poll_wait_ms': self.max_wait * 1000,
+        }
@@ -0,0 +1,163 @@
+import os
+import time
+
+import numpy as np
+
+from pylab.stacks import open_session_stack
+
+
+def replay_timing(filename):
+    """
+    Return the frame times (seconds from the first frame) a stack was recorded with, from the
+    <stem>_frame_metadata.npy written next to it, or None if the stack has no frame metadata
+    """
+    from pylab.metadata import load_frame_metadata
+
+    stem = filename[:-len('_manifest.json')] if filename.endswith('_manifest.json') else os.path.splitext(filename)[0]
+    metadata_filename = stem + '_frame_metadata.npy'
+    if not os.path.exists(metadata_filename):
+        return None
+    host_time = load_frame_metadata(metadata_filename)['host_time']
+    if len(host_time) < 2:
+        return None
+    return host_time - host_time[0]
+
+
+class ReplayCore:
+    '''
+    Stand-in for CMMCorePlus that replays a stored stack as a live camera, for dry runs, writer stress tests
+    and benchmarking online analysis without a camera attached. The stack is opened lazily (memory-mapped
+    where possible, see open_session_stack) and frames are read only when they are popped.
+
+    Frames are released into a simulated circular buffer on the clock once a sequence acquisition is started,
+    either at a fixed `fps` or with the original frame times from the stack's frame metadata. As with a real
+    camera, frames that are not popped in time overflow the circular buffer: the oldest are discarded,
+    isBufferOverflowed() turns True and the ImageNumber tags show the gap.
+
+        mmc = ReplayCore('Frames_1_512_512_uint16_0001.tif', fps=100)
+        run_session(config, mmc=mmc)
+
+    Parameters:
+    - filename (str): stack to replay, a single file or the <stem>_manifest.json of a split stack
+    - fps (float): replay rate; None replays the recorded frame times from <stem>_frame_metadata.npy (default: None)
+    - loop (bool): start again from the first frame at the end of the stack instead of ending the sequence (default: False)
+    - buffer_mb (int): size of the simulated circular buffer (default: 1024)
+    '''
+    def __init__(self, filename, fps=None, loop=False, buffer_mb=1024):
+        from pymmcore_plus import Metadata
+
+        self._metadata_class = Metadata # popNextImageAndMD returns the same metadata type as CMMCorePlus
+        self.filename = filename
+        self.stack = open_session_stack(filename)
+        self.num_stack_frames = len(self.stack)
+        # period: time of one pass through the stack, including one mean frame interval before it starts again
+        if fps is not None:
+            self.frame_times = np.arange(self.num_stack_frames) / fps
+            self.period = self.num_stack_frames / fps
+        else:
+            self.frame_times = replay_timing(filename)
+            if self.frame_times is None:
+                raise ValueError(f"{filename} has no frame metadata to replay its original frame rate, pass fps")
+            self.period = self.frame_times[-1] * self.num_stack_frames / (self.num_stack_frames - 1)
+        self.loop = loop
+        self.frame_shape = tuple(self.stack.shape[1:])
+        self.dtype = np.dtype(self.stack.dtype)
+        self.capacity = max(buffer_mb * 1024**2 // (int(np.prod(self.frame_shape)) * self.dtype.itemsize), 1)
+        self.exposure = 1000 * self.period / self.num_stack_frames
+        self._start_time = None
+        self._sequence_frames = 0
+        self._popped = 0
+        self._overflowed = False
+
+    # ==== Camera properties ==== #
+    def getCameraDevice(self):
+        return 'Replay'
+
+    def getImageHeight(self):
+        return self.frame_shape[0]
+
+    def getImageWidth(self):
+        return self.frame_shape[1]
+
+    def getBytesPerPixel(self):
+        return self.dtype.itemsize
+
+    def getImageBitDepth(self):
+        return self.dtype.itemsize * 8
+
+    def getExposure(self):
+        return self.exposure
+
+    def setExposure(self, *args):
+        pass # the frame rate is set by the replayed stack
+
+    # ==== Sequence acquisition ==== #
+    def prepareSequenceAcquisition(self, camera):
+        pass
+
+    def startSequenceAcquisition(self, num_images, interval_ms=0, stop_on_overflow=False):
+        self._sequence_frames = num_images if self.loop else min(num_images, self.num_stack_frames)
+        self._start()
+
+    def startContinuousSequenceAcquisition(self, interval_ms=0):
+        self._sequence_frames = np.iinfo(np.int64).max if self.loop else self.num_stack_frames
+        self._start()
+
+    def _start(self):
+        self._popped = 0
+        self._overflowed = False
+        self._start_time = time.perf_counter()
+
+    def stopSequenceAcquisition(self):
+        if self._start_time is not None:
+            # Frames released so far stay in the circular buffer, no further frames arrive
+            self._sequence_frames = self._released()
+            self._start_time = None
+
+    def isSequenceRunning(self):
+        return self._start_time is not None and self._released() < self._sequence_frames
+
+    def _released(self):
+        """Number of frames the camera has produced since the sequence started"""
+        if self._start_time is None:
+            return self._sequence_frames
+        elapsed = time.perf_counter() - self._start_time
+        cycles = int(elapsed // self.period) if self.loop else 0
+        in_cycle = int(np.searchsorted(self.frame_times, elapsed - cycles * self.period, side='right'))
+        return min(cycles * self.num_stack_frames + in_cycle, self._sequence_frames)
+
+    # ==== Circular buffer ==== #
+    def getBufferTotalCapacity(self):
+        return self.capacity
+
+    def isBufferOverflowed(self):
+        return self._overflowed
+
+    def getRemainingImageCount(self):
+        remaining = self._released() - self._popped
+        if remaining > self.capacity:
+            # The oldest frames were overwritten before they were popped
+            self._popped += remaining - self.capacity
+            self._overflowed = True
+            remaining = self.capacity
+        return remaining
+
+    def popNextImage(self):
+        return self.popNextImageAndMD()[0]
+
+    def popNextImageAndMD(self):
+        if self.getRemainingImageCount() == 0:
+            raise RuntimeError("Circular buffer is empty")
+        index = self._popped
+        self._popped += 1
+        image = np.asarray(self.stack[index % self.num_stack_frames])
+        md = self._metadata_class()
+        md['Camera'] = 'Replay'
+        md['ImageNumber'] = str(index)
+        md['ElapsedTime-ms'] = str(1000 * ((index // self.num_stack_frames) * self.period
+                                           + self.frame_times[index % self.num_stack_frames]))
+        return image, md
+
+    def close(self):
+        if hasattr(self.stack, 'close'):
+            self.stack.close()
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+from pylab.cache import AnalysisCache
+
+RESAMPLE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pylab', 'resample_maps') # cached index maps
+RESAMPLE_CACHE_GB = 5 # size cap of the index map cache
+
+
+def _index_dtype(source_shape):
+    return np.int32 if int(np.prod(source_shape)) < np.iinfo(np.int32).max else np.int64
+
+
+def nearest_index_map(source_shape, target_shape, transform=None, out=None, order='C'):
+    """
+    Flat index into a source array of shape source_shape for every element of target_shape, so that
+    source.ravel(order)[index] resamples the source with nearest-neighbour interpolation. order is the memory
+    order of the source ('C' or 'F', e.g. for volumes memory-mapped from NRRD), so the flat view needs no copy.
+    Without a transform the source is scaled to the target with pixel centers aligned (as
+    skimage.transform.resize with order=0). A transform is an (ndim + 1, ndim + 1) affine matrix mapping target
+    coordinates (homogeneous, in index order) to source coordinates, as in scipy.ndimage.affine_transform;
+    target elements that map outside the source get index -1.
+    The map is built one slice of the first axis at a time, into `out` if given.
+    """
+    source_shape, target_shape = tuple(source_shape), tuple(target_shape)
+    if out is None:
+        out = np.empty(target_shape, dtype=_index_dtype(source_shape))
+    # Elements per step along each source axis in the flat view
+    if order == 'F':
+        strides = np.cumprod((1,) + source_shape[:-1])
+    else:
+        strides = np.cumprod((source_shape[1:] + (1,))[::-1])[::-1]
+
+    if transform is None:
+        # Nearest source element of each target element center, per axis
+        axes = [np.minimum(((np.arange(n_out) + 0.5) * n_in / n_out).astype(np.int64), n_in - 1)
+                for n_in, n_out in zip(source_shape, target_shape)]
+        rest = np.zeros(target_shape[1:], dtype=np.int64)
+        for axis, index in enumerate(axes[1:], 1):
+            rest += (index * strides[axis]).reshape((-1,) + (1,) * (len(target_shape) - axis - 1))
+        for i, index in enumerate(axes[0]):
+            out[i] = index * strides[0] + rest
+        return out
+
+    transform = np.asarray(transform, dtype=np.float64)
+    ndim = len(target_shape)
+    if transform.shape != (ndim + 1, ndim + 1):
+        raise ValueError(f"Expected a {ndim + 1}x{ndim + 1} affine transform, got shape {transform.shape}")
+    grid = np.indices(target_shape[1:], dtype=np.float64).reshape(ndim - 1, -1)
+    for i in range(target_shape[0]):
+        coords = np.vstack([np.full(grid.shape[1], i, dtype=np.float64), grid])
+        source = np.floor(transform[:ndim, :ndim] @ coords + transform[:ndim, ndim:] + 0.5).astype(np.int64)
+        inside = np.all((source >= 0) & (source < np.array(source_shape)[:, np.newaxis]), axis=0)
+        out[i] = np.where(inside, strides @ source, -1).reshape(target_shape[1:])
+    return out
+
+
+def label_index_map(source_shape, target_shape, transform=None, cache_dir=RESAMPLE_CACHE_DIR, order='C'):
+    """
+    nearest_index_map() computed once per (source shape, target shape, transform, source order) and cached on
+    disk (see AnalysisCache); later calls memory-map it
+    """
+    params = {'source_shape': list(source_shape), 'target_shape': list(target_shape),
+              'transform': None if transform is None else np.asarray(transform, dtype=np.float64).tolist()}
+    if order != 'C':
+        params['order'] = order # C-order maps keep the keys they were cached with
+
+    def compute(out_dir):
+        out = np.lib.format.open_memmap(os.path.join(out_dir, 'index.npy'), mode='w+',
+                                        dtype=_index_dtype(source_shape), shape=tuple(target_shape))
+        return {'index': nearest_index_map(source_shape, target_shape, transform, out=out, order=order)}
+
+    _, value = AnalysisCache(cache_dir, RESAMPLE_CACHE_GB).run('index_map', [], params, compute)
+    return value['index']
+
+
+def resample_labels(labels, target_shape, transform=None, fill=0, cache_dir=RESAMPLE_CACHE_DIR):
+    """
+    Resample a label image or volume (e.g. an atlas annotation) to target_shape with a cached nearest-neighbour
+    index map: a single gather, so label IDs are never interpolated or blended. Elements that a transform maps
+    outside the labels get `fill`.
+    """
+    # Index the labels in their own memory order, so the flat view of a memory-mapped volume is not a copy
+    order = 'F' if labels.flags.f_contiguous and not labels.flags.c_contiguous else 'C'
+    index = label_index_map(labels.shape, target_shape, transform, cache_dir, order)
+    # Gather straight from the labels (a memory-mapped volume stays on disk), then fill where index is -1
+    gathered = labels.reshape(-1, order=order)[np.maximum(index, 0)]
+    return np.where(index < 0, np.asarray(fill, dtype=labels.dtype), gathered)
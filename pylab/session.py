@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+
+from pylab.buffers import FrameRingBuffer
+from pylab.metadata import FrameMetadataBuffer
+from pylab.process_writer import ProcessFrameWriter, SharedFrameRing
+from pylab.pump import FramePump
+from pylab.telemetry import AcquisitionMonitor, save_session_report
+from pylab.writers import FrameSavingThread
+
+
+class CameraPipeline:
+    '''
+    Everything needed to stream one camera to disk: its own core, ring buffer, frame pump, writer thread,
+    per-frame metadata file, monitor and stop event. Pipelines share no state, so several can run side by side.
+    Output files are written next to `filename`: <stack>_frame_metadata.npy and <stack>_report.json.
+
+    Parameters:
+    - name (str): camera label used in reports (e.g. 'widefield', 'pupil')
+    - mmc (CMMCorePlus): core controlling this camera
+    - filename (str): output stack
+    - num_frames (int): number of frames to acquire
+    - backend (str): writer storage backend, see make_writer() (default: 'tiff')
+    - batch_size (int): frames written per call (default: 64)
+    - batch_timeout_ms (float): write a partial batch after waiting this long for it to fill (default: 250)
+    - ring_buffer_mb (float): memory reserved for frames waiting to be written (default: 1024)
+    - preview (LivePreview): optional live view fed by the pump
+    - monitor_interval (float): seconds between telemetry samples (default: 5.0)
+    - live (bool): print telemetry samples while acquiring (default: False)
+    - writer_mode (str): 'thread' writes from a FrameSavingThread, 'process' from a ProcessFrameWriter fed
+      through shared memory (default: 'thread')
+    - max_file_frames (int): split the stack into files of at most this many frames (optional)
+    - max_file_bytes (int): split the stack into files of at most this many image bytes (optional)
+    - journal_interval (float): seconds between journaled syncs of the stack, for recovery after a crash
+      (optional, 'memmap' and 'zarr' backends)
+    - series_frames (int): frames per TIFF series, see TiffStackWriter (optional, 'tiff' backend)
+    '''
+    def __init__(self, name, mmc, filename, num_frames, backend='tiff', batch_size=64, batch_timeout_ms=250,
+                 ring_buffer_mb=1024, preview=None, monitor_interval=5.0, live=False, writer_mode='thread',
+                 max_file_frames=None, max_file_bytes=None, journal_interval=None, series_frames=None):
+        self.name = name
+        self.mmc = mmc
+        self.filename = filename
+        self.num_frames = num_frames
+        base = os.path.splitext(filename)[0]
+        self.report_filename = base + "_report.json"
+        self.stop_event = threading.Event()
+        if writer_mode == 'thread':
+            ring_class, writer_class = FrameRingBuffer, FrameSavingThread
+        elif writer_mode == 'process':
+            ring_class, writer_class = SharedFrameRing, ProcessFrameWriter
+        else:
+            raise ValueError(f"Unknown writer mode: {writer_mode}")
+        self.frame_queue = ring_class.for_core(mmc, ring_buffer_mb * 1024**2, num_frames)
+        self.metadata = FrameMetadataBuffer(base + "_frame_metadata.npy", num_frames)
+        self.saving_thread = writer_class(self.frame_queue, self.stop_event, filename, num_frames,
+                                          batch_size=batch_size, batch_timeout_ms=batch_timeout_ms,
+                                          backend=backend, metadata=self.metadata,
+                                          max_file_frames=max_file_frames, max_file_bytes=max_file_bytes,
+                                          journal_interval=journal_interval, series_frames=series_frames)
+        self.pump = FramePump(mmc, self.frame_queue.put, num_frames, stop_event=self.stop_event,
+                              metadata=self.metadata, preview=preview)
+        self.monitor = AcquisitionMonitor(mmc, self.frame_queue, self.pump, self.saving_thread,
+                                          interval=monitor_interval, live=live, label=name)
+        self.trigger_time = None
+        self.report = None
+        self.error = None
+
+    @classmethod
+    def from_config(cls, name, config_file, filename, num_frames, **kwargs):
+        """Create a pipeline with its own CMMCorePlus (not the shared instance) loaded from a Micro-Manager config"""
+        from pymmcore_plus import CMMCorePlus
+
+        mmc = CMMCorePlus()
+        mmc.loadSystemConfiguration(config_file)
+        return cls(name, mmc, filename, num_frames, **kwargs)
+
+    def arm(self):
+        """Start the writer and prepare the camera sequence, so streaming starts as soon as start() is called"""
+        self.saving_thread.start()
+        self.mmc.prepareSequenceAcquisition(self.mmc.getCameraDevice())
+
+    def start(self, trigger_time=None):
+        """Start streaming; trigger_time is the perf_counter() of the trigger edge, if any"""
+        self.trigger_time = trigger_time if trigger_time is not None else time.perf_counter()
+        self.mmc.startContinuousSequenceAcquisition(0)
+        self.monitor.start()
+
+    def run(self):
+        """
+        Pump frames until done, then stop the camera, drain the writer and save the session report.
+        If the writer fails, the pump stops at the next frame (see WriterFailedError), the failure is kept in
+        `error` and recorded in the report.
+        """
+        try:
+            self.pump.run()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stop_event.set()
+            self.mmc.stopSequenceAcquisition()
+            self.saving_thread.join()
+            self.metadata.close()
+            self.monitor.stop()
+        if self.error is None and getattr(self.saving_thread, 'error', None) is not None:
+            self.error = RuntimeError(f"The frame writer of {self.name} failed: {self.saving_thread.error!r}")
+        self.report = self.monitor.report(self.num_frames, self.metadata.columns['image_number'][:self.metadata.count],
+                                          trigger_time=self.trigger_time)
+        self.report['camera'] = self.name
+        self.report['filename'] = self.filename
+        if self.error is not None:
+            self.report['error'] = repr(self.error)
+        self._release_writer()
+        save_session_report(self.report_filename, self.report)
+        return self.report
+
+    def abort(self):
+        """Stop a pipeline that was armed but did not run, stopping its camera if it was already started"""
+        self.stop_event.set()
+        self.mmc.stopSequenceAcquisition()
+        if self.monitor.is_alive():
+            self.monitor.stop()
+        if self.saving_thread.is_alive():
+            self.saving_thread.join()
+        self.metadata.close()
+        self._release_writer()
+
+    def _release_writer(self):
+        # A process writer keeps its statistics and frames in shared memory until it is closed
+        if hasattr(self.saving_thread, 'close'):
+            self.saving_thread.close()
+
+
+class AcquisitionSession:
+    '''
+    Runs one or more CameraPipelines concurrently from a single trigger, e.g. the widefield and pupil cameras.
+    All pipelines are armed first, then the session waits once for the trigger, starts every camera, and runs
+    each pump in its own thread.
+
+    Each pipeline needs its own core; create them with CameraPipeline.from_config() rather than sharing
+    CMMCorePlus.instance(). Two cores in one process can drive different camera adapters; whether a single
+    adapter supports two instances depends on the device library.
+
+    Parameters:
+    - pipelines (list): CameraPipeline objects to run together
+    '''
+    def __init__(self, pipelines):
+        self.pipelines = list(pipelines)
+        self.trigger_time = None
+
+    def run(self, trigger=None, timeout=None):
+        """
+        Arm all cameras, wait for the trigger (an entered NIDAQTrigger or SoftwareTrigger, or None to start now),
+        start streaming and return {camera name: session report} once every pipeline has finished.
+        """
+        armed = []
+        try:
+            for pipeline in self.pipelines:
+                armed.append(pipeline)
+                pipeline.arm()
+            if trigger is not None:
+                print("Waiting for trigger...")
+                self.trigger_time = trigger.wait(timeout)
+                if self.trigger_time is None:
+                    raise TimeoutError("No trigger received")
+            else:
+                self.trigger_time = time.perf_counter()
+            for pipeline in self.pipelines:
+                pipeline.start(self.trigger_time)
+        except BaseException:
+            # e.g. Ctrl-C while waiting for the trigger: end the writers, or they keep the process alive
+            for pipeline in armed:
+                pipeline.abort()
+            raise
+        print(time.ctime(time.time()), ' trigger received, starting acquisition')
+
+        threads = [threading.Thread(target=pipeline.run, name=f"pump-{pipeline.name}") for pipeline in self.pipelines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for pipeline in self.pipelines:
+            if pipeline.error is not None:
+                raise pipeline.error
+        return {pipeline.name: pipeline.report for pipeline in self.pipelines}
+
+    def print_summary(self):
+        """Print per-camera throughput and dropped-frame status"""
+        for pipeline in self.pipelines:
+            report = pipeline.report
+            if report is None:
+                continue
+            pump = report['pump']
+            line = (f"[{pipeline.name}] {report['frames_written']}/{report['frames_requested']} frames, "
+                    f"{pump.get('fps', 0.0):.1f} fps, writer {report['writer']['mb_per_s']:.1f} MB/s")
+            if 'latency_p99_ms' in pump:
+                line += f", pump latency p99 {pump['latency_p99_ms']:.2f} ms"
+            if 'trigger_to_first_frame_ms' in report:
+                line += f", trigger to first frame {report['trigger_to_first_frame_ms']:.1f} ms"
+            if report['no_dropped_frames']:
+                line += ", no dropped frames"
+            else:
+                line += (f", WARNING: {report['dropped_frames']} dropped frames, {report['frame_counter_gaps']} "
+                         f"frame counter gaps, circular buffer overflow: {report['circular_buffer_overflowed']}, "
+                         f"ring buffer full {report['backpressure_events']} times")
+            if 'error' in report:
+                line += f", FAILED: {report['error']}"
+            print(line)
+            print(f"    Session report: {pipeline.report_filename}")
@@ -0,0 +1,217 @@
+import json
+import os
+
+import numpy as np
+import tifffile
+
+
+class TiffPages:
+    '''
+    Lazy (frames, height, width) view of a TIFF stack whose pages are not one contiguous block (e.g. written
+    in batches by TiffStackWriter): indexing reads only the requested pages.
+
+    Parameters:
+    - filename (str): TIFF file
+    '''
+    def __init__(self, filename):
+        self._tif = tifffile.TiffFile(filename)
+        page = self._tif.pages[0]
+        self.shape = (len(self._tif.pages),) + tuple(page.shape)
+        self.dtype = page.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        frames_key, rest = key[0], key[1:]
+        if isinstance(frames_key, (int, np.integer)):
+            return self._tif.pages[int(frames_key)].asarray()[rest]
+        pages = range(len(self))[frames_key]
+        if len(pages) == 0:
+            return np.zeros((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+        data = self._tif.asarray(key=pages).reshape((len(pages),) + self.shape[1:])
+        return data[(slice(None),) + rest]
+
+    def close(self):
+        self._tif.close()
+
+
+def open_stack_file(filename):
+    """
+    Open one stack written by a writer backend as a lazy (frames, height, width) array: memory-mapped when
+    the image data are contiguous, read page by page otherwise
+    """
+    if filename.endswith('.zarr'):
+        import zarr
+        return zarr.open(filename, mode='r')
+    with tifffile.TiffFile(filename) as tif:
+        single_series = len(tif.series) == 1 # memmap() would only map the first of several series
+    if single_series:
+        try:
+            return tifffile.memmap(filename, mode='r')
+        except ValueError:
+            pass
+    return TiffPages(filename)
+
+
+class VirtualStack:
+    '''
+    Read-only view of a stack that was split into several files by RolloverWriter, addressed by global frame
+    index as if it were one (frames, height, width) array. Only the manifest is read when the stack is opened;
+    files are opened (memory-mapped) the first time one of their frames is requested, and only the requested
+    frames are read.
+
+        stack = VirtualStack('sub-01_ses-01_20240801_120000_manifest.json')
+        frame = stack[12000]
+        block = stack[1000:2000, 100:200, 100:200]
+
+    Parameters:
+    - manifest_filename (str): the <stem>_manifest.json written next to the files
+    '''
+    def __init__(self, manifest_filename):
+        with open(manifest_filename) as fh:
+            self.manifest = json.load(fh)
+        directory = os.path.dirname(os.path.abspath(manifest_filename))
+        self.files = [os.path.join(directory, part['filename']) for part in self.manifest['files']]
+        self.first_frames = np.array([part['first_frame'] for part in self.manifest['files']], dtype=np.int64)
+        self.part_frames = np.array([part['frames'] for part in self.manifest['files']], dtype=np.int64)
+        self.dtype = np.dtype(self.manifest['dtype'])
+        self.shape = (int(self.part_frames.sum()),) + tuple(self.manifest['frame_shape'])
+        self._parts = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def locate(self, index):
+        """Return (file, page) of a global frame index"""
+        part = int(np.searchsorted(self.first_frames, index, side='right')) - 1
+        return self.files[part], int(index - self.first_frames[part])
+
+    def _part(self, part):
+        if part not in self._parts:
+            self._parts[part] = open_stack_file(self.files[part])
+        return self._parts[part]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        frames_key, rest = key[0], key[1:]
+        if isinstance(frames_key, (int, np.integer)):
+            index = int(frames_key) + len(self) if frames_key < 0 else int(frames_key)
+            if not 0 <= index < len(self):
+                raise IndexError(f"frame {frames_key} out of range for {len(self)} frames")
+            part = int(np.searchsorted(self.first_frames, index, side='right')) - 1
+            return np.asarray(self._part(part)[(index - self.first_frames[part],) + rest])
+
+        indices = np.arange(len(self))[frames_key]
+        parts = np.searchsorted(self.first_frames, indices, side='right') - 1
+        # Read runs of consecutive frames that lie in the same file with one slice each
+        breaks = np.flatnonzero((np.diff(indices) != 1) | (np.diff(parts) != 0)) + 1
+        blocks = []
+        for run in np.split(np.arange(len(indices)), breaks):
+            if len(run) == 0:
+                continue
+            part = parts[run[0]]
+            start = indices[run[0]] - self.first_frames[part]
+            blocks.append(np.asarray(self._part(part)[(slice(start, start + len(run)),) + rest]))
+        if not blocks:
+            return np.zeros((0,) + np.empty(self.shape[1:])[rest].shape, dtype=self.dtype)
+        return np.concatenate(blocks)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data.astype(dtype) if dtype is not None else data
+
+    def close(self):
+        for part in self._parts.values():
+            if hasattr(part, 'close'):
+                part.close()
+        self._parts = {}
+
+
+class MappedStack:
+    '''
+    Read-only view of a stack through a lookup table (e.g. StreamingHistogram.equalization_lut()): frames are
+    mapped when they are read, so the mapped stack is never written out.
+
+    Parameters:
+    - stack: (frames, height, width) stack of integer gray values, e.g. from open_session_stack()
+    - lut (numpy array): mapped value of every gray value
+    '''
+    def __init__(self, stack, lut):
+        self.stack = stack
+        self.lut = lut
+        self.dtype = lut.dtype
+        self.shape = tuple(stack.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __getitem__(self, key):
+        return self.lut[np.asarray(self.stack[key])]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data.astype(dtype) if dtype is not None else data
+
+
+def open_session_stack(filename):
+    """Open a stack lazily, whether it is a single file or a <stem>_manifest.json of a split stack"""
+    if filename.endswith('_manifest.json'):
+        return VirtualStack(filename)
+    return open_stack_file(filename)
+
+
+def iter_blocks(stack, block_frames=64, halo=0):
+    """
+    Read a (frames, height, width) stack in blocks of consecutive frames, so only one block is in memory at a
+    time. Yields (start, stop, block, core): block holds frames start - halo to stop + halo (clipped to the
+    stack) for filters that need neighbouring frames, and block[core] are the frames start to stop.
+    """
+    num_frames = len(stack)
+    for start in range(0, num_frames, block_frames):
+        stop = min(start + block_frames, num_frames)
+        lo, hi = max(start - halo, 0), min(stop + halo, num_frames)
+        yield start, stop, np.asarray(stack[lo:hi]), slice(start - lo, stop - lo)
+
+
+def map_blocks(func, stack, block_frames=64, halo=0, workers=1, args=(), block_args=None):
+    """
+    Apply func(start, block, core, *args) to every block of iter_blocks(stack, block_frames, halo), in a process
+    pool when workers > 1 (or in `workers` itself if it is an executor, so several passes can share one pool).
+    block_args(start, stop), if given, returns further arguments for one block only. Results are yielded in frame
+    order as (start, stop, result); at most 2 blocks per worker are in flight, which bounds memory.
+    """
+    from collections import deque
+    from concurrent.futures import Executor, ProcessPoolExecutor
+
+    blocks = iter_blocks(stack, block_frames, halo)
+    extra = block_args or (lambda start, stop: ())
+    if not isinstance(workers, Executor):
+        if workers == 1:
+            for start, stop, block, core in blocks:
+                yield start, stop, func(start, block, core, *args, *extra(start, stop))
+            return
+        with ProcessPoolExecutor(workers) as pool:
+            yield from map_blocks(func, stack, block_frames, halo, pool, args, block_args)
+        return
+    in_flight = 2 * getattr(workers, '_max_workers', os.cpu_count())
+    pending = deque()
+    for start, stop, block, core in blocks:
+        pending.append((start, stop, workers.submit(func, start, block, core, *args, *extra(start, stop))))
+        if len(pending) >= in_flight:
+            start, stop, future = pending.popleft()
+            yield start, stop, future.result()
+    while pending:
+        start, stop, future = pending.popleft()
+        yield start, stop, future.result()
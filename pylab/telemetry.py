@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+# Bin edges (ms) of the pump-to-disk latency histogram in the session report
+LATENCY_BINS_MS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, np.inf]
+
+
+def frame_counter_gaps(image_numbers):
+    """Return (number of gaps, number of missing frames) in a sequence of camera frame counters"""
+    counters = np.asarray(image_numbers, dtype=np.float64)
+    counters = counters[~np.isnan(counters)]
+    if len(counters) < 2:
+        return 0, 0
+    steps = np.diff(counters)
+    gaps = steps != 1
+    missing = int(np.sum(steps[steps > 1] - 1))
+    return int(np.count_nonzero(gaps)), missing
+
+
+class AcquisitionMonitor(threading.Thread):
+    '''
+    Background thread that samples the acquisition pipeline while it runs and builds a machine-readable
+    session report at the end. Every `interval` seconds it records:
+    - MMCore circular-buffer fill level and whether it has overflowed
+    - queue depth between the pump and the writer (and ring buffer fill, if a FrameRingBuffer is used)
+    - frames pumped and written, and writer MB/s
+    After the run, report() adds the pump-to-disk latency histogram and gaps in the camera frame counters,
+    and states whether any frame was dropped.
+
+    Parameters:
+    - mmc (CMMCorePlus): core running the sequence acquisition
+    - frame_queue (queue.Queue or FrameRingBuffer): hand-off between pump and writer
+    - pump (FramePump): the acquisition pump
+    - saving_thread (FrameSavingThread): the writer
+    - interval (float): seconds between samples (default: 1.0)
+    - live (bool): print each sample while acquiring (default: False)
+    - label (str): prefix of the printed samples, e.g. the camera name (optional)
+    '''
+    def __init__(self, mmc, frame_queue, pump, saving_thread, interval=1.0, live=False, label=None):
+        super().__init__(daemon=True)
+        self.mmc = mmc
+        self.frame_queue = frame_queue
+        self.pump = pump
+        self.saving_thread = saving_thread
+        self.interval = interval
+        self.live = live
+        self.label = label
+        self.samples = []
+        self.overflowed = False
+        self._done = threading.Event()
+        self._start_time = time.perf_counter()
+
+    def run(self):
+        self._start_time = time.perf_counter()
+        while not self._done.wait(self.interval):
+            self.sample()
+        self.sample()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def sample(self):
+        """Record one snapshot of the pipeline state"""
+        mmc = self.mmc
+        capacity = mmc.getBufferTotalCapacity()
+        overflowed = bool(mmc.isBufferOverflowed())
+        self.overflowed = self.overflowed or overflowed
+        written = self.saving_thread.bytes_written
+        pumped = self.pump.frames_pumped
+        now = time.perf_counter() - self._start_time
+        previous = self.samples[-1] if self.samples else {'time_s': 0.0, 'bytes_written': 0, 'frames_pumped': 0}
+        elapsed = now - previous['time_s']
+        sample = {
+            'time_s': now,
+            'circular_buffer_fill': mmc.getRemainingImageCount() / capacity if capacity else 0.0,
+            'circular_buffer_overflowed': overflowed,
+            'queue_depth': self.frame_queue.qsize(),
+            'frames_pumped': pumped,
+            'fps': (pumped - previous['frames_pumped']) / elapsed if elapsed > 0 else 0.0,
+            'frames_written': self.saving_thread.frames_written,
+            'bytes_written': written,
+            'writer_mb_per_s': (written - previous['bytes_written']) / 1024**2 / elapsed if elapsed > 0 else 0.0,
+        }
+        if hasattr(self.frame_queue, 'fill_level'):
+            sample['ring_buffer_fill'] = self.frame_queue.fill_level()
+        self.samples.append(sample)
+        if self.live:
+            prefix = f"[{self.label}] " if self.label else ""
+            tqdm.write(f"{prefix}[{now:7.1f} s] {sample['fps']:.1f} fps | pumped {sample['frames_pumped']} "
+                       f"written {sample['frames_written']} | "
+                       f"circular buffer {sample['circular_buffer_fill']:.0%} | queue {sample['queue_depth']} | "
+                       f"writer {sample['writer_mb_per_s']:.1f} MB/s"
+                       + (" | OVERFLOW" if overflowed else ""))
+
+    def report(self, num_frames, image_numbers=None, trigger_time=None):
+        """
+        Build the end-of-run session report as a JSON-serialisable dict.
+        trigger_time is the time.perf_counter() of the trigger edge that started the acquisition, if any.
+        """
+        pump = self.pump
+        writer = self.saving_thread
+        pumped = pump.frames_pumped
+        written = writer.frames_written
+        report = {
+            'frames_requested': num_frames,
+            'frames_pumped': pumped,
+            'frames_written': written,
+            'pump': pump.summary(),
+            'writer': {
+                'elapsed_s': writer.elapsed,
+                'bytes_written': writer.bytes_written,
+                'mb_per_s': writer.bytes_written / 1024**2 / writer.elapsed if writer.elapsed else 0.0,
+            },
+            'circular_buffer_overflowed': self.overflowed,
+            'circular_buffer_peak_fill': max((s['circular_buffer_fill'] for s in self.samples), default=0.0),
+            'queue_peak_depth': max((s['queue_depth'] for s in self.samples), default=0),
+            'backpressure_events': getattr(self.frame_queue, 'backpressure_events', 0),
+            'samples': self.samples,
+        }
+
+        if trigger_time is not None and pumped:
+            report['trigger_to_first_frame_ms'] = (pump.handoff_times[0] - trigger_time) * 1000
+
+        # ==== Pump-to-disk latency ==== #
+        count = min(pumped, written)
+        if count and writer.write_times is not None:
+            latency_ms = (writer.write_times[:count] - pump.handoff_times[:count]) * 1000
+            counts, _ = np.histogram(latency_ms, bins=LATENCY_BINS_MS)
+            report['pump_to_disk_latency_ms'] = {
+                'bins': [float(edge) for edge in LATENCY_BINS_MS[:-1]] + ['inf'],
+                'counts': counts.tolist(),
+                'mean': float(latency_ms.mean()),
+                'p99': float(np.percentile(latency_ms, 99)),
+                'max': float(latency_ms.max()),
+            }
+
+        # ==== Dropped frames ==== #
+        gaps, missing = frame_counter_gaps(image_numbers) if image_numbers is not None else (0, 0)
+        report['frame_counter_gaps'] = gaps
+        report['frames_missing_from_counter'] = missing
+        report['dropped_frames'] = missing + max(pumped - written, 0)
+        report['no_dropped_frames'] = (
+            report['dropped_frames'] == 0 and gaps == 0 and not self.overflowed and written == num_frames
+        )
+        return report
+
+
+def save_session_report(filename, report):
+    """Write a session report to JSON"""
+    with open(filename, 'w') as fh:
+        json.dump(report, fh, indent=2)
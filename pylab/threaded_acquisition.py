@@ -1,23 +1,20 @@
-from pymmcore_plus import CMMCorePlus
 import numpy as np
 import tifffile
 import os
 from datetime import datetime
-from napari import Viewer, run
+from qtpy.QtCore import QTimer
 from qtpy.QtWidgets import QCheckBox, QPushButton, QWidget, QVBoxLayout, QLineEdit, QLabel, QFormLayout, QProgressBar
-import nidaqmx
 import threading
-import queue
-from queue import Queue
 import time
-from tqdm import tqdm
 from typing import TYPE_CHECKING
 
+from pylab.acquisition import load_session_config, run_session
+from pylab.preview import LivePreview
+from pylab.writers import STACK_EXTENSIONS, make_writer
+
 if TYPE_CHECKING:
     import napari
 
-import time
-import pandas as pd
 
 #SAVE_DIR = r'C:/dev/sipefield/devOutput'
 SAVE_NAME = r'Acquisition_test'
@@ -26,10 +23,27 @@ MM_CONFIG = r'C:/dev/ThorPupil.cfg'
 NIDAQ_DEVICE = 'Dev1'
 CHANNELS = ['port2/line0']
 IO = 'input' # is the NIDAQ an INput or Output Device?
+DAQ_AI_CHANNELS = [] # analog inputs recorded for the whole session, e.g. ['ai0', 'ai1']; empty disables recording
+DAQ_DI_CHANNELS = [] # digital lines recorded on the same sample clock, e.g. ['port0/line1']
+DAQ_RATE = 1000 # DAQ samples per second per channel
+REPLAY_STACK = None # replay a stored stack instead of the camera for dry runs, e.g. r'F:/.../Frames_1_512_512_uint16_0001.tif'
+REPLAY_FPS = None # replay rate (default: the recorded frame times of REPLAY_STACK)
+EXTRA_CAMERAS = {} # cameras streamed in parallel from the same trigger, name -> config, e.g. {'widefield': r'C:/dev/Widefield.cfg'}
+
+mmc = None # Micro-Manager core, loaded by load_core() when an acquisition or the interface first needs it
+
+
+def load_core(config_file=MM_CONFIG):
+    """Return the shared CMMCorePlus, loading the Micro-Manager configuration on first use"""
+    global mmc
+    if mmc is None:
+        from pymmcore_plus import CMMCorePlus
+
+        print("loading Micro-Manager CORE...")
+        mmc = CMMCorePlus.instance()
+        mmc.loadSystemConfiguration(config_file)
+    return mmc
 
-print("loading Micro-Manager CORE...")
-mmc = CMMCorePlus.instance()
-mmc.loadSystemConfiguration(MM_CONFIG)
 
 # Default parameters for file saving
 save_dir = r'F:/sbaskar/202407_SB_F31prelim_pupil'
@@ -39,8 +53,16 @@ session_id = "01"
 num_frames = 24000
 
 ###THREADING
-frame_queue = Queue()
-stop_event = threading.Event()
+ring_buffer_mb = 1024 # memory reserved for frames waiting to be written to disk
+write_batch_size = 64 # frames written to disk per call
+write_batch_ms = 250 # write a partial batch after waiting this long for it to fill
+writer_backend = 'tiff' # 'tiff' appends pages, 'memmap' preallocates the full stack, 'zarr' compresses chunks
+max_file_gb = None # e.g. 4: split the stack into files of at most this size, listed in <stack>_manifest.json
+journal_interval = None # e.g. 5: sync the stack every 5 s so a crashed run can be restored with `pylab recover` (memmap/zarr)
+tiff_series_frames = None # frames per TIFF series: None loses at most one batch in a crash, >= num_frames makes the stack memory-mappable
+writer_mode = 'thread' # 'process' writes from a separate process fed through shared memory
+preview_fps = 15 # maximum live view refresh rate during acquisition
+preview_downsample = 2 # live view is binned by this factor
 ############
 
 # Class to save frames as a TIFF stack with timestamps
@@ -51,24 +73,35 @@ class Output:
         self.subject_id = subject_id
         self.session_id = session_id
 
-    def save(self, frames):
+    def save(self, frames, backend='tiff'):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S') # get current timestamp
         anat_dir = os.path.join(self.save_dir, f"{self.protocol}-{self.subject_id}", f"ses-{self.session_id}", "anat")
         os.makedirs(anat_dir, exist_ok=True) # create the directory if it doesn't exist
-        filename = os.path.join(anat_dir, f"sub-{self.subject_id}_ses-{self.session_id}_{timestamp}.tiff")
-        tifffile.imwrite(filename, np.array(frames)) # save the TIFF stack
-        print(f"Saved TIFF stack: {filename}")
+        filename = os.path.join(anat_dir, f"sub-{self.subject_id}_ses-{self.session_id}_{timestamp}{STACK_EXTENSIONS[backend]}")
+        if backend == 'tiff':
+            tifffile.imwrite(filename, np.array(frames)) # save the TIFF stack
+        else:
+            frames = np.asarray(frames)
+            writer = make_writer(backend, filename, len(frames))
+            writer.open(frames.shape[1:], frames.dtype)
+            writer.write(frames)
+            writer.close()
+        print(f"Saved {backend} stack: {filename}")
 
     def save_md(self, metadata):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S') # get current timestamp
         metadata_dir = os.path.join(save_dir, f"{self.protocol}-{self.subject_id}", f"ses-{self.session_id}", "metadata")
         os.makedirs(metadata_dir, exist_ok=True) # create the directory if it doesn't exist
         filename = os.path.join(metadata_dir, f"sub-{self.subject_id}_ses-{self.session_id}_{timestamp}.csv")
+        import pandas as pd
+
         df = pd.DataFrame(metadata)
         df.to_csv(filename, index=False) # save the metadata as a CSV file
         print(f"Saved metadata: {filename}")
     
     def create_dataframe(self, frames):
+        import pandas as pd
+
         df = pd.DataFrame(frames)
         return df
 class NIDAQ:
@@ -89,6 +122,8 @@ class NIDAQ:
 
     def __enter__(self):
         """During With context, generate input or output channels according to parameter 'io' """
+        import nidaqmx
+
         self.task = nidaqmx.Task()
         if self._io == "input": # Create input channel(s)
             for channel in self.channels:
@@ -122,99 +157,34 @@ class NIDAQ:
         self.trigger(False)
 
 
-class FrameSavingThread(threading.Thread):
-    def __init__(self, frame_queue, stop_event, filename):
-        super().__init__()
-        self.frame_queue = frame_queue
-        self.stop_event = stop_event
-        self.filename = filename
-
-    def run(self):
-        with tifffile.TiffWriter(self.filename) as tiff:
-            with tqdm(total=num_frames, desc='Saving Frames') as pbar:
-                while not self.stop_event.is_set() or not self.frame_queue.empty():
-                    try:
-                        frame = self.frame_queue.get(timeout=1)
-
-                        # Append the frame to the TIFF file
-
-                        tiff.write(frame) 
-                        self.frame_queue.task_done()
-                        pbar.update(1)
-                    except queue.Empty:
-                        continue    
-                pbar.clear
-
-
 # Function to start the MDA sequence
-def start_acquisition(viewer, wait_for_trigger):
+def start_acquisition(viewer, wait_for_trigger, preview=None):
+    mmc = None if REPLAY_STACK else load_core()
 
     ###THREADING
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S') # get current timestamp
-    anat_dir = os.path.join(save_dir, f"{protocol_id}-{subject_id}", f"ses-{session_id}", "anat")
-    os.makedirs(anat_dir, exist_ok=True) # create the directory if it doesn't exist
-    output_filename = os.path.join(anat_dir, f"sub-{subject_id}_ses-{session_id}_{timestamp}.tiff")
-
-    saving_thread = FrameSavingThread(frame_queue, stop_event, output_filename)
+    # Same pipeline as the headless `pylab acquire`, configured from the module settings and the widget fields
+    config = load_session_config(
+        mm_config=MM_CONFIG, extra_cameras=EXTRA_CAMERAS, save_dir=save_dir, protocol_id=protocol_id,
+        subject_id=subject_id, session_id=session_id, num_frames=num_frames,
+        trigger='input' if wait_for_trigger and IO == "input" else 'none', nidaq_device=NIDAQ_DEVICE,
+        trigger_channels=CHANNELS, backend=writer_backend, writer_mode=writer_mode, batch_size=write_batch_size,
+        batch_ms=write_batch_ms, ring_buffer_mb=ring_buffer_mb, max_file_gb=max_file_gb,
+        journal_interval=journal_interval, tiff_series_frames=tiff_series_frames, daq_ai_channels=DAQ_AI_CHANNELS, daq_di_channels=DAQ_DI_CHANNELS,
+        daq_rate=DAQ_RATE, replay=REPLAY_STACK, replay_fps=REPLAY_FPS,
+    )
     ############
 
-    if wait_for_trigger:
+    if wait_for_trigger and IO == "output":
+        # reset NIDAQ output trigger state
         with NIDAQ() as nidaq:
-            if nidaq._io == "output": 
-                # reset NIDAQ output trigger state
-                with NIDAQ() as nidaq:
-                    nidaq.trigger(False)
-            else:
-                print("Waiting for trigger...")
-                while not nidaq.task.read(): # While input signal is not True
-                    time.sleep(0.1)
-    
-    saving_thread.start()
-
-    print(time.ctime(time.time()), ' trigger received, starting acquisition')
-    mmc.startContinuousSequenceAcquisition(0)
-    time.sleep(1)  # Allow some time for the camera to start capturing images
-
-    images = []
-    metadata = []
-    layer = None
-    start_time = time.time()  # Start time of the acquisition
-    for i in range(num_frames):
-        while mmc.getRemainingImageCount() == 0:
-            time.sleep(0.1) 
-            
-        if mmc.getRemainingImageCount() > 0 or mmc.isSequenceRunning():
-            image = mmc.popNextImage()
-            #images.append(image)
-            frame_queue.put(image)
-            #print("frame acquired")
-            # if layer is None:
-            #     # Initialize the live-view layer on the first image
-            #     layer = viewer.add_image(image, name='Live View')
-            # else:
-            #     layer.data = image  # Update the image layer with the new frame
-
-    
-    mmc.stopSequenceAcquisition()
-
-    end_time = time.time()  # End time of the acquisition
-    elapsed_time = end_time - start_time  # Total time taken for the acquisition
-    framerate = num_frames / elapsed_time  # Calculate the average framerate
+            nidaq.trigger(False)
 
-    ###THREADING
-    print("!!! Stopping thread")
-    stop_event.set()
-    print("!!! Joining threads")
-    saving_thread.join()
-    ############
+    run_session(config, mmc=mmc, preview=preview)
 
-    if wait_for_trigger:
-        if nidaq._io == "output": 
+    if wait_for_trigger and IO == "output":
         # reset NIDAQ output trigger state
-            with NIDAQ() as nidaq:
-                nidaq.trigger(False)
-        
-    print(f"started at ctime: {time.ctime(start_time)} with Average framerate: {framerate} frames per second") # TODO sort out possible 2 second process delay between trigger and acquisition
+        with NIDAQ() as nidaq:
+            nidaq.trigger(False)
     
     # Save images to a single TIFF stack with associated metadata
     # acquisition = Output(save_dir, protocol_id, subject_id, session_id)
@@ -230,6 +200,13 @@ class MyWidget(QWidget):
         self.viewer = viewer
         self.layout = QVBoxLayout(self)
         self._trigger_mode = True
+        self._acquisition_thread = None
+
+        # ==== Live preview, refreshed on the Qt thread while acquisition runs in the background ==== #
+        self.preview = LivePreview(max_fps=preview_fps, downsample=preview_downsample)
+        self.preview_layer = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.timeout.connect(self.update_preview)
         
         # ==== Progress bar ==== #
         # self.progress_bar = QProgressBar(self)
@@ -277,7 +254,26 @@ class MyWidget(QWidget):
         subject_id = self.subject_id_input.text()
         session_id = self.session_id_input.text()
         num_frames = int(self.num_frames_input.text())
-        start_acquisition(self.viewer, self._trigger_mode)
+        if self._acquisition_thread is not None and self._acquisition_thread.is_alive():
+            print("Acquisition already running")
+            return
+        # Run the acquisition off the Qt thread so the live view keeps updating
+        self._acquisition_thread = threading.Thread(
+            target=start_acquisition, args=(self.viewer, self._trigger_mode, self.preview), daemon=True
+        )
+        self._acquisition_thread.start()
+        self.preview_timer.start(int(1000 / preview_fps))
+
+    def update_preview(self):
+        frame = self.preview.latest()
+        if frame is not None:
+            if self.preview_layer is None or self.preview_layer not in self.viewer.layers:
+                self.preview_layer = self.viewer.add_image(frame, name='Live View',
+                                                           scale=(preview_downsample, preview_downsample))
+            else:
+                self.preview_layer.data = frame
+        if not self._acquisition_thread.is_alive():
+            self.preview_timer.stop()
         
 
     def test_trigger(self):
@@ -293,7 +289,9 @@ class MyWidget(QWidget):
 
 # Function to start Napari with the custom widget
 def start_napari():
-    
+    from napari import Viewer, run
+
+    load_core() # napari-micromanager picks up the loaded configuration from the shared core
     print("launching interface...")
     viewer = Viewer()
     
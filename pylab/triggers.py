@@ -0,0 +1,135 @@
+import threading
+import time
+
+_READ_TIMEOUT = -200284 # DAQmx error code of a read that timed out (DAQmxErrors.SAMPLES_NOT_YET_AVAILABLE)
+
+
+class SoftwareTrigger:
+    '''
+    Stand-in for a hardware trigger, used for dry runs and tests without a DAQ.
+    Call fire() (or fire_after()) from another thread to release wait().
+
+    Use as a context manager, like NIDAQTrigger.
+    '''
+    def __init__(self):
+        self._edge = threading.Event()
+        self.edge_time = None
+
+    def __enter__(self):
+        self._edge.clear()
+        self.edge_time = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def fire(self):
+        """Produce a trigger edge now"""
+        self.edge_time = time.perf_counter()
+        self._edge.set()
+
+    def fire_after(self, delay):
+        """Produce a trigger edge after `delay` seconds, from a timer thread"""
+        timer = threading.Timer(delay, self.fire)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def wait(self, timeout=None):
+        """Block until the trigger edge; return its time.perf_counter() timestamp, or None on timeout"""
+        if not self._edge.wait(timeout):
+            return None
+        return self.edge_time
+
+
+class NIDAQTrigger:
+    '''
+    Waits for a rising edge on NI-DAQ digital input line(s). The task uses hardware change detection, so
+    task.read() blocks inside the driver until the line changes instead of being polled; the edge is
+    timestamped with time.perf_counter() as soon as the read returns. Devices without change detection
+    fall back to polling the line every `poll_interval` seconds.
+
+    Use as a context manager, like NIDAQ:
+
+        with NIDAQTrigger('Dev1', ['port2/line0']) as trigger:
+            edge_time = trigger.wait()
+
+    Parameters:
+    - device_name (str): Name of the NI-DAQ device (default: 'Dev1')
+    - channels (list): digital input line(s) carrying the trigger (default: ['port2/line0'])
+    - poll_interval (float): polling period when change detection is unavailable (default: 0.001)
+    '''
+    def __init__(self, device_name='Dev1', channels=None, poll_interval=0.001):
+        self.device_name = device_name
+        self.channels = channels if channels else ['port2/line0']
+        self.poll_interval = poll_interval
+        self.task = None
+        self.change_detection = False
+        self.edge_time = None
+
+    def __enter__(self):
+        import nidaqmx
+
+        lines = ','.join(f'{self.device_name}/{channel}' for channel in self.channels)
+        try:
+            self.task = self._start_task(lines, change_detection=True)
+            self.change_detection = True
+        except nidaqmx.DaqError:
+            # e.g. USB devices without change detection, which may only refuse it at start(): poll instead
+            self.task = self._start_task(lines, change_detection=False)
+            self.change_detection = False
+        return self
+
+    def _start_task(self, lines, change_detection):
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType
+
+        task = nidaqmx.Task()
+        try:
+            task.di_channels.add_di_chan(lines)
+            if change_detection:
+                task.timing.cfg_change_detection_timing(rising_edge_chan=lines, sample_mode=AcquisitionType.CONTINUOUS)
+            task.start()
+        except BaseException:
+            task.close()
+            raise
+        return task
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the task() on exit"""
+        if self.task:
+            self.task.close()
+            self.task = None
+
+    def _is_high(self, value):
+        if isinstance(value, list):
+            return any(self._is_high(v) for v in value)
+        return bool(value)
+
+    def wait(self, timeout=None):
+        """Block until the trigger line goes high; return the edge's time.perf_counter(), or None on timeout"""
+        import nidaqmx
+        from nidaqmx.constants import WAIT_INFINITELY
+
+        if not self.task:
+            raise RuntimeError("Task not initialized. Use 'with NIDAQTrigger(...) as trigger:' context.")
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            if self.change_detection:
+                remaining = WAIT_INFINITELY if deadline is None else max(deadline - time.perf_counter(), 0)
+                try:
+                    value = self.task.read(number_of_samples_per_channel=1, timeout=remaining)
+                except nidaqmx.DaqError as e:
+                    if e.error_code != _READ_TIMEOUT:
+                        raise
+                    return None
+            else:
+                value = self.task.read()
+            if self._is_high(value):
+                self.edge_time = time.perf_counter()
+                return self.edge_time
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            if not self.change_detection:
+                time.sleep(self.poll_interval)
+
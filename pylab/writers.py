@@ -0,0 +1,518 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+from tqdm import tqdm
+
+from pylab.journal import JOURNAL_BACKENDS, StackJournal
+
+
+class TiffStackWriter:
+    '''
+    Writes frames to a single TIFF stack. Each block of frames is appended with one call as a contiguous
+    series of pages; the pages of the whole acquisition have the same shape, so they read back as one
+    (frames, height, width) series (see pylab.stacks.open_stack_file).
+
+    tifffile holds back the page directories (IFDs) of a contiguous series until the series is closed, and a
+    stack whose IFDs never reached disk shows only its first page. To bound what a crash, power loss or kill
+    can cost, the series is closed (its IFDs written and the file flushed) before the next block once it holds
+    `series_frames` frames; by default every block is its own series, so at most the frames of the last block
+    written are lost, but the stack is read page by page. Larger series lose up to `series_frames` frames more;
+    only a stack written as a single series (series_frames >= number of frames) can be memory-mapped. The flush hands the data to the OS, it does not fsync:
+    use the journaled 'memmap' or 'zarr' backends when the stack has to survive a power loss.
+
+    Parameters:
+    - filename (str): path of the TIFF file to create
+    - bigtiff (bool): write BigTIFF, required for files larger than 4 GB (default: True)
+    - series_frames (int): frames appended to one contiguous series before it is closed (default: None, one
+      series per block)
+    '''
+    def __init__(self, filename, bigtiff=True, series_frames=None):
+        self.filename = filename
+        self.bigtiff = bigtiff
+        self.series_frames = series_frames or 0
+        self._series_fill = 0
+        self._tiff = None
+
+    def open(self, frame_shape, dtype):
+        self._tiff = tifffile.TiffWriter(self.filename, bigtiff=self.bigtiff)
+
+    def write(self, block):
+        """Append a (frames, height, width) block to the stack"""
+        # A non-contiguous write makes tifffile write the held-back IFDs of the previous series first
+        contiguous = 0 < self._series_fill < self.series_frames
+        self._tiff.write(block, contiguous=contiguous, photometric='minisblack', metadata=None)
+        self._series_fill = self._series_fill + len(block) if contiguous else len(block)
+        self._tiff.filehandle.flush()
+
+    def close(self):
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+
+
+class MemmapStackWriter:
+    '''
+    Writes frames into a TIFF stack that is preallocated at full size when the first frame arrives.
+    The file layout (all pages, contiguous image data) is created up front with tifffile.memmap, so each
+    frame is a plain copy into its mapped slot and the file can be opened for random access (e.g. with
+    tifffile.memmap(filename, mode='r')) while it is still being written. If the acquisition stops early
+    the page chain and shape description are cut down to the frames actually written on close().
+
+    Parameters:
+    - filename (str): path of the TIFF file to create
+    - num_frames (int): number of frames to preallocate
+    '''
+    def __init__(self, filename, num_frames):
+        if not num_frames:
+            raise ValueError("The memmap backend needs the number of frames up front")
+        self.filename = filename
+        self.num_frames = num_frames
+        self.frames_written = 0
+        self._mm = None
+
+    def open(self, frame_shape, dtype):
+        self._mm = tifffile.memmap(self.filename, shape=(self.num_frames,) + tuple(frame_shape), dtype=dtype,
+                                   bigtiff=True, photometric='minisblack')
+
+    def write(self, block):
+        """Copy a (frames, height, width) block into the next slots of the mapped stack"""
+        start = self.frames_written
+        if start + len(block) > self.num_frames:
+            raise ValueError(f"{self.filename} was preallocated for {self.num_frames} frames")
+        self._mm[start:start + len(block)] = block
+        self.frames_written += len(block)
+
+    def flush(self):
+        self._mm.flush()
+
+    def sync(self):
+        """Flush the mapped frames to disk; returns the number of frames that are durable"""
+        self._mm.flush()
+        return self.frames_written
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm = None
+        if 0 < self.frames_written < self.num_frames:
+            truncate_tiff_pages(self.filename, self.frames_written)
+
+
+class ZarrStackWriter:
+    '''
+    Writes frames as a time-chunked, losslessly compressed Zarr (v2 directory layout) array of shape
+    (frames, height, width). Frames are gathered into chunks of `chunk_frames` and every full chunk is
+    compressed with Blosc (zstd + bit shuffle by default) and written to its own file by a pool of worker
+    threads, so compression runs in parallel with acquisition. Blosc releases the GIL while compressing.
+    The array can be opened with zarr.open(filename, mode='r').
+
+    Parameters:
+    - filename (str): path of the .zarr directory to create
+    - num_frames (int): expected number of frames, written to the array metadata until close() (optional)
+    - chunk_frames (int): frames per chunk (default: 64)
+    - cname (str): Blosc compressor, e.g. 'zstd' or 'lz4' (default: 'zstd')
+    - clevel (int): compression level (default: 3)
+    - workers (int): number of compression threads (default: number of CPUs)
+    '''
+    def __init__(self, filename, num_frames=None, chunk_frames=64, cname='zstd', clevel=3, workers=None):
+        self.filename = filename
+        self.num_frames = num_frames or 0
+        self.chunk_frames = chunk_frames
+        self.cname = cname
+        self.clevel = clevel
+        self.workers = workers or os.cpu_count()
+        self.frames_written = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._chunk = None
+        self._chunk_fill = 0
+        self._chunk_index = 0
+        self._synced_chunks = 0
+        self._pending = []
+        self._pool = None
+
+    def open(self, frame_shape, dtype):
+        from numcodecs import Blosc
+
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self._codec = Blosc(cname=self.cname, clevel=self.clevel, shuffle=Blosc.BITSHUFFLE)
+        os.makedirs(self.filename, exist_ok=True)
+        self._write_metadata(self.num_frames)
+        self._chunk = np.zeros((self.chunk_frames,) + self.frame_shape, dtype=self.dtype)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='zarr-writer')
+
+    def write(self, block):
+        """Append a (frames, height, width) block, submitting every chunk that fills up for compression"""
+        start = 0
+        while start < len(block):
+            count = min(len(block) - start, self.chunk_frames - self._chunk_fill)
+            self._chunk[self._chunk_fill:self._chunk_fill + count] = block[start:start + count]
+            self._chunk_fill += count
+            start += count
+            if self._chunk_fill == self.chunk_frames:
+                self._submit_chunk()
+        self.frames_written += len(block)
+        self.raw_bytes += block.nbytes
+
+    def _submit_chunk(self):
+        # Bound the chunks held in memory: wait for the oldest once every worker has two queued
+        while len(self._pending) >= 2 * self.workers:
+            self.compressed_bytes += self._pending.pop(0).result()
+        chunk_path = os.path.join(self.filename, f"{self._chunk_index}.0.0")
+        self._pending.append(self._pool.submit(self._store_chunk, chunk_path, self._chunk))
+        self._chunk = np.zeros_like(self._chunk)
+        self._chunk_fill = 0
+        self._chunk_index += 1
+
+    def _store_chunk(self, chunk_path, chunk):
+        data = self._codec.encode(chunk)
+        with open(chunk_path, 'wb') as fh:
+            fh.write(data)
+        return len(data)
+
+    def sync(self):
+        """
+        Wait for the chunks being compressed and fsync the chunk files written since the last sync.
+        Returns the number of frames in complete chunks on disk; frames of the chunk being filled are not durable.
+        """
+        for future in self._pending:
+            self.compressed_bytes += future.result()
+        self._pending = []
+        for index in range(self._synced_chunks, self._chunk_index):
+            with open(os.path.join(self.filename, f"{index}.0.0"), 'r+b') as fh:
+                os.fsync(fh.fileno())
+        self._synced_chunks = self._chunk_index
+        return self._chunk_index * self.chunk_frames
+
+    def _write_metadata(self, num_frames):
+        zarray = {
+            'zarr_format': 2,
+            'shape': [num_frames, *self.frame_shape],
+            'chunks': [self.chunk_frames, *self.frame_shape],
+            'dtype': self.dtype.str,
+            'compressor': self._codec.get_config(),
+            'fill_value': 0,
+            'order': 'C',
+            'filters': None,
+            'dimension_separator': '.',
+        }
+        with open(os.path.join(self.filename, '.zarray'), 'w') as fh:
+            json.dump(zarray, fh, indent=4)
+
+    def compression_ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+
+    def close(self):
+        if self._pool is None:
+            return
+        if self._chunk_fill:
+            self._submit_chunk() # the last chunk is padded with zeros, as Zarr expects full chunks
+        for future in self._pending:
+            self.compressed_bytes += future.result()
+        self._pending = []
+        self._pool.shutdown()
+        self._pool = None
+        self._write_metadata(self.frames_written)
+
+
+def truncate_tiff_pages(filename, count):
+    """
+    Cut the page chain of a TIFF stack after `count` pages and update its shape description, without
+    touching the image data. Used to finalise preallocated stacks that received fewer frames than planned.
+    """
+    with tifffile.TiffFile(filename) as tif:
+        if count >= len(tif.pages):
+            return
+        tiff = tif.tiff
+        ifd_offset = tif.pages[count - 1].offset
+        frame_shape = tif.series[0].shape[1:]
+    with open(filename, 'r+b') as fh:
+        fh.seek(ifd_offset)
+        tag_count = struct.unpack(tiff.tagnoformat, fh.read(tiff.tagnosize))[0]
+        fh.seek(ifd_offset + tiff.tagnosize + tag_count * tiff.tagsize)
+        fh.write(b'\0' * tiff.offsetsize)
+    tifffile.tiffcomment(filename, json.dumps({'shape': [count, *frame_shape]}), pageindex=0)
+
+
+class RolloverWriter:
+    '''
+    Splits a stack into several files of bounded size, each written by its own backend writer
+    (<stem>_000.tiff, <stem>_001.tiff, ...). A block that crosses the limit is split, so every frame lands in
+    exactly one file. After every rollover and on close() a manifest <stem>_manifest.json lists the files and
+    the global index of their first frame, so frame i is page i - first_frame of the file that contains it.
+    Open the session as one lazy stack with pylab.stacks.VirtualStack.
+
+    Parameters:
+    - backend (str): storage backend of each file, see make_writer()
+    - filename (str): name of the stack; parts and manifest are named after it
+    - num_frames (int): expected number of frames in the session (optional, required by 'memmap')
+    - max_frames (int): maximum frames per file (optional)
+    - max_bytes (int): maximum image bytes per file (optional)
+    - series_frames (int): frames per TIFF series of each file, see TiffStackWriter (optional, 'tiff' backend)
+    '''
+    def __init__(self, backend, filename, num_frames=None, max_frames=None, max_bytes=None, series_frames=None):
+        if not max_frames and not max_bytes:
+            raise ValueError("RolloverWriter needs max_frames or max_bytes")
+        self.backend = backend
+        self.filename = filename
+        self.num_frames = num_frames
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.series_frames = series_frames
+        stem, self.extension = os.path.splitext(filename)
+        self.manifest_filename = stem + '_manifest.json'
+        self.frames_written = 0
+        self.compressed_bytes = 0
+        self.parts = []
+        self._writer = None
+        self._part_frames = 0
+
+    def open(self, frame_shape, dtype):
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        frames_per_file = self.max_frames or np.inf
+        if self.max_bytes:
+            frame_nbytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+            frames_per_file = min(frames_per_file, max(1, self.max_bytes // frame_nbytes))
+        self.frames_per_file = int(frames_per_file)
+
+    def _part_filename(self, index):
+        stem = os.path.splitext(self.filename)[0]
+        return f"{stem}_{index:03d}{self.extension}"
+
+    def _roll_over(self):
+        self._close_part()
+        part_frames = self.frames_per_file
+        if self.num_frames and self.num_frames > self.frames_written:
+            part_frames = min(part_frames, self.num_frames - self.frames_written) # the last file can be shorter
+        filename = self._part_filename(len(self.parts))
+        self._writer = make_writer(self.backend, filename, part_frames, series_frames=self.series_frames)
+        self._writer.open(self.frame_shape, self.dtype)
+        self.parts.append({'filename': os.path.basename(filename), 'first_frame': self.frames_written, 'frames': 0})
+        self._part_frames = 0
+
+    def _close_part(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self.compressed_bytes += getattr(self._writer, 'compressed_bytes', 0)
+        self._writer = None
+        self.write_manifest()
+
+    def write(self, block):
+        """Append a (frames, height, width) block, starting a new file whenever the current one is full"""
+        start = 0
+        while start < len(block):
+            if self._writer is None or self._part_frames == self.frames_per_file:
+                self._roll_over()
+            count = min(len(block) - start, self.frames_per_file - self._part_frames)
+            self._writer.write(block[start:start + count])
+            start += count
+            self._part_frames += count
+            self.frames_written += count
+            self.parts[-1]['frames'] = self._part_frames
+
+    @property
+    def current_filename(self):
+        """File that receives the next frames"""
+        return os.path.join(os.path.dirname(self.filename), self.parts[-1]['filename']) if self.parts else self.filename
+
+    @property
+    def current_first_frame(self):
+        return self.parts[-1]['first_frame'] if self.parts else 0
+
+    def flush(self):
+        if hasattr(self._writer, 'flush'):
+            self._writer.flush()
+
+    def sync(self):
+        """Make the frames of the current file durable; returns the number of durable frames of the whole stack"""
+        if self._writer is None:
+            return self.frames_written # every file written so far has been closed
+        return self.current_first_frame + self._writer.sync()
+
+    def write_manifest(self):
+        manifest = {
+            'backend': self.backend,
+            'frames': self.frames_written,
+            'frame_shape': list(self.frame_shape),
+            'dtype': self.dtype.str,
+            'files': self.parts,
+        }
+        with open(self.manifest_filename, 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+
+    def compression_ratio(self):
+        raw_bytes = self.frames_written * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        return raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+
+    def close(self):
+        self._close_part()
+
+
+# File extension of the stack written by each storage backend
+STACK_EXTENSIONS = {'tiff': '.tiff', 'memmap': '.tiff', 'zarr': '.zarr'}
+
+
+def make_writer(backend, filename, num_frames=None, max_file_frames=None, max_file_bytes=None, series_frames=None):
+    """
+    Create the stack writer for a storage backend:
+    'tiff' (append pages), 'memmap' (preallocated TIFF) or 'zarr' (chunked, compressed).
+    With max_file_frames or max_file_bytes the stack is split into several files, see RolloverWriter.
+    series_frames sets how many frames of a 'tiff' stack form one contiguous series (default: one series per
+    block, the least a crash can lose; only a stack written as one series can be memory-mapped), see TiffStackWriter.
+    """
+    if max_file_frames or max_file_bytes:
+        return RolloverWriter(backend, filename, num_frames, max_file_frames, max_file_bytes, series_frames)
+    if backend == 'tiff':
+        return TiffStackWriter(filename, series_frames=series_frames)
+    if backend == 'memmap':
+        return MemmapStackWriter(filename, num_frames)
+    if backend == 'zarr':
+        return ZarrStackWriter(filename, num_frames)
+    raise ValueError(f"Unknown writer backend: {backend}")
+
+
+class FrameSavingThread(threading.Thread):
+    '''
+    Thread that takes frames from frame_queue and writes them to disk in batches.
+    Frames are collected until `batch_size` frames are waiting or `batch_timeout_ms` has passed,
+    then the whole batch is written as one contiguous block. With a FrameRingBuffer
+    the batch is a view of consecutive ring slots and is written without copying; with a queue.Queue the
+    frames are copied into one reused batch array.
+
+    Parameters:
+    - frame_queue (queue.Queue or FrameRingBuffer): source of frames from the acquisition pump
+    - stop_event (threading.Event): set once the acquisition is finished; the thread exits when the queue is empty
+    - filename (str): output file
+    - num_frames (int): expected number of frames, used for the progress bar
+    - batch_size (int): maximum number of frames written per call (default: 64, 1 writes frame by frame)
+    - batch_timeout_ms (float): write a partial batch after waiting this long for it to fill (default: 250)
+    - backend (str): storage backend, see make_writer() (default: 'tiff')
+    - metadata (FrameMetadataBuffer): per-frame metadata to flush to disk alongside the frames (optional)
+    - max_file_frames (int): start a new file after this many frames (optional)
+    - max_file_bytes (int): start a new file before it exceeds this many image bytes (optional)
+    - journal_interval (float): sync the stack and append the number of durable frames to <stem>_journal.jsonl
+      every this many seconds, so that an interrupted run can be recovered with recover_stack()
+      (optional, 'memmap' and 'zarr' backends)
+    - series_frames (int): frames per TIFF series, see TiffStackWriter (optional, 'tiff' backend)
+
+    If writing fails the exception is kept in `error` before the thread exits; a FrameRingBuffer feeding the
+    thread then raises WriterFailedError from put() instead of waiting for slots that will never be released.
+    '''
+    def __init__(self, frame_queue, stop_event, filename, num_frames=None, batch_size=64, batch_timeout_ms=250,
+                 backend='tiff', metadata=None, max_file_frames=None, max_file_bytes=None, journal_interval=None,
+                 series_frames=None):
+        super().__init__()
+        if journal_interval and backend not in JOURNAL_BACKENDS:
+            raise ValueError(f"Journaled writes need one of the {JOURNAL_BACKENDS} backends, not {backend!r}")
+        self.frame_queue = frame_queue
+        self.stop_event = stop_event
+        self.filename = filename
+        self.num_frames = num_frames
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout_ms / 1000
+        self.backend = backend
+        self.writer = make_writer(backend, filename, num_frames, max_file_frames, max_file_bytes, series_frames)
+        self.journal = StackJournal(filename, journal_interval) if journal_interval else None
+        self.metadata = metadata
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.elapsed = 0.0
+        self.error = None
+        # time.perf_counter() at which each frame was handed to the storage backend
+        self.write_times = np.zeros(num_frames, dtype=np.float64) if num_frames else None
+        self._batch = None
+        if hasattr(frame_queue, 'consumer'):
+            frame_queue.consumer = self
+
+    def run(self):
+        opened = False
+        start_time = time.perf_counter()
+        try:
+            with tqdm(total=self.num_frames, desc='Saving Frames') as pbar:
+                while not self.stop_event.is_set() or not self.frame_queue.empty():
+                    block = self._next_batch()
+                    if block is None:
+                        continue
+                    if not opened:
+                        self.writer.open(block.shape[1:], block.dtype)
+                        if self.journal is not None:
+                            self.journal.open(self.writer, self.backend, self.num_frames, block.shape[1:], block.dtype)
+                        opened = True
+                    self.writer.write(block)
+                    self._release(len(block))
+                    if self.write_times is not None:
+                        self.write_times[self.frames_written:self.frames_written + len(block)] = time.perf_counter()
+                    self.frames_written += len(block)
+                    self.bytes_written += block.nbytes
+                    pbar.update(len(block))
+                    if self.metadata is not None:
+                        self.metadata.flush(min_interval=1.0)
+                    if self.journal is not None:
+                        self.journal.sync(self.writer, self.metadata)
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self.writer.close()
+            if self.metadata is not None:
+                self.metadata.flush()
+            if self.journal is not None:
+                self.journal.close(self.frames_written)
+            self.elapsed = time.perf_counter() - start_time
+        print(self.report())
+
+    def report(self):
+        """One-line summary of writer throughput (and compression, for compressed backends)"""
+        mb_written = self.bytes_written / 1024**2
+        line = f"Saved {self.frames_written} frames ({mb_written:.0f} MB) to {self.filename} " \
+               f"at {mb_written / self.elapsed if self.elapsed else 0:.1f} MB/s"
+        if getattr(self.writer, 'compressed_bytes', 0):
+            line += f", compression ratio {self.writer.compression_ratio():.2f}x " \
+                    f"({self.writer.compressed_bytes / 1024**2:.0f} MB on disk)"
+        return line
+
+    def _release(self, count):
+        """Mark `count` frames as written so a ring buffer can reuse their slots"""
+        if hasattr(self.frame_queue, 'get_many'):
+            self.frame_queue.task_done(count)
+        else:
+            for _ in range(count):
+                self.frame_queue.task_done()
+
+    def _next_batch(self):
+        """Collect the next batch of frames, or return None if no frame arrived in time"""
+        if hasattr(self.frame_queue, 'get_many'):
+            try:
+                return self.frame_queue.get_many(self.batch_size, timeout=self.batch_timeout)
+            except queue.Empty:
+                return None
+        try:
+            frame = self.frame_queue.get(timeout=1)
+        except queue.Empty:
+            return None
+        if self._batch is None:
+            self._batch = np.empty((self.batch_size,) + frame.shape, dtype=frame.dtype)
+        self._batch[0] = frame
+        count = 1
+        deadline = time.perf_counter() + self.batch_timeout
+        while count < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                self._batch[count] = self.frame_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            count += 1
+        return self._batch[:count]
@@ -0,0 +1,93 @@
+"""Stand-ins for CMMCorePlus and writer helpers shared by the acquisition tests"""
+import threading
+
+import numpy as np
+
+from pylab.writers import FrameSavingThread
+
+
+class FakeCore:
+    """Circular buffer stand-in that releases frames in bursts"""
+
+    def __init__(self, bursts, shape=(4, 4)):
+        self.bursts = list(bursts)
+        self.shape = shape
+        self.buffer = []
+        self.count = 0
+
+    def getRemainingImageCount(self):
+        if not self.buffer and self.bursts:
+            for _ in range(self.bursts.pop(0)):
+                self.buffer.append(np.full(self.shape, self.count, np.uint16))
+                self.count += 1
+        return len(self.buffer)
+
+    def isSequenceRunning(self):
+        return bool(self.bursts)
+
+    def popNextImage(self):
+        return self.buffer.pop(0)
+
+    def popNextImageAndMD(self):
+        image = self.buffer.pop(0)
+        return image, {'ImageNumber': str(image[0, 0])}
+
+
+class MonitoredCore(FakeCore):
+    """FakeCore with the circular-buffer queries read by AcquisitionMonitor"""
+
+    def getBufferTotalCapacity(self):
+        return 100
+
+    def isBufferOverflowed(self):
+        return False
+
+
+class SessionCore(MonitoredCore):
+    """Camera that only releases frames once its sequence has been started"""
+
+    def __init__(self, bursts, shape=(4, 4)):
+        super().__init__(bursts, shape)
+        self.started = False
+        self.stopped = False
+
+    def getImageHeight(self):
+        return self.shape[0]
+
+    def getImageWidth(self):
+        return self.shape[1]
+
+    def getBytesPerPixel(self):
+        return 2
+
+    def getCameraDevice(self):
+        return 'Camera'
+
+    def prepareSequenceAcquisition(self, camera):
+        pass
+
+    def startContinuousSequenceAcquisition(self, interval):
+        self.started = True
+
+    def stopSequenceAcquisition(self):
+        self.stopped = True
+
+    def getRemainingImageCount(self):
+        return super().getRemainingImageCount() if self.started else 0
+
+
+def make_frames(count, shape=(16, 8)):
+    """Frames whose pixels all hold their index"""
+    return [np.full(shape, i, dtype=np.uint16) for i in range(count)]
+
+
+def run_writer(frame_queue, frames, filename, **kwargs):
+    """Write `frames` through a FrameSavingThread fed from `frame_queue` and wait for it to finish"""
+    stop_event = threading.Event()
+    writer = FrameSavingThread(frame_queue, stop_event, filename, len(frames), **kwargs)
+    writer.start()
+    for frame in frames:
+        frame_queue.put(frame)
+    stop_event.set()
+    writer.join()
+    return writer
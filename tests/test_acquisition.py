@@ -0,0 +1,52 @@
+import errno
+import json
+import os
+
+import pytest
+import tifffile
+
+from pylab.acquisition import DEFAULT_SESSION_CONFIG, load_session_config, run_session, save_session_config
+from tests.fakes import SessionCore
+
+
+def test_session_config_overrides_defaults():
+    with open('session.json', 'w') as fh:
+        json.dump({'num_frames': 100, 'backend': 'zarr'}, fh)
+    config = load_session_config('session.json', num_frames=50, subject_id=None)
+    assert config['num_frames'] == 50
+    assert config['backend'] == 'zarr'
+    assert config['subject_id'] == DEFAULT_SESSION_CONFIG['subject_id']
+    save_session_config('template.json')
+    assert load_session_config('template.json') == DEFAULT_SESSION_CONFIG
+
+
+def test_session_config_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        load_session_config(num_frame=10)
+    with pytest.raises(ValueError):
+        load_session_config(trigger='output')
+
+
+def test_headless_session_writes_stack_and_report(tmpdir):
+    config = load_session_config(save_dir=str(tmpdir), subject_id='m1', num_frames=6, batch_size=4, batch_ms=5,
+                                 camera_name='pupil')
+    reports = run_session(config, mmc=SessionCore([3, 3]))
+    assert reports['pupil']['no_dropped_frames']
+    anat_dir = os.path.join(str(tmpdir), 'baseline-m1', 'ses-01', 'anat')
+    stacks = [name for name in os.listdir(anat_dir) if name.endswith('.tiff')]
+    assert len(stacks) == 1 and stacks[0].startswith('sub-m1_ses-01_')
+    assert tifffile.imread(os.path.join(anat_dir, stacks[0])).shape == (6, 4, 4)
+    assert os.path.exists(os.path.join(anat_dir, stacks[0].replace('.tiff', '_report.json')))
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_failed_session_prints_its_summary(tmpdir, monkeypatch, capsys):
+    def disk_full(self, block):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr('pylab.writers.TiffStackWriter.write', disk_full)
+    config = load_session_config(save_dir=str(tmpdir), num_frames=40, batch_size=1, batch_ms=5, camera_name='pupil')
+    with pytest.raises(RuntimeError): # the writer failure, or the pump stopped by it
+        run_session(config, mmc=SessionCore([2] * 20))
+    summary = capsys.readouterr().out
+    assert '[pupil]' in summary and 'No space left on device' in summary
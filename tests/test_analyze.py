@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+
+pytest.importorskip('skimage')
+from skimage import exposure, filters, measure
+
+from pylab.analyze import (analyze_images, label_stack, load_tiff_stack, preprocess_images, region_table,
+                           save_region_table)
+from pylab.histogram import StreamingHistogram
+
+
+def _stack(count=23, shape=(20, 17)):
+    rng = np.random.default_rng(0)
+    images = (rng.random((count,) + shape) * 1000).astype(np.uint16)
+    images[5:9, 3:8, 3:8] += 3000
+    images[10:16, 10:14, 2:6] += 3000
+    return images
+
+
+def test_streaming_analysis_matches_whole_stack():
+    images = _stack()
+    with tifffile.TiffWriter('stack.tiff') as tif:
+        for block in np.array_split(images, 3): # pages not contiguous: read page by page
+            tif.write(block, contiguous=False, photometric='minisblack')
+    stack = load_tiff_stack('stack.tiff')
+    assert not isinstance(stack, np.ndarray)
+
+    preprocessed = preprocess_images(stack, block_frames=4, out_dir='analysis')
+    assert preprocessed.dtype == np.float32
+    np.testing.assert_allclose(preprocessed, exposure.equalize_hist(images), rtol=1e-6)
+    edges, labeled_image, regions = analyze_images(preprocessed, block_frames=4, out_dir='analysis')
+    expected = np.asarray(preprocessed)
+    np.testing.assert_allclose(edges, filters.sobel(expected), rtol=1e-6)
+    np.testing.assert_array_equal(labeled_image, measure.label(expected > filters.threshold_otsu(expected)))
+    assert len(regions['label']) == labeled_image.max()
+    assert os.path.exists(os.path.join('analysis', 'labels.npy'))
+
+
+@pytest.mark.parametrize('block_frames', [1, 3, 50])
+def test_labels_merge_across_blocks(block_frames):
+    binary = np.random.default_rng(1).random((30, 25, 25)) > 0.75
+    np.testing.assert_array_equal(label_stack(binary, block_frames), measure.label(binary))
+
+
+def test_uint16_equalization_thresholds_in_one_pass():
+    images = _stack()
+    preprocessed = preprocess_images(images, block_frames=5, dtype=np.uint16)
+    assert preprocessed.dtype == np.uint16
+    _, labeled_image, _ = analyze_images(preprocessed, block_frames=5)
+    np.testing.assert_array_equal(labeled_image,
+                                  measure.label(preprocessed > filters.threshold_otsu(preprocessed)))
+
+
+@pytest.mark.parametrize('dtype, workers', [(np.float32, 1), (np.float32, 2), (np.uint16, 1)])
+def test_lookup_table_matches_preprocessed_stack(dtype, workers):
+    images = _stack()
+    expected = analyze_images(preprocess_images(images, block_frames=5, dtype=dtype), block_frames=5)
+    lut = StreamingHistogram.from_stack(images).equalization_lut(dtype)
+    edges, labeled_image, regions = analyze_images(images, block_frames=5, workers=workers, lut=lut)
+    np.testing.assert_array_equal(edges, expected[0])
+    np.testing.assert_array_equal(labeled_image, expected[1])
+    for name in expected[2]:
+        np.testing.assert_array_equal(regions[name], expected[2][name])
+
+
+def test_process_pool_matches_serial_analysis():
+    images = _stack()
+    serial = analyze_images(images, block_frames=4)
+    for parallel in [analyze_images(images, block_frames=4, workers=2),
+                     analyze_images(images, block_frames=4, workers=2, out_dir='analysis')]:
+        np.testing.assert_array_equal(parallel[0], serial[0])
+        np.testing.assert_array_equal(parallel[1], serial[1])
+        for name in serial[2]:
+            np.testing.assert_array_equal(parallel[2][name], serial[2][name])
+    # the workers wrote the labels straight into the output file
+    np.testing.assert_array_equal(np.load(os.path.join('analysis', 'labels.npy')), serial[1])
+
+
+def test_per_frame_analysis_labels_each_frame():
+    images = _stack()
+    edges, labeled_image, regions = analyze_images(images, block_frames=4, workers=2, per_frame=True)
+    threshold = filters.threshold_otsu(images)
+    offset = 0
+    for i, frame in enumerate(images):
+        np.testing.assert_allclose(edges[i], filters.sobel(frame))
+        expected = measure.label(frame > threshold)
+        np.testing.assert_array_equal(labeled_image[i], np.where(expected > 0, expected + offset, 0))
+        offset += expected.max()
+    assert len(regions['label']) == offset
+    assert np.all(regions['frame'] == regions['last_frame'])
+
+
+def test_region_table_matches_regionprops():
+    rng = np.random.default_rng(2)
+    labeled_image = measure.label(rng.random((20, 25, 25)) > 0.75)
+    intensity = rng.random(labeled_image.shape)
+    regions = region_table(labeled_image, intensity, block_frames=3)
+    props = measure.regionprops(labeled_image, intensity_image=intensity)
+    np.testing.assert_array_equal(regions['label'], [p.label for p in props])
+    np.testing.assert_array_equal(regions['area'], [p.area for p in props])
+    np.testing.assert_array_equal(regions['frame'], [p.bbox[0] for p in props])
+    np.testing.assert_array_equal(regions['last_frame'], [p.bbox[3] - 1 for p in props])
+    np.testing.assert_allclose(np.stack([regions['centroid_y'], regions['centroid_x']], axis=1),
+                               [p.centroid[1:] for p in props])
+    np.testing.assert_allclose(regions['mean_intensity'], [p.intensity_mean for p in props])
+
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    save_region_table('regions.parquet', regions)
+    np.testing.assert_array_equal(pd.read_parquet('regions.parquet')['area'], regions['area'])
+
+
+def test_analyze_stack_reuses_cached_stages(monkeypatch):
+    from pylab import analyze
+
+    tifffile.imwrite('stack.tiff', _stack(), photometric='minisblack')
+    images, edges, labeled_image, regions = analyze.analyze_stack('stack.tiff', cache_dir='cache')
+    expected = analyze_images(preprocess_images(_stack()))
+    np.testing.assert_array_equal(labeled_image, expected[1])
+    np.testing.assert_allclose(images[:], preprocess_images(_stack()))
+    # only the lookup table of the equalization is cached, not an equalized copy of the stack
+    assert all(not name.startswith('preprocess') for name in os.listdir('cache'))
+    monkeypatch.setattr(analyze, 'preprocess_images', None) # a cached run must not recompute
+    monkeypatch.setattr(analyze, 'analyze_images', None)
+    again = analyze.analyze_stack('stack.tiff', cache_dir='cache')
+    np.testing.assert_array_equal(again[2], labeled_image)
+    np.testing.assert_array_equal(again[3]['area'], regions['area'])
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+
+from pylab.atlas import AtlasStore, dorsal_projection, read_annotation_volume
+
+nrrd = pytest.importorskip('nrrd')
+
+
+def _volume(shape=(10, 6, 15)):
+    """(AP, DV, ML) annotation with two cortical areas over a deeper structure and empty space around the brain"""
+    volume = np.zeros(shape, dtype=np.uint32)
+    volume[1:9, 2:, 1:14] = 672 # deep structure
+    volume[1:9, 1, 1:7] = 614454277 # dorsal areas on the surface
+    volume[1:9, 1, 7:14] = 385
+    volume[4, 1, 3] = 0 # a hole in the surface shows the structure below
+    return volume
+
+
+def _brute_force_projection(volume):
+    projection = np.zeros((volume.shape[0], volume.shape[2]), dtype=volume.dtype)
+    for ap in range(volume.shape[0]):
+        for ml in range(volume.shape[2]):
+            column = volume[ap, :, ml]
+            if column.any():
+                projection[ap, ml] = column[np.flatnonzero(column)[0]]
+    return projection
+
+
+def test_dorsal_projection_takes_first_labeled_voxel():
+    volume = _volume()
+    np.testing.assert_array_equal(dorsal_projection(volume, slab=4), _brute_force_projection(volume))
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip'])
+def test_annotation_volume_is_read_in_allen_order(encoding):
+    volume = _volume()
+    nrrd.write('annotation.nrrd', volume, {'encoding': encoding})
+    data = read_annotation_volume('annotation.nrrd')
+    assert isinstance(data, np.memmap) == (encoding == 'raw')
+    np.testing.assert_array_equal(data, volume)
+
+
+def test_store_projects_once_and_works_offline():
+    volume = _volume()
+    store = AtlasStore('atlas', download=False)
+    os.makedirs(os.path.dirname(store.volume_filename(10)))
+    nrrd.write(store.volume_filename(10), volume, {'encoding': 'raw'})
+    labels = store.dorsal_labels(10)
+    assert labels.dtype == np.uint16
+    np.testing.assert_array_equal(store.region_ids(10), [0, 385, 672, 614454277])
+    np.testing.assert_array_equal(store.dorsal_annotation(10), _brute_force_projection(volume))
+
+    os.remove(store.volume_filename(10)) # later runs only need the projection
+    store = AtlasStore('atlas', download=False)
+    assert isinstance(store.dorsal_labels(10), np.memmap)
+    np.testing.assert_array_equal(store.dorsal_annotation(50), _brute_force_projection(volume)[2::5, 2::5])
+    with pytest.raises(FileNotFoundError):
+        store.dorsal_labels(25)
@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pylab.buffers import FrameRingBuffer, WriterFailedError
+
+
+def test_ring_buffer_reuses_slots_without_copying():
+    ring = FrameRingBuffer(2, (3, 3))
+    for value in range(5):
+        ring.put(np.full((3, 3), value))
+        frame = ring.get()
+        assert np.shares_memory(frame, ring.frames)
+        assert frame[0, 0] == value
+        ring.task_done()
+    assert ring.head == ring.tail == 5
+    assert ring.empty()
+
+
+def test_full_ring_buffer_reports_backpressure():
+    ring = FrameRingBuffer(2, (2, 2))
+    ring.put(np.zeros((2, 2)))
+    ring.put(np.ones((2, 2)))
+    with pytest.raises(queue.Full):
+        ring.put(np.ones((2, 2)), timeout=0.01)
+    assert ring.backpressure_events == 1
+
+    # a blocked producer resumes once the consumer releases a slot
+    producer = threading.Thread(target=ring.put, args=(np.full((2, 2), 7),))
+    producer.start()
+    while ring.backpressure_events < 2:
+        time.sleep(0.001)
+    ring.get()
+    ring.task_done()
+    producer.join(timeout=1)
+    assert not producer.is_alive()
+    assert ring.get()[0, 0] == 1
+    assert ring.get()[0, 0] == 7
+
+
+def test_blocked_put_raises_once_the_writer_fails():
+    class FailedWriter:
+        error = None
+
+    ring = FrameRingBuffer(1, (2, 2))
+    ring.consumer = FailedWriter()
+    ring.put(np.zeros((2, 2)))
+    errors = []
+
+    def produce():
+        try:
+            ring.put(np.ones((2, 2)))
+        except WriterFailedError as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    ring.consumer.error = OSError(28, 'No space left on device')
+    producer.join(timeout=1)
+    assert not producer.is_alive()
+    assert isinstance(errors[0].__cause__, OSError)
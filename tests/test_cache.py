@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+from pylab import cache as cache_module
+from pylab.cache import AnalysisCache, file_fingerprint
+
+
+def test_fingerprint_follows_content(monkeypatch):
+    monkeypatch.setattr(cache_module, 'SAMPLE_BYTES', 16)
+    monkeypatch.setattr(cache_module, 'SAMPLES', 4)
+    data = np.arange(4096, dtype=np.uint16)
+    data.tofile('stack.raw')
+    fingerprint = file_fingerprint('stack.raw')
+    assert file_fingerprint('stack.raw') == fingerprint
+    data[0] = 1 # the first block is always sampled
+    data.tofile('stack.raw')
+    assert file_fingerprint('stack.raw') != fingerprint
+    assert file_fingerprint('stack.raw', full=True) != file_fingerprint('stack.raw')
+
+
+def test_fingerprint_follows_edits_between_samples(monkeypatch):
+    monkeypatch.setattr(cache_module, 'SAMPLE_BYTES', 16)
+    monkeypatch.setattr(cache_module, 'SAMPLES', 4)
+    data = np.arange(4096, dtype=np.uint16)
+    data.tofile('stack.raw')
+    os.utime('stack.raw', ns=(0, 10**18))
+    fingerprint = file_fingerprint('stack.raw')
+    data[1000] += 1 # same size, outside the sampled blocks
+    data.tofile('stack.raw')
+    os.utime('stack.raw', ns=(0, 10**18 + 1))
+    assert file_fingerprint('stack.raw') != fingerprint
+
+
+def test_stages_are_computed_once():
+    cache = AnalysisCache('cache')
+    calls = []
+
+    def compute(out_dir):
+        calls.append(out_dir)
+        kept = np.lib.format.open_memmap(os.path.join(out_dir, 'kept.npy'), mode='w+', dtype=np.float32, shape=(3, 4))
+        kept[:] = 1
+        return {'kept': kept, 'saved': np.arange(5), 'table': {'label': np.arange(1, 4), 'area': np.ones(3)}}
+
+    key, value = cache.run('stage', ['input'], {'threshold': 2}, compute)
+    key_again, value_again = cache.run('stage', ['input'], {'threshold': 2}, compute)
+    assert len(calls) == 1 and key_again == key
+    assert isinstance(value_again['kept'], np.memmap)
+    np.testing.assert_array_equal(value_again['kept'], np.ones((3, 4)))
+    np.testing.assert_array_equal(value_again['saved'], np.arange(5))
+    np.testing.assert_array_equal(value_again['table']['label'], [1, 2, 3])
+    assert cache.key('stage', ['input'], {'threshold': 3}) != key
+    assert cache.key('later', [key]) != cache.key('later', ['other'])
+
+
+def test_least_recently_used_entries_are_evicted():
+    max_gb = 2.5 * 8000 / 1024**3 # room for two 8000-byte entries
+    cache = AnalysisCache('cache', max_gb)
+    keys = [cache.run('stage', [str(i)], {}, lambda out_dir: {'data': np.zeros(1000)})[0] for i in range(2)]
+    cache.load(keys[0]) # keys[1] is now the least recently used
+    later_run = AnalysisCache('cache', max_gb)
+    third, _ = later_run.run('stage', ['2'], {}, lambda out_dir: {'data': np.zeros(1000)})
+    assert keys[0] in cache and third in cache
+    assert keys[1] not in cache
+    assert later_run.nbytes <= later_run.max_bytes
+    assert os.listdir(os.path.join('cache', '.trash')) == []
+
+
+def test_entries_used_in_the_current_run_are_kept():
+    cache = AnalysisCache('cache', max_gb=1.5 * 8000 / 1024**3) # room for one entry
+    first, value = cache.run('stage', ['0'], {}, lambda out_dir: {'data': np.zeros(1000)})
+    second, _ = cache.run('stage', ['1'], {}, lambda out_dir: {'data': np.ones(1000)})
+    assert first in cache and second in cache # over the cap rather than deleting a mapped entry
+    np.testing.assert_array_equal(value['data'], np.zeros(1000))
@@ -0,0 +1,22 @@
+import time
+
+import numpy as np
+
+from pylab.daq_recorder import DAQRecorder, SimulatedRecordingBackend, load_daq_recording
+
+
+def test_simulated_recording_streams_blocks_with_clock_reference():
+    backend = SimulatedRecordingBackend(['ai0', 'ai1'], ['port0/line0'], rate=2000, pulse_rate=100)
+    recorder = DAQRecorder(backend, 'session_daq', block_size=100)
+    before = time.perf_counter()
+    recorder.start()
+    time.sleep(0.2)
+    recorder.stop()
+    assert recorder.error is None
+
+    header, analog, digital, times = load_daq_recording('session_daq')
+    assert header['samples'] == recorder.samples_written == len(analog) == len(digital)
+    assert analog.shape[1] == 2 and digital.shape[1] == 1
+    assert header['perf_counter_at_start'] >= before
+    np.testing.assert_allclose(np.diff(times), 1 / 2000)
+    assert set(np.unique(digital)) == {0, 1}
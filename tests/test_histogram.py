@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from pylab.histogram import StreamingHistogram
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    images = rng.normal(1000, 200, size=(12, 16, 16)).clip(0, 65535).astype(np.uint16)
+    images[3:6, 4:10, 4:10] += 2000
+    return images
+
+
+def test_histogram_accumulates_chunks():
+    images = _images()
+    hist = StreamingHistogram.from_stack(images, block_frames=5)
+    assert hist.total == images.size
+    assert (hist.min, hist.max) == (images.min(), images.max())
+    np.testing.assert_array_equal(hist.counts[:images.max() + 1], np.bincount(images.ravel()))
+
+
+def test_statistics_match_whole_stack():
+    pytest.importorskip('skimage')
+    from skimage import exposure, filters
+
+    images = _images()
+    hist = StreamingHistogram.from_stack(images, block_frames=5)
+    assert hist.otsu() == filters.threshold_otsu(images)
+    np.testing.assert_allclose(hist.equalize(images), exposure.equalize_hist(images), rtol=1e-6)
+    q = [0, 1, 37.5, 50, 99, 100]
+    np.testing.assert_allclose(hist.percentile(q), np.percentile(images, q))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint16])
+def test_mapped_histogram_matches_histogram_of_mapped_stack(dtype):
+    from pylab.histogram import stack_histogram
+
+    images = _images()
+    hist = StreamingHistogram.from_stack(images)
+    lut = hist.equalization_lut(dtype)
+    counts, centers = hist.mapped_histogram(lut)
+    expected_counts, expected_centers = stack_histogram(lut[images])
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_array_equal(centers, expected_centers)
+
+
+def test_integer_equalization_spans_range():
+    images = _images()
+    equalized = StreamingHistogram.from_stack(images).equalize(images, np.uint16)
+    assert equalized.dtype == np.uint16
+    assert equalized.max() == 65535
+
+
+def test_rejects_float_images():
+    with pytest.raises(ValueError):
+        StreamingHistogram(np.float32)
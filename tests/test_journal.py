@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+import tifffile
+
+from pylab.buffers import FrameRingBuffer
+from pylab.journal import StackJournal, read_journal, recover_stack
+from pylab.metadata import FrameMetadataBuffer, load_frame_metadata
+from pylab.stacks import VirtualStack
+from pylab.writers import FrameSavingThread, make_writer
+from tests.fakes import make_frames, run_writer
+
+
+def _crashed_session(filename, backend, frames_before_sync, frames_after_sync, **kwargs):
+    """Write frames with journaled syncs, then leave the files open as if the process had died"""
+    writer = make_writer(backend, filename, 100, **kwargs)
+    journal = StackJournal(filename, interval=0)
+    metadata = FrameMetadataBuffer(filename.split('.')[0] + '_frame_metadata.npy', 100)
+    frames = np.stack(make_frames(frames_before_sync + frames_after_sync, (8, 8)))
+    writer.open((8, 8), np.uint16)
+    journal.open(writer, backend, 100, (8, 8), np.uint16)
+    for i, frame in enumerate(frames):
+        metadata.record(i, {'ImageNumber': i}, 1.0 + i)
+        writer.write(frame[None])
+        if i + 1 == frames_before_sync:
+            journal.sync(writer, metadata)
+    return frames, writer
+
+
+def test_recover_preallocated_tiff():
+    frames, writer = _crashed_session('stack.tiff', 'memmap', 30, 5)
+    writer.flush() # pages that reached the disk after the last sync are dropped anyway
+    assert recover_stack('stack.tiff') == 30
+    np.testing.assert_array_equal(tifffile.imread('stack.tiff'), frames[:30])
+    assert len(load_frame_metadata('stack_frame_metadata.npy')['image_number']) == 30
+    assert read_journal('stack_journal.jsonl')[-1]['recovered']
+
+
+def test_recover_tiff_without_synced_frames():
+    frames, writer = _crashed_session('stack.tiff', 'memmap', 0, 5)
+    writer.flush()
+    assert recover_stack('stack.tiff') == 0
+    assert not os.path.exists('stack.tiff')
+    assert load_frame_metadata('stack_frame_metadata.npy')['image_number'].size == 0
+    record = read_journal('stack_journal.jsonl')[-1]
+    assert record == {**record, 'frames': 0, 'recovered': True}
+
+
+def test_recover_zarr_keeps_complete_chunks():
+    zarr = pytest.importorskip('zarr')
+    frames, writer = _crashed_session('stack.zarr', 'zarr', 20, 10)
+    assert recover_stack('stack.zarr') == 0 # chunks of 64 frames: nothing complete yet
+    frames, writer = _crashed_session('big.zarr', 'zarr', 70, 5)
+    assert recover_stack('big.zarr') == 64
+    np.testing.assert_array_equal(zarr.open('big.zarr', mode='r')[:], frames[:64])
+
+
+def test_recover_split_stack():
+    frames, writer = _crashed_session('stack.tiff', 'memmap', 25, 3, max_file_frames=10)
+    assert recover_stack('stack.tiff') == 25
+    with open('stack_manifest.json') as fh:
+        assert [part['frames'] for part in json.load(fh)['files']] == [10, 10, 5]
+    np.testing.assert_array_equal(VirtualStack('stack_manifest.json')[:], frames[:25])
+
+
+def test_journaled_writer_closes_cleanly():
+    run_writer(FrameRingBuffer(8, (16, 8)), make_frames(20), 'stack.tiff', batch_size=4, backend='memmap',
+                journal_interval=0.001)
+    records = read_journal('stack_journal.jsonl')
+    assert records[0]['backend'] == 'memmap'
+    assert records[-1] == {**records[-1], 'frames': 20, 'closed': True}
+    assert recover_stack('stack.tiff') == 20
+
+
+def test_journal_needs_a_recoverable_backend():
+    with pytest.raises(ValueError):
+        FrameSavingThread(FrameRingBuffer(2, (8, 8)), threading.Event(), 'stack.tiff', 10, journal_interval=1)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from pylab.metadata import FrameMetadataBuffer, load_frame_metadata
+
+
+def test_metadata_columns_round_trip():
+    metadata = FrameMetadataBuffer('frames_md.npy', num_frames=10)
+    for i in range(4):
+        metadata.record(i, {'ImageNumber': str(100 + i), 'ElapsedTime-ms': str(10.0 * i)}, host_time=1.5 + i)
+    metadata.record(4, {}, host_time=9.0)
+    metadata.flush()
+
+    # the file is readable while the buffer is still open
+    columns = load_frame_metadata('frames_md.npy')
+    np.testing.assert_array_equal(columns['frame_index'], np.arange(5))
+    np.testing.assert_array_equal(columns['image_number'][:4], [100, 101, 102, 103])
+    np.testing.assert_array_equal(columns['camera_time_ms'][:4], [0.0, 10.0, 20.0, 30.0])
+    assert np.isnan(columns['camera_time_ms'][4])
+    assert len(columns['unix_time']) == 5
+    metadata.close()
+
+
+def test_missing_tags_of_core_metadata_are_nan():
+    Metadata = pytest.importorskip('pymmcore_plus').Metadata
+    md = Metadata()
+    md['ImageNumber'] = '7' # no ElapsedTime-ms, as with some camera adapters
+    metadata = FrameMetadataBuffer('frames_md.npy', num_frames=2)
+    metadata.record(0, md, host_time=1.0)
+    metadata.record(1, Metadata(), host_time=2.0)
+    metadata.close()
+
+    columns = load_frame_metadata('frames_md.npy')
+    assert columns['image_number'][0] == 7
+    assert np.isnan(columns['image_number'][1])
+    assert np.isnan(columns['camera_time_ms']).all()
@@ -0,0 +1,22 @@
+import numpy as np
+
+from pylab.preview import LivePreview, downsample_frame
+
+
+def test_downsample_frame():
+    frame = np.arange(16, dtype=np.uint16).reshape(4, 4)
+    np.testing.assert_array_equal(downsample_frame(frame, 2), [[2, 4], [10, 12]])
+    np.testing.assert_array_equal(downsample_frame(frame, 2, 'stride'), [[0, 2], [8, 10]])
+
+
+def test_preview_is_throttled_and_never_blocks():
+    preview = LivePreview(max_fps=0.001, downsample=2)
+    assert preview.latest() is None
+    assert preview.offer(np.ones((4, 4), np.uint16))
+    assert not preview.offer(np.zeros((4, 4), np.uint16)) # not due yet
+    assert preview.latest().shape == (2, 2)
+    assert preview.latest() is None
+
+    preview = LivePreview(max_fps=1000)
+    with preview._lock: # display is reading the slot
+        assert not preview.offer(np.ones((4, 4), np.uint16))
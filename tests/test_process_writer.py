@@ -0,0 +1,65 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import tifffile
+
+from pylab.buffers import WriterFailedError
+from pylab.metadata import FrameMetadataBuffer, load_frame_metadata
+from pylab.process_writer import ProcessFrameWriter, SharedFrameRing
+from pylab.session import AcquisitionSession, CameraPipeline
+from tests.fakes import SessionCore
+
+
+def test_process_writer_writes_frames_from_shared_memory():
+    ring = SharedFrameRing(4, (8, 8))
+    writer = ProcessFrameWriter(ring, threading.Event(), 'stack.tiff', 10, batch_size=3, batch_timeout_ms=5)
+    writer.start()
+    for i in range(10):
+        ring.put(np.full((8, 8), i, np.uint16)) # more frames than slots: slots are handed back by the writer
+    writer.join()
+    assert writer.frames_written == 10
+    assert np.all(writer.write_times > 0)
+    writer.close()
+    stack = tifffile.imread('stack.tiff')
+    np.testing.assert_array_equal(stack[:, 0, 0], np.arange(10))
+
+
+def test_pipeline_with_writer_process():
+    pipeline = CameraPipeline('pupil', SessionCore([3, 3]), 'pupil.tiff', 6, batch_size=4, batch_timeout_ms=5,
+                              monitor_interval=0.01, writer_mode='process')
+    reports = AcquisitionSession([pipeline]).run()
+    assert reports['pupil']['no_dropped_frames']
+    assert sum(reports['pupil']['pump_to_disk_latency_ms']['counts']) == 6
+    assert tifffile.imread('pupil.tiff').shape == (6, 4, 4)
+
+
+def test_put_raises_when_the_writer_process_dies():
+    ring = SharedFrameRing(2, (8, 8))
+    writer = ProcessFrameWriter(ring, threading.Event(), 'stack.tiff', 10)
+    writer.start()
+    writer._process.kill()
+    writer._process.join()
+    with pytest.raises(WriterFailedError):
+        for i in range(10):
+            ring.put(np.full((8, 8), i, np.uint16))
+    assert ring.head <= 2
+    writer.close()
+
+
+def test_metadata_is_flushed_on_the_journal_interval():
+    ring = SharedFrameRing(4, (8, 8))
+    metadata = FrameMetadataBuffer('stack_frame_metadata.npy', 10)
+    writer = ProcessFrameWriter(ring, threading.Event(), 'stack.tiff', 10, backend='memmap', metadata=metadata,
+                                journal_interval=0.01)
+    writer.start()
+    for i in range(5):
+        metadata.record(i, {'ImageNumber': i}, 1.0 + i)
+        ring.put(np.full((8, 8), i, np.uint16))
+    deadline = time.perf_counter() + 5
+    while len(load_frame_metadata('stack_frame_metadata.npy')['frame_index']) < 5: # before the writer is joined
+        assert time.perf_counter() < deadline
+        time.sleep(0.01)
+    writer.join()
+    writer.close()
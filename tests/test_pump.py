@@ -0,0 +1,32 @@
+import numpy as np
+
+from pylab.metadata import FrameMetadataBuffer, load_frame_metadata
+from pylab.pump import FramePump
+from tests.fakes import FakeCore
+
+
+def test_pump_drains_bursts_in_order():
+    frames = []
+    pump = FramePump(FakeCore([0, 3, 0, 0, 5]), frames.append, num_frames=8)
+    assert pump.run() == 8
+    assert [int(f[0, 0]) for f in frames] == list(range(8))
+    assert pump.wakeups == 2
+    stats = pump.summary()
+    assert stats['frames'] == 8
+    assert stats['latency_max_ms'] >= 0
+
+
+def test_pump_stops_when_sequence_ends():
+    frames = []
+    pump = FramePump(FakeCore([2]), frames.append, num_frames=10)
+    assert pump.run() == 2
+
+
+def test_pump_records_frame_metadata():
+    metadata = FrameMetadataBuffer('md.npy', num_frames=4)
+    pump = FramePump(FakeCore([4]), lambda frame: None, num_frames=4, metadata=metadata)
+    pump.run()
+    metadata.close()
+    columns = load_frame_metadata('md.npy')
+    np.testing.assert_array_equal(columns['image_number'], [0, 1, 2, 3])
+    assert np.all(np.diff(columns['host_time']) >= 0)
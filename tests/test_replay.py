@@ -0,0 +1,65 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import tifffile
+
+from pylab.acquisition import load_session_config, run_session
+from pylab.metadata import FrameMetadataBuffer
+from pylab.replay import ReplayCore
+from pylab.session import CameraPipeline
+
+
+def _recorded_stack(filename, count=12, shape=(8, 6)):
+    frames = np.arange(count * shape[0] * shape[1], dtype=np.uint16).reshape((count,) + shape)
+    tifffile.imwrite(filename, frames, photometric='minisblack')
+    return frames
+
+
+def test_replayed_stack_streams_through_pipeline():
+    frames = _recorded_stack('recorded.tiff')
+    pipeline = CameraPipeline('replay', ReplayCore('recorded.tiff', fps=500), 'copy.tiff', len(frames),
+                              batch_size=4, batch_timeout_ms=5, monitor_interval=0.01)
+    pipeline.arm()
+    pipeline.start()
+    report = pipeline.run()
+    assert report['no_dropped_frames']
+    np.testing.assert_array_equal(tifffile.imread('copy.tiff'), frames)
+
+
+def test_replay_uses_recorded_frame_times():
+    _recorded_stack('recorded.tiff', count=4)
+    metadata = FrameMetadataBuffer('recorded_frame_metadata.npy', 4)
+    for i, host_time in enumerate([10.0, 10.01, 10.02, 10.04]):
+        metadata.record(i, {}, host_time)
+    metadata.close()
+    mmc = ReplayCore('recorded.tiff')
+    np.testing.assert_allclose(mmc.frame_times, [0, 0.01, 0.02, 0.04])
+    os.remove('recorded_frame_metadata.npy')
+    with pytest.raises(ValueError):
+        ReplayCore('recorded.tiff')
+
+
+def test_unpopped_frames_overflow_the_circular_buffer():
+    _recorded_stack('recorded.tiff', count=12, shape=(512, 512))
+    mmc = ReplayCore('recorded.tiff', fps=1000, loop=True, buffer_mb=2) # 4 frames
+    mmc.startContinuousSequenceAcquisition(0)
+    time.sleep(0.05)
+    mmc.stopSequenceAcquisition()
+    assert not mmc.isSequenceRunning()
+    assert mmc.getRemainingImageCount() == 4
+    assert mmc.isBufferOverflowed()
+    image, md = mmc.popNextImageAndMD()
+    assert int(md['ImageNumber']) > 12 # looped past the end of the stack
+    np.testing.assert_array_equal(image, tifffile.imread('recorded.tiff', key=int(md['ImageNumber']) % 12))
+    assert mmc.getRemainingImageCount() == 3
+
+
+def test_headless_session_replays_stack(tmpdir):
+    frames = _recorded_stack('recorded.tiff')
+    config = load_session_config(save_dir=str(tmpdir), num_frames=len(frames), batch_size=4, batch_ms=5,
+                                 replay='recorded.tiff', replay_fps=500)
+    reports = run_session(config)
+    assert reports['recorded']['no_dropped_frames']
+    assert reports['recorded']['frames_written'] == len(frames)
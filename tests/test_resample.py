@@ -0,0 +1,66 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from pylab.resample import label_index_map, nearest_index_map, resample_labels
+
+
+def _labels(shape=(37, 23)):
+    return np.random.default_rng(0).integers(1, 50, shape).astype(np.uint32) * 1000003
+
+
+@pytest.mark.parametrize('target_shape', [(74, 46), (100, 61), (13, 9), (37, 23)])
+def test_scaling_matches_nearest_neighbour_resize(target_shape):
+    transform = pytest.importorskip('skimage.transform')
+    labels = _labels()
+    expected = transform.resize(labels, target_shape, order=0, preserve_range=True, anti_aliasing=False)
+    resampled = resample_labels(labels, target_shape, cache_dir='maps')
+    assert resampled.dtype == labels.dtype
+    np.testing.assert_array_equal(resampled, expected.astype(labels.dtype))
+    assert set(np.unique(resampled)) <= set(np.unique(labels)) # no blended label IDs
+
+
+def test_affine_transform_fills_outside():
+    labels = _labels()
+    flip_and_shift = [[-1, 0, 36], [0, 1, 5], [0, 0, 1]] # target (row, col) -> source (36 - row, col + 5)
+    resampled = resample_labels(labels, (37, 23), flip_and_shift, fill=0, cache_dir='maps')
+    np.testing.assert_array_equal(resampled[:, :18], labels[::-1, 5:])
+    assert np.all(resampled[:, 18:] == 0)
+    with pytest.raises(ValueError):
+        nearest_index_map((4, 4), (4, 4), np.eye(2))
+
+
+def test_memory_mapped_volume_is_gathered_in_place():
+    volume = _labels((6, 37, 23))
+    np.save('annotation.npy', volume)
+    mapped = np.load('annotation.npy', mmap_mode='r')
+    resampled = resample_labels(mapped, (3, 13, 9), cache_dir='maps')
+    np.testing.assert_array_equal(resampled, resample_labels(volume, (3, 13, 9), cache_dir='maps'))
+
+
+def test_index_maps_are_cached():
+    index = label_index_map((37, 23), (512, 512), cache_dir='maps')
+    assert isinstance(index, np.memmap)
+    entries = os.listdir('maps')
+    again = label_index_map((37, 23), (512, 512), cache_dir='maps')
+    assert os.listdir('maps') == entries
+    assert again.filename == index.filename
+    label_index_map((37, 23), (256, 256), cache_dir='maps')
+    assert len(os.listdir('maps')) == len(entries) + 1
+
+
+def test_fortran_ordered_memmap_is_not_copied():
+    volume = np.asfortranarray(_labels((40, 30, 50)))
+    np.save('annotation.npy', volume)
+    mapped = np.load('annotation.npy', mmap_mode='r') # F-ordered, like an NRRD annotation volume
+    assert mapped.flags.f_contiguous and not mapped.flags.c_contiguous
+    expected = resample_labels(np.ascontiguousarray(volume), (10, 8, 12), cache_dir='maps')
+    resample_labels(mapped, (10, 8, 12), cache_dir='maps') # build the index map first
+    tracemalloc.start()
+    resampled = resample_labels(mapped, (10, 8, 12), cache_dir='maps')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    np.testing.assert_array_equal(resampled, expected)
+    assert peak < volume.nbytes / 2 # a copy of the volume alone would be volume.nbytes
@@ -0,0 +1,84 @@
+import errno
+import json
+
+import pytest
+import tifffile
+
+from pylab.buffers import WriterFailedError
+from pylab.session import AcquisitionSession, CameraPipeline
+from pylab.triggers import SoftwareTrigger
+from tests.fakes import SessionCore
+
+
+def test_cameras_run_in_parallel_from_one_trigger():
+    pipelines = [
+        CameraPipeline('widefield', SessionCore([4, 4], shape=(8, 8)), 'widefield.tiff', 8, batch_size=4,
+                       batch_timeout_ms=5, monitor_interval=0.01),
+        CameraPipeline('pupil', SessionCore([2, 2, 2]), 'pupil.tiff', 6, batch_size=4, batch_timeout_ms=5,
+                       monitor_interval=0.01),
+    ]
+    session = AcquisitionSession(pipelines)
+    with SoftwareTrigger() as trigger:
+        trigger.fire_after(0.02)
+        reports = session.run(trigger, timeout=1)
+
+    assert reports['widefield']['frames_written'] == 8
+    assert reports['pupil']['frames_written'] == 6
+    assert all(report['no_dropped_frames'] for report in reports.values())
+    assert all(pipeline.trigger_time == session.trigger_time for pipeline in pipelines)
+    assert tifffile.imread('widefield.tiff').shape == (8, 8, 8)
+    assert tifffile.imread('pupil.tiff').shape == (6, 4, 4)
+    with open('pupil_report.json') as fh:
+        assert json.load(fh)['camera'] == 'pupil'
+
+
+def test_session_times_out_without_trigger():
+    session = AcquisitionSession([CameraPipeline('pupil', SessionCore([2]), 'pupil.tiff', 2)])
+    with SoftwareTrigger() as trigger, pytest.raises(TimeoutError):
+        session.run(trigger, timeout=0.01)
+    assert not session.pipelines[0].saving_thread.is_alive()
+
+
+def test_interrupted_trigger_ends_every_writer():
+    class InterruptedTrigger:
+        def wait(self, timeout=None):
+            raise KeyboardInterrupt
+
+    pipelines = [CameraPipeline('widefield', SessionCore([2]), 'widefield.tiff', 2),
+                 CameraPipeline('pupil', SessionCore([2]), 'pupil.tiff', 2)]
+    with pytest.raises(KeyboardInterrupt):
+        AcquisitionSession(pipelines).run(InterruptedTrigger())
+    assert not any(pipeline.saving_thread.is_alive() for pipeline in pipelines)
+
+
+def test_failed_start_ends_every_writer():
+    class BrokenCore(SessionCore):
+        def startContinuousSequenceAcquisition(self, interval):
+            raise RuntimeError('camera not responding')
+
+    pipelines = [CameraPipeline('widefield', SessionCore([2]), 'widefield.tiff', 2),
+                 CameraPipeline('pupil', BrokenCore([2]), 'pupil.tiff', 2)]
+    with pytest.raises(RuntimeError, match='camera not responding'):
+        AcquisitionSession(pipelines).run()
+    assert pipelines[0].mmc.stopped
+    assert not any(pipeline.saving_thread.is_alive() for pipeline in pipelines)
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_failed_writer_stops_the_camera(monkeypatch):
+    def disk_full(self, block):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr('pylab.writers.TiffStackWriter.write', disk_full)
+    core = SessionCore([2] * 20)
+    # two ring slots: the pump blocks on the full ring once the writer is gone
+    pipeline = CameraPipeline('pupil', core, 'pupil.tiff', 40, batch_size=1, batch_timeout_ms=5,
+                              ring_buffer_mb=64 / 1024**2, monitor_interval=0.01)
+    with pytest.raises(WriterFailedError):
+        AcquisitionSession([pipeline]).run()
+    assert core.stopped
+    assert pipeline.stop_event.is_set()
+    assert not pipeline.saving_thread.is_alive()
+    assert pipeline.pump.frames_pumped < 40
+    with open('pupil_report.json') as fh:
+        assert 'No space left on device' in json.load(fh)['error']
@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import pytest
+import tifffile
+
+from pylab.buffers import FrameRingBuffer
+from pylab.stacks import VirtualStack, open_session_stack
+from tests.fakes import make_frames, run_writer
+
+
+@pytest.mark.parametrize('backend', ['tiff', 'memmap'])
+def test_rollover_splits_batches_at_file_boundaries(backend):
+    frames = make_frames(23)
+    run_writer(FrameRingBuffer(8, (16, 8)), frames, 'stack.tiff', batch_size=7, backend=backend,
+                max_file_frames=10)
+    with open('stack_manifest.json') as fh:
+        manifest = json.load(fh)
+    assert manifest['frames'] == 23
+    assert [(part['filename'], part['first_frame'], part['frames']) for part in manifest['files']] == [
+        ('stack_000.tiff', 0, 10), ('stack_001.tiff', 10, 10), ('stack_002.tiff', 20, 3)]
+    assert tifffile.imread('stack_002.tiff').shape == (3, 16, 8)
+
+
+def test_virtual_stack_reads_across_files():
+    frames = np.stack(make_frames(23))
+    frame_nbytes = frames[0].nbytes
+    run_writer(FrameRingBuffer(8, (16, 8)), list(frames), 'stack.tiff', batch_size=5,
+                max_file_bytes=8 * frame_nbytes + 1)
+    stack = open_session_stack('stack_manifest.json')
+    assert isinstance(stack, VirtualStack)
+    assert stack.shape == (23, 16, 8)
+    assert stack.locate(17) == (stack.files[2], 1)
+    np.testing.assert_array_equal(stack[17], frames[17])
+    np.testing.assert_array_equal(stack[-1], frames[-1])
+    np.testing.assert_array_equal(stack[5:20, 2:4], frames[5:20, 2:4])
+    np.testing.assert_array_equal(stack[::-3], frames[::-3])
+    np.testing.assert_array_equal(np.asarray(stack), frames)
@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pycromanager', 'pymmcore_plus', 'napari', 'nidaqmx', 'serial', 'requests', 'pandas', 'allensdk']
+
+
+def _heavy_imports(module):
+    probe = (f"import sys, json, importlib; importlib.import_module({module!r}); "
+             f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize('module', ['pylab.session', 'pylab.stacks', 'pylab.journal'])
+def test_pipeline_modules_import_without_heavy_dependencies(module):
+    assert _heavy_imports(module) == []
+
+
+@pytest.mark.parametrize('module, requires', [('pylab.__main__', 'click'), ('pylab.threaded_acquisition', 'qtpy')])
+def test_entry_points_defer_heavy_dependencies(module, requires):
+    pytest.importorskip(requires)
+    assert _heavy_imports(module) == []
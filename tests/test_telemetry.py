@@ -0,0 +1,35 @@
+import threading
+
+import numpy as np
+
+from pylab.buffers import FrameRingBuffer
+from pylab.pump import FramePump
+from pylab.telemetry import AcquisitionMonitor, frame_counter_gaps
+from pylab.writers import FrameSavingThread
+from tests.fakes import MonitoredCore
+
+
+def test_frame_counter_gaps():
+    assert frame_counter_gaps([1, 2, 3, 4]) == (0, 0)
+    assert frame_counter_gaps([1, 2, 5, 6, 8]) == (2, 3)
+
+
+def test_session_report_without_dropped_frames():
+    ring = FrameRingBuffer(4, (4, 4))
+    stop_event = threading.Event()
+    writer = FrameSavingThread(ring, stop_event, 'stack.tiff', 6, batch_size=2, batch_timeout_ms=5)
+    core = MonitoredCore([3, 3])
+    pump = FramePump(core, ring.put, 6)
+    monitor = AcquisitionMonitor(core, ring, pump, writer, interval=0.01)
+    writer.start()
+    monitor.start()
+    pump.run()
+    stop_event.set()
+    writer.join()
+    monitor.stop()
+
+    report = monitor.report(6, np.arange(6))
+    assert report['no_dropped_frames']
+    assert report['frames_written'] == 6
+    assert sum(report['pump_to_disk_latency_ms']['counts']) == 6
+    assert monitor.report(6, [0, 1, 2, 4, 5, 6])['dropped_frames'] == 1
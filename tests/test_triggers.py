@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from pylab.triggers import NIDAQTrigger, SoftwareTrigger
+
+
+def test_software_trigger_returns_the_edge_time():
+    with SoftwareTrigger() as trigger:
+        trigger.fire_after(0.02)
+        before = time.perf_counter()
+        edge_time = trigger.wait(timeout=1)
+    assert before < edge_time <= time.perf_counter()
+
+
+def test_missing_trigger_times_out():
+    with SoftwareTrigger() as trigger:
+        assert trigger.wait(timeout=0.01) is None
+
+
+class FakeTask:
+    """nidaqmx.Task stand-in for a device that refuses change detection when the task starts"""
+    tasks = []
+
+    def __init__(self, nidaqmx, read_error=None):
+        self.nidaqmx = nidaqmx
+        self.read_error = read_error
+        self.change_detection = False
+        self.closed = False
+        self.di_channels = self
+        self.timing = self
+        FakeTask.tasks.append(self)
+
+    def add_di_chan(self, lines):
+        pass
+
+    def cfg_change_detection_timing(self, **kwargs):
+        self.change_detection = True
+
+    def start(self):
+        if self.change_detection:
+            raise self.nidaqmx.DaqError("Change detection is not supported", -200077)
+
+    def read(self, **kwargs):
+        if self.read_error is not None:
+            raise self.read_error
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def nidaqmx(monkeypatch):
+    nidaqmx = pytest.importorskip('nidaqmx')
+    FakeTask.tasks = []
+    monkeypatch.setattr(nidaqmx, 'Task', lambda: FakeTask(nidaqmx))
+    return nidaqmx
+
+
+def test_trigger_polls_when_change_detection_fails_at_start(nidaqmx):
+    with NIDAQTrigger() as trigger:
+        assert not trigger.change_detection
+        assert trigger.wait(timeout=1) is not None
+    first, second = FakeTask.tasks
+    assert first.closed and second.closed
+
+
+@pytest.mark.parametrize('error_code, times_out', [(-200284, True), (-200088, False)])
+def test_only_read_timeouts_end_the_wait(nidaqmx, error_code, times_out):
+    trigger = NIDAQTrigger()
+    trigger.change_detection = True
+    trigger.task = FakeTask(nidaqmx, read_error=nidaqmx.DaqError("read failed", error_code))
+    if times_out:
+        assert trigger.wait(timeout=0.01) is None
+    else:
+        with pytest.raises(nidaqmx.DaqError):
+            trigger.wait(timeout=0.01)
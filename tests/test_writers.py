@@ -0,0 +1,78 @@
+import queue
+import shutil
+import threading
+
+import numpy as np
+import pytest
+import tifffile
+
+from pylab.buffers import FrameRingBuffer
+from pylab.stacks import TiffPages, open_stack_file
+from pylab.writers import FrameSavingThread, TiffStackWriter
+from tests.fakes import make_frames, run_writer
+
+
+def test_batched_tiff_from_ring_buffer_is_one_series():
+    frames = make_frames(50)
+    writer = run_writer(FrameRingBuffer(8, (16, 8)), frames, 'ring.tiff', batch_size=6)
+    assert writer.frames_written == 50
+    with tifffile.TiffFile('ring.tiff') as tif:
+        assert len(tif.series) == 1
+        stack = tif.asarray()
+    np.testing.assert_array_equal(stack, np.stack(frames))
+
+
+def test_tiff_written_as_one_series_can_be_memory_mapped():
+    frames = make_frames(20)
+    run_writer(FrameRingBuffer(8, (16, 8)), frames, 'per_batch.tiff', batch_size=4)
+    run_writer(FrameRingBuffer(8, (16, 8)), frames, 'one_series.tiff', batch_size=4, series_frames=20)
+    assert isinstance(open_stack_file('per_batch.tiff'), TiffPages)
+    np.testing.assert_array_equal(open_stack_file('one_series.tiff'), np.stack(frames))
+    assert isinstance(open_stack_file('one_series.tiff'), np.memmap)
+
+
+def test_batched_tiff_from_queue():
+    frames = make_frames(10)
+    run_writer(queue.Queue(), frames, 'queue.tiff', batch_size=4, batch_timeout_ms=5)
+    np.testing.assert_array_equal(tifffile.imread('queue.tiff'), np.stack(frames))
+
+
+@pytest.mark.parametrize('series_frames, readable', [(None, 73), (32, 65)])
+def test_tiff_pages_of_closed_series_survive_a_crash(series_frames, readable):
+    writer = TiffStackWriter('stack.tiff', series_frames=series_frames)
+    writer.open((4, 4), np.uint16)
+    for i in range(10):
+        writer.write(np.full((8, 4, 4), i, np.uint16))
+    shutil.copy('stack.tiff', 'crashed.tiff') # the file as a crash would leave it
+    writer.close()
+    with tifffile.TiffFile('crashed.tiff') as tif:
+        assert len(tif.pages) == readable
+    np.testing.assert_array_equal(tifffile.imread('stack.tiff')[:, 0, 0], np.repeat(np.arange(10), 8))
+
+
+def test_memmap_backend_preallocates_and_truncates_on_early_stop():
+    frames = make_frames(7)
+    writer = run_writer(FrameRingBuffer(4, (16, 8)), frames, 'mm.tiff', batch_size=3, backend='memmap')
+    assert writer.writer.num_frames == 7
+    np.testing.assert_array_equal(tifffile.memmap('mm.tiff', mode='r'), np.stack(frames))
+
+    stop_event = threading.Event()
+    ring = FrameRingBuffer(4, (16, 8))
+    writer = FrameSavingThread(ring, stop_event, 'short.tiff', 20, batch_size=3, backend='memmap')
+    writer.start()
+    for frame in frames:
+        ring.put(frame)
+    stop_event.set()
+    writer.join()
+    with tifffile.TiffFile('short.tiff') as tif:
+        assert len(tif.pages) == 7
+        np.testing.assert_array_equal(tif.asarray(), np.stack(frames))
+
+
+def test_zarr_backend_writes_compressed_chunks():
+    zarr = pytest.importorskip('zarr')
+    pytest.importorskip('numcodecs')
+    frames = make_frames(10)
+    writer = run_writer(FrameRingBuffer(4, (16, 8)), frames, 'stack.zarr', batch_size=3, backend='zarr')
+    assert writer.writer.compression_ratio() > 1
+    np.testing.assert_array_equal(zarr.open('stack.zarr', mode='r')[:], np.stack(frames))